@@ -1,17 +1,38 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for, current_app
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, current_app, Response
 from datetime import datetime, timedelta
 import pytz
 from dotenv import load_dotenv
 import os
-from telegram import Bot, Update, WebAppInfo, KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
-import asyncio
-import threading
+import hmac
 import json
 import logging
+import threading
+import time
 from functools import wraps
+from assets import StaticAssets
+from categories import (
+    category_payload, create_categories, list_param, rename_categories, reorder_categories, set_archived
+)
+from category_cache import category_cache
+from events import broker, format_sse, init_events, notify_user_changed
+from json_provider import FastJSONProvider, compact_number
+from log_sampling import sampled_debug
+from ratelimit import RateLimiting
+from models import db, User, Category, Activity, Achievement
+from profiling import profiler
+from pagination import decode_cursor, encode_cursor, parse_datetime_param, parse_limit
+from schema import upgrade_schema
+import sharding
+from search import search_activities, setup_search
+from dialect import resolve_timezone
+from health import check_ready, warm_pool
+from heartbeat import HEARTBEAT_INTERVAL, heartbeats
+from heatmap import get_heatmap
+from reports import get_report, local_today, parse_range, parse_report_period
+from stats_cache import stats_cache
+from sync import backfill_updated_at, changes_since, prune_tombstones
+from teams import find_team, get_team_report, is_member, parse_period, user_teams
+from tracking import AlreadyFinished, backfill_durations, finish_activity as close_activity, finished_payload
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -30,11 +51,12 @@ database_url = os.getenv('DATABASE_URL')
 if database_url:
     if database_url.startswith('postgres://'):
         database_url = database_url.replace('postgres://', 'postgresql://', 1)
-    if '?' not in database_url:
+    if database_url.startswith('postgresql') and '?' not in database_url:
         database_url += '?sslmode=require'
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'sqlite:///pixel_tracker.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+sharding.configure(app)
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,
     'pool_recycle': 300,
@@ -42,211 +64,103 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'max_overflow': 10
 }
 
-if database_url:
+if database_url and database_url.startswith('postgresql'):
     app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {
         'sslmode': 'require'
     }
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+app.json = FastJSONProvider(app)
+assets = StaticAssets(app)
 
-# Декоратор для работы с контекстом приложения
-def with_app_context(f):
-    @wraps(f)
-    async def decorated_function(*args, **kwargs):
-        with app.app_context():
-            return await f(*args, **kwargs)
-    return decorated_function
+db.init_app(app)
+sharding.init_app(app)
+if os.getenv('FLASK_RUN_FROM_CLI'):
+    # Flask-Migrate тянет alembic (~0.3 с импорта) и нужен только командам
+    # `flask db`; флаг выставляет CLI Flask до загрузки приложения
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
+init_events(app, db)
+rate_limiting = RateLimiting(app, route_classes={
+    'start_activity': 'write',
+    'finish_activity': 'write',
+    'update_theme': 'write',
+    'update_notifications': 'write',
+    'update_daily_goal': 'write',
+    'update_break_reminder': 'write',
+    'update_timezone': 'write',
+    'bulk_create_categories': 'write',
+    'bulk_rename_categories': 'write',
+    'bulk_archive_categories': 'write',
+    'bulk_reorder_categories': 'write',
+    'get_daily_stats': 'stats',
+    'get_category_stats': 'stats',
+    'get_heatmap_stats': 'stats',
+    'get_reports': 'stats',
+    'get_insights': 'stats',
+    'list_activities': 'stats',
+    'sync_changes': 'stats',
+    'list_teams': 'stats',
+    'get_team_stats': 'stats',
+    'search': 'stats',
+    'stream_events': 'stream',
+})
 
-# Обработчики команд Telegram
-@with_app_context
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    db_user = User.query.filter_by(telegram_id=user.id).first()
-    
-    if not db_user:
-        db_user = User(telegram_id=user.id, username=user.username)
-        db.session.add(db_user)
-        db.session.commit()
-        
-        # Создаем категории по умолчанию
-        default_categories = [
-            Category(name="Работа", user_id=db_user.id),
-            Category(name="Учеба", user_id=db_user.id),
-            Category(name="Отдых", user_id=db_user.id),
-            Category(name="Спорт", user_id=db_user.id),
-            Category(name="Другое", user_id=db_user.id)
-        ]
-        db.session.add_all(default_categories)
-        db.session.commit()
-    
-    await update.message.reply_text(
-        f"Привет, {user.first_name}! Я бот для отслеживания времени. "
-        "Используйте /help для просмотра доступных команд."
-    )
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /help"""
-    help_text = (
-        "🔍 *Доступные команды:*\n\n"
-        "/start - Начать работу с ботом\n"
-        "/stats - Показать статистику\n"
-        "/profile - Информация о профиле\n"
-        "/settings - Настройки уведомлений\n\n"
-        "📱 Используйте кнопку 'Открыть трекер' для доступа к основному интерфейсу."
-    )
-    await update.message.reply_text(help_text, parse_mode='Markdown')
-
-async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /stats"""
-    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-    if not user:
-        await update.message.reply_text("Пользователь не найден. Используйте /start для начала работы.")
-        return
-    
-    # Получаем статистику за сегодня
-    today = datetime.now(pytz.UTC).date()
-    today_activities = Activity.query.filter(
-        Activity.user_id == user.id,
-        db.func.date(Activity.start_time) == today
-    ).all()
-    
-    total_today = sum(activity.duration or 0 for activity in today_activities) // 60
-    
-    stats_text = (
-        f"📊 *Статистика за сегодня:*\n\n"
-        f"⏱ Общее время: {total_today} минут\n"
-        f"📝 Количество активностей: {len(today_activities)}\n"
-        f"🎯 Цель на день: {user.daily_goal} минут\n"
-        f"✨ Текущий уровень: {user.level}\n"
-        f"⭐️ Опыт: {user.xp} XP"
-    )
-    
-    await update.message.reply_text(stats_text, parse_mode='Markdown')
-
-async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /settings"""
-    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
-    if not user:
-        await update.message.reply_text("Пользователь не найден. Используйте /start для начала работы.")
-        return
-    
-    settings_text = (
-        f"⚙️ *Текущие настройки:*\n\n"
-        f"🔔 Уведомления: {'включены' if user.notifications else 'выключены'}\n"
-        f"🎯 Цель на день: {user.daily_goal} минут\n"
-        f"⏰ Напоминание о перерыве: каждые {user.break_reminder} минут\n"
-        f"🎨 Тема: {user.theme}\n\n"
-        "Для изменения настроек используйте веб-интерфейс."
-    )
-    
-    await update.message.reply_text(settings_text, parse_mode='Markdown')
+profiler.init_app(app)
+heartbeats.init_app(app, db)
 
-# Инициализация бота
-def init_bot():
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not token:
-        raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
-        
-    application = Application.builder().token(token).build()
-    
-    # Добавляем обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CommandHandler("settings", settings_command))
-    
-    return application
-
-# Создаем экземпляр бота
-application = init_bot()
-
-class User(db.Model):
-    __tablename__ = 'users'
-    id = db.Column(db.Integer, primary_key=True)
-    telegram_id = db.Column(db.BigInteger, unique=True)
-    username = db.Column(db.String(80))
-    first_name = db.Column(db.String(80))
-    last_name = db.Column(db.String(80))
-    level = db.Column(db.Integer, default=1)
-    xp = db.Column(db.Integer, default=0)
-    theme = db.Column(db.String(20), default='light')
-    notifications = db.Column(db.Boolean, default=True)
-    daily_goal = db.Column(db.Integer, default=120)  # Цель в минутах
-    break_reminder = db.Column(db.Integer, default=60)  # Напоминание о перерыве каждые X минут
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    activities = db.relationship('Activity', backref='user', lazy=True)
-    categories = db.relationship('Category', backref='user', lazy=True)
-    achievements = db.relationship('Achievement', backref='user', lazy=True)
-
-    def calculate_level(self):
-        new_level = 1 + (self.xp // 1000)
-        if new_level > self.level:
-            self.level = new_level
-            return True
-        return False
-
-    def add_xp(self, amount):
-        self.xp += amount
-        if self.calculate_level():
-            asyncio.run(self.notify_level_up())
-        db.session.commit()
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = 300  # Клиент переподключается сам, это ограничивает занятость потока
+# Каждый поток SSE держит поток воркера (gthread/waitress) до SSE_MAX_STREAM_SECONDS.
+# Ограничиваем их четвертью потоков, чтобы открытые Mini App не заняли все
+# потоки и API продолжало отвечать; без блокировки потоки держит asgi.py.
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', max(1, int(os.getenv('WEB_THREADS', 32)) // 4)))
+SSE_RETRY_AFTER = 30
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+sse_metrics = {'rejected': 0}
 
-    async def notify_level_up(self):
-        if self.notifications:
-            await bot.send_message(
-                chat_id=self.telegram_id,
-                text=f'🎉 Поздравляем! Вы достигли уровня {self.level}!'
-            )
+def admin_required(f):
+    """Служебные маршруты: доступ по заголовку Authorization: Bearer <ADMIN_TOKEN>.
 
-class Category(db.Model):
-    __tablename__ = 'categories'
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(80), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    activities = db.relationship('Activity', backref='category', lazy=True)
-
-class Activity(db.Model):
-    __tablename__ = 'activities'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
-    name = db.Column(db.String(100), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False)
-    end_time = db.Column(db.DateTime)
-    duration = db.Column(db.Integer)  # в секундах
-    notes = db.Column(db.Text)
-    productivity = db.Column(db.Integer)  # Оценка продуктивности (1-5)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class Achievement(db.Model):
-    __tablename__ = 'achievements'
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.String(200), nullable=False)
-    icon = db.Column(db.String(50), nullable=False)
-    earned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    Если ADMIN_TOKEN не задан, маршрут считается несуществующим.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        admin_token = os.getenv('ADMIN_TOKEN')
+        if not admin_token:
+            return jsonify({'error': 'Not found'}), 404
+        auth = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth.encode(), f"Bearer {admin_token}".encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
 
 def init_db():
-    with app.app_context():
+    """Создает и докатывает схему на всех шардах"""
+    for shard in range(sharding.shard_count()):
+        init_shard(shard)
+
+def init_shard(shard):
+    with sharding.on_shard(app, shard):
         try:
             # Логируем URL базы данных (без пароля)
-            db_url = os.getenv('DATABASE_URL', '')
-            if db_url:
-                masked_url = db_url.replace(db_url.split('@')[0].split(':')[2], '****')
-                logger.info(f"Attempting to connect to database: {masked_url}")
+            if os.getenv('DATABASE_URL'):
+                # repr(URL) скрывает пароль
+                logger.info(f"Attempting to connect to database: {db.engine.url!r}")
             else:
-                logger.error("DATABASE_URL not found in environment variables")
-                return
+                logger.warning("DATABASE_URL not found in environment variables, using local SQLite database")
             
-            # Проверяем подключение к базе данных
-            db.engine.connect()
+            # Проверяем подключение к базе данных (и возвращаем его в пул)
+            with db.engine.connect() as conn:
+                conn.execute(db.text('SELECT 1'))
             logger.info("Database connection successful")
             
             # Создаем таблицы
             db.create_all()
+            upgrade_schema(db)
+            backfill_durations(db)
+            backfill_updated_at(db)
+            prune_tombstones(db)
+            setup_search(db)
             logger.info("Database tables created successfully")
             
             try:
@@ -269,10 +183,50 @@ def init_db():
             logger.error(f"Error initializing database: {str(e)}")
             raise
 
+@app.cli.command('init-db')
+def init_db_command():
+    """Создает и докатывает схему (один раз перед запуском воркеров)"""
+    init_db()
+
+def load_insights():
+    # NumPy (~0.15 с импорта) загружается при первом запросе аналитики
+    from insights import insights_cache
+    return insights_cache
+
+@app.route('/healthz')
+def healthz():
+    """Живость процесса: без обращения к базе"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Готовность: SELECT 1 через пул на каждом шарде с таймаутом"""
+    ready, error = check_ready(app, db)
+    if not ready:
+        logger.warning(f"Readiness check failed: {error}")
+        return jsonify({'status': 'unavailable', 'error': error}), 503
+    return jsonify({'status': 'ok'})
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def user_payload(db_user):
+    return {
+        'id': db_user.id, # Возвращаем внутренний ID базы данных
+        'telegram_id': db_user.telegram_id, # Также возвращаем telegram_id
+        'username': db_user.username,
+        'first_name': db_user.first_name,
+        'last_name': db_user.last_name,
+        'level': db_user.level,
+        'xp': db_user.xp,
+        'theme': db_user.theme,
+        'notifications': db_user.notifications,
+        'daily_goal': db_user.daily_goal,
+        'break_reminder': db_user.break_reminder,
+        'timezone': db_user.timezone
+    }
+
 @app.route('/api/user', methods=['GET'])
 def get_user():
     try:
@@ -283,7 +237,6 @@ def get_user():
             
         try:
             user = json.loads(user_data)
-            logger.info(f"Received user data: {user}")
         except json.JSONDecodeError:
             logger.error("Invalid JSON data received in /api/user")
             return jsonify({'error': 'Invalid JSON data'}), 400
@@ -319,30 +272,67 @@ def get_user():
                 db.session.rollback() # Откатываем добавление категорий в случае ошибки
                 logger.error(f"Error creating default categories for user {telegram_id}: {str(cat_e)}")
 
-        else:
-             logger.info(f"User {telegram_id} found.")
-
         # --- ОБНОВЛЯЕМ ВОЗВРАЩАЕМЫЕ ДАННЫЕ ---
-        response_data = {
-            'id': db_user.id, # Возвращаем внутренний ID базы данных
-            'telegram_id': db_user.telegram_id, # Также возвращаем telegram_id
-            'username': db_user.username,
-            'first_name': db_user.first_name,
-            'last_name': db_user.last_name,
-            'level': db_user.level,
-            'xp': db_user.xp,
-            'theme': db_user.theme,
-            'notifications': db_user.notifications,
-            'daily_goal': db_user.daily_goal,
-            'break_reminder': db_user.break_reminder
-        }
-        logger.info(f"Returning user data for {telegram_id}: {response_data}")
+        response_data = user_payload(db_user)
+        sampled_debug(logger, "Returning user data for %s: %s", telegram_id, response_data)
         return jsonify(response_data)
 
     except Exception as e:
         logger.error(f"Unexpected error in get_user: {str(e)}")
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """SSE-поток событий пользователя: старт/стоп активностей и версия данных"""
+    user_data = request.args.get('user')
+    if not user_data:
+        return jsonify({'error': 'No user data'}), 400
+        
+    try:
+        user = json.loads(user_data)
+    except json.JSONDecodeError:
+        return jsonify({'error': 'Invalid JSON data'}), 400
+        
+    telegram_id = user.get('id')
+    if not telegram_id:
+        return jsonify({'error': 'No Telegram ID'}), 400
+        
+    db_user = User.query.filter_by(telegram_id=telegram_id).first()
+    if not db_user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    if not sse_slots.acquire(blocking=False):
+        sse_metrics['rejected'] += 1
+        response = jsonify({'error': 'Too many event streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_RETRY_AFTER)
+        return response
+    
+    # Подписываемся до отдачи ответа, чтобы не потерять события между запросом версии и стримом
+    subscription = broker.subscribe(telegram_id)
+    version = db_user.data_version
+    
+    def close():
+        subscription.close()
+        sse_slots.release()
+    
+    def generate():
+        yield 'retry: 3000\n\n'
+        yield format_sse('stats', app.json.dumps({'version': version}))
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+            if message is None:
+                yield ': ping\n\n'
+                continue
+            yield format_sse(message['event'], app.json.dumps(message['data']))
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(close)
+    return response
+
 @app.route('/api/stats/daily', methods=['GET'])
 def get_daily_stats():
     try:
@@ -364,21 +354,27 @@ def get_daily_stats():
             return jsonify({'error': 'User not found'}), 404
             
         today = datetime.now(pytz.UTC).date()
-        activities = Activity.query.filter(
-            Activity.user_id == db_user.id,
-            db.func.date(Activity.start_time) == today
-        ).all()
         
-        total_time = sum((activity.end_time - activity.start_time).total_seconds() / 60 
-                        for activity in activities if activity.end_time) if activities else 0
-        total_tasks = len(activities)
-        productivity = sum(activity.productivity for activity in activities) / total_tasks if total_tasks > 0 else 0
+        def compute():
+            total_tasks, total_seconds, productivity_sum = db.session.query(
+                db.func.count(Activity.id),
+                db.func.coalesce(db.func.sum(Activity.duration), 0),
+                db.func.coalesce(db.func.sum(Activity.productivity), 0)
+            ).filter(
+                Activity.user_id == db_user.id,
+                db.func.date(Activity.start_time) == today
+            ).one()
+            
+            total_time = total_seconds / 60
+            productivity = productivity_sum / total_tasks if total_tasks > 0 else 0
+            
+            return {
+                'total_time': compact_number(total_time),
+                'total_tasks': total_tasks,
+                'productivity': round(productivity, 1)
+            }
         
-        return jsonify({
-            'total_time': total_time,
-            'total_tasks': total_tasks,
-            'productivity': round(productivity, 1)
-        })
+        return jsonify(stats_cache.get_or_compute('daily', db_user, compute, (today,)))
     except Exception as e:
         logger.error(f"Error in get_daily_stats: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -403,28 +399,468 @@ def get_category_stats():
         if not db_user:
             return jsonify({'error': 'User not found'}), 404
             
-        categories = Category.query.filter_by(user_id=db_user.id).all()
-        stats = []
+        def compute():
+            rows = db.session.query(
+                Category.id,
+                Category.name,
+                Category.position,
+                Category.archived,
+                db.func.coalesce(db.func.sum(Activity.duration), 0),
+                db.func.count(Activity.id)
+            ).outerjoin(
+                Activity, (Activity.category_id == Category.id) & (Activity.user_id == db_user.id)
+            ).filter(
+                Category.user_id == db_user.id
+            ).group_by(
+                Category.id, Category.name, Category.position, Category.archived
+            ).order_by(Category.position, Category.id).all()
+            
+            return [
+                {'id': id_, 'name': name, 'position': position, 'archived': archived,
+                 'total_time': total_time, 'total_tasks': total_tasks}
+                for id_, name, position, archived, total_time, total_tasks in rows
+            ]
         
-        for category in categories:
-            activities = Activity.query.filter_by(
-                user_id=db_user.id,
-                category_id=category.id
-            ).all()
+        return jsonify(stats_cache.get_or_compute('categories', db_user, compute))
+    except Exception as e:
+        logger.error(f"Error in get_category_stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/categories', methods=['GET'])
+def list_categories():
+    """Категории пользователя (и архивные) в порядке position"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
             
-            total_time = sum(activity.duration for activity in activities)
-            total_tasks = len(activities)
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
             
-            stats.append({
-                'id': category.id,
-                'name': category.name,
-                'total_time': total_time,
-                'total_tasks': total_tasks
-            })
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
         
-        return jsonify(stats)
+        return jsonify({'categories': [category_payload(category) for category in category_cache.get(db_user)]})
     except Exception as e:
-        logger.error(f"Error in get_category_stats: {str(e)}")
+        logger.error(f"Error in list_categories: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def change_categories(name, operation):
+    """Общая часть массовых операций: пользователь из тела запроса, ошибки, событие"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_data = data.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+        
+        try:
+            user = json.loads(user_data) if isinstance(user_data, str) else user_data
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+        
+        telegram_id = user.get('id') if isinstance(user, dict) else None
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+        
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        try:
+            categories = operation(db_user, data)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        except LookupError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 404
+        
+        payload = [category_payload(category) for category in categories]
+        notify_user_changed(db_user, 'categories_changed', {'categories': payload})
+        return jsonify({'categories': payload})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error in {name}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/categories', methods=['POST'])
+def bulk_create_categories():
+    """Создает категории из списка names"""
+    return change_categories('bulk_create_categories', lambda db_user, data: create_categories(
+        db, db_user, list_param(data, 'names')
+    ))
+
+@app.route('/api/categories/rename', methods=['POST'])
+def bulk_rename_categories():
+    """Переименовывает категории: categories = [{id, name}, ...]"""
+    def rename(db_user, data):
+        items = list_param(data, 'categories')
+        if not all(isinstance(item, dict) for item in items):
+            raise ValueError("'categories' must be a list of {id, name}")
+        return rename_categories(db, db_user, [(item.get('id'), item.get('name')) for item in items])
+    return change_categories('bulk_rename_categories', rename)
+
+@app.route('/api/categories/archive', methods=['POST'])
+def bulk_archive_categories():
+    """Архивирует категории ids (archived: false - возвращает из архива)"""
+    return change_categories('bulk_archive_categories', lambda db_user, data: set_archived(
+        db, db_user, list_param(data, 'ids'), bool(data.get('archived', True))
+    ))
+
+@app.route('/api/categories/reorder', methods=['POST'])
+def bulk_reorder_categories():
+    """Ставит категории ids в начало списка в указанном порядке"""
+    return change_categories('bulk_reorder_categories', lambda db_user, data: reorder_categories(
+        db, db_user, list_param(data, 'ids')
+    ))
+
+@app.route('/api/stats/heatmap', methods=['GET'])
+def get_heatmap_stats():
+    """Минуты и средняя продуктивность по часам недели (7x24) для каждой категории"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+        
+        days = max(1, min(request.args.get('days', 90, type=int), 366))
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # Зона по умолчанию - из настроек пользователя
+        try:
+            tz_name = resolve_timezone(request.args.get('tz') or db_user.timezone).zone
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(get_heatmap(db, db_user, tz_name, days))
+    except Exception as e:
+        logger.error(f"Error in get_heatmap_stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reports', methods=['GET'])
+def get_reports():
+    """Суммы времени по дням, неделям, месяцам или годам за диапазон from..to (YYYY-MM-DD)"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+        
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # Зона по умолчанию - из настроек пользователя
+        tz_name = request.args.get('tz') or db_user.timezone
+        try:
+            tz_name = resolve_timezone(tz_name).zone
+            period = parse_report_period(request.args.get('period'))
+            first, last = parse_range(
+                period, request.args.get('from'), request.args.get('to'),
+                today=local_today(tz_name), count=request.args.get('count', type=int)
+            )
+            return jsonify(get_report(db, db_user, period, first, last, tz_name))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in get_reports: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stats/insights', methods=['GET'])
+def get_insights():
+    """Скользящие средние, перцентили, лучшие часы и тренды по категориям"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+        
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # Зона по умолчанию - из настроек пользователя
+        try:
+            tz_name = resolve_timezone(request.args.get('tz') or db_user.timezone).zone
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(stats_cache.get_or_compute(
+            'insights', db_user, lambda: load_insights().get(db, db_user, tz_name),
+            (tz_name, datetime.utcnow().date())
+        ))
+    except Exception as e:
+        logger.error(f"Error in get_insights: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def activity_payload(activity):
+    return {
+        'id': activity.id,
+        'category_id': activity.category_id,
+        'name': activity.name,
+        'start_time': activity.start_time,
+        'end_time': activity.end_time,
+        'duration': activity.duration,
+        'notes': activity.notes,
+        'productivity': activity.productivity,
+        'updated_at': activity.updated_at
+    }
+
+@app.route('/api/activities', methods=['GET'])
+def list_activities():
+    """История активностей с keyset-пагинацией по (start_time, id), новые первыми"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+        
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            category_id = request.args.get('category_id', type=int)
+            date_from = parse_datetime_param(request.args.get('from'))
+            date_to = parse_datetime_param(request.args.get('to'))
+            cursor = request.args.get('cursor')
+            position = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+            
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        query = Activity.query.filter(Activity.user_id == db_user.id)
+        if category_id is not None:
+            query = query.filter(Activity.category_id == category_id)
+        if date_from is not None:
+            query = query.filter(Activity.start_time >= date_from)
+        if date_to is not None:
+            query = query.filter(Activity.start_time < date_to)
+        if position is not None:
+            query = query.filter(db.tuple_(Activity.start_time, Activity.id) < position)
+        
+        # Берем на одну запись больше, чтобы узнать, есть ли следующая страница
+        activities = query.order_by(
+            Activity.start_time.desc(), Activity.id.desc()
+        ).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(activities) > limit:
+            activities = activities[:limit]
+            last = activities[-1]
+            next_cursor = encode_cursor(last.start_time, last.id)
+        
+        return jsonify({
+            'items': [activity_payload(activity) for activity in activities],
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        logger.error(f"Error in list_activities: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """Изменения после токена since: профиль, категории, активности и удаления"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+            
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        try:
+            changes = changes_since(db, db_user, request.args.get('since'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'user': user_payload(changes['user']) if changes['user'] else None,
+            'categories': [
+                {**category_payload(category), 'updated_at': category.updated_at}
+                for category in changes['categories']
+            ],
+            'activities': [activity_payload(activity) for activity in changes['activities']],
+            'deleted': [
+                {'type': tombstone.entity, 'id': tombstone.entity_id, 'deleted_at': tombstone.deleted_at}
+                for tombstone in changes['tombstones']
+            ],
+            'token': changes['token'],
+            'has_more': changes['has_more'],
+            'reset': changes['reset']
+        })
+    except Exception as e:
+        logger.error(f"Error in sync_changes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teams', methods=['GET'])
+def list_teams():
+    """Команды групповых чатов, в которых состоит пользователь"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+            
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        return jsonify([
+            {'chat_id': team.chat_id, 'title': team.title}
+            for team in user_teams(db_user)
+        ])
+    except Exception as e:
+        logger.error(f"Error in list_teams: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/teams/<int(signed=True):chat_id>/stats', methods=['GET'])
+def get_team_stats(chat_id):
+    """Итоги команды по участникам и категориям за последние days дней"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+        
+        try:
+            days = parse_period(request.args.get('days'))
+        except ValueError:
+            return jsonify({'error': 'Invalid period'}), 400
+            
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # Отчет видят только участники команды
+        team = find_team(chat_id)
+        if not team or not is_member(db, team, db_user):
+            return jsonify({'error': 'Team not found'}), 404
+        
+        return jsonify(get_team_report(db, team, days))
+    except Exception as e:
+        logger.error(f"Error in get_team_stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Поиск по названиям и заметкам активностей, по убыванию релевантности"""
+    try:
+        user_data = request.args.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        try:
+            user = json.loads(user_data)
+        except json.JSONDecodeError:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+            
+        telegram_id = user.get('id')
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+        
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'No search query'}), 400
+        
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            offset = max(0, int(request.args.get('offset', 0)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+            
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        results = search_activities(db, db_user.id, query, limit=limit + 1, offset=offset)
+        has_more = len(results) > limit
+        results = results[:limit]
+        
+        activities = {
+            activity.id: activity
+            for activity in Activity.query.filter(Activity.id.in_([activity_id for activity_id, _ in results])).all()
+        }
+        items = []
+        for activity_id, rank in results:
+            if activity_id in activities:
+                item = activity_payload(activities[activity_id])
+                item['rank'] = float(rank)
+                items.append(item)
+        
+        return jsonify({
+            'items': items,
+            'next_offset': offset + limit if has_more else None
+        })
+    except Exception as e:
+        logger.error(f"Error in search: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/activity/start', methods=['POST'])
@@ -449,16 +885,29 @@ def start_activity():
         category = Category.query.get(category_id)
         if not category or category.user_id != db_user.id:
             return jsonify({'error': 'Category not found'}), 404
+        if category.archived:
+            return jsonify({'error': 'Category is archived'}), 400
         
+        now = datetime.now(pytz.UTC)
         activity = Activity(
             user_id=db_user.id,
             category_id=category_id,
             name=data.get('name', 'Новая активность'),
-            start_time=datetime.now(pytz.UTC)
+            start_time=now,
+            # Без отметки таймер, брошенный до первого пинга, никогда не закроется
+            last_heartbeat=now.replace(tzinfo=None)
         )
         db.session.add(activity)
+        db_user.touch()
         db.session.commit()
         
+        notify_user_changed(db_user, 'activity_started', {
+            'id': activity.id,
+            'category_id': activity.category_id,
+            'name': activity.name,
+            'start_time': activity.start_time.isoformat()
+        })
+        
         return jsonify({
             'id': activity.id,
             'start_time': activity.start_time.isoformat()
@@ -485,28 +934,58 @@ def finish_activity():
         if not db_user:
             return jsonify({'error': 'User not found'}), 404
         
-        activity = Activity.query.get(activity_id)
+        # FOR UPDATE: одновременные завершения одной активности идут по очереди,
+        # второе увидит end_time первого
+        activity = Activity.query.filter_by(id=activity_id).with_for_update().first()
         if not activity or activity.user_id != db_user.id:
             return jsonify({'error': 'Activity not found'}), 404
         
-        activity.end_time = datetime.now(pytz.UTC)
-        activity.duration = (activity.end_time - activity.start_time).total_seconds()
-        activity.notes = data.get('notes')
-        activity.productivity = data.get('productivity')
+        try:
+            xp, _ = close_activity(
+                activity, db_user,
+                productivity=data.get('productivity'),
+                notes=data.get('notes')
+            )
+        except AlreadyFinished:
+            db.session.rollback()
+            return jsonify({'error': 'Activity already finished'}), 409
+        db.session.commit()
+        heartbeats.forget(activity.id)
         
-        # Добавляем XP за завершенную активность
-        xp = int(activity.duration / 60)  # 1 XP за каждую минуту
-        db_user.add_xp(xp)
+        notify_user_changed(db_user, 'activity_finished', finished_payload(activity))
         
-        db.session.commit()
+        return jsonify({**finished_payload(activity), 'xp_earned': xp})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/activity/heartbeat', methods=['POST'])
+def activity_heartbeat():
+    """Пинг идущего таймера; пишется в базу пачкой фоновым потоком"""
+    try:
+        data = request.get_json()
+        user_data = data.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        user = json.loads(user_data)
+        telegram_id = user.get('id')
+        activity_id = data.get('activity_id')
         
-        return jsonify({
-            'id': activity.id,
-            'end_time': activity.end_time.isoformat(),
-            'duration': activity.duration,
-            'xp_earned': xp
-        })
+        if not telegram_id or not activity_id:
+            return jsonify({'error': 'Telegram ID and activity ID are required'}), 400
+        
+        # Владелец проверяется по базе только при первом пинге активности в процессе
+        if heartbeats.owner(activity_id) != telegram_id:
+            activity = db.session.get(Activity, activity_id)
+            if not activity or activity.user.telegram_id != telegram_id:
+                return jsonify({'error': 'Activity not found'}), 404
+            if activity.end_time is not None:
+                return jsonify({'error': 'Activity already finished'}), 409
+        
+        heartbeats.record(activity_id, telegram_id)
+        return jsonify({'interval': HEARTBEAT_INTERVAL})
     except Exception as e:
+        logger.error(f"Error in activity_heartbeat: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/settings/theme', methods=['POST'])
@@ -539,8 +1018,11 @@ def update_theme():
             return jsonify({'error': 'User not found'}), 404
             
         db_user.theme = theme
+        db_user.touch()
         db.session.commit()
         
+        notify_user_changed(db_user, 'settings', {'theme': theme})
+        
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error in update_theme: {str(e)}")
@@ -569,8 +1051,11 @@ def update_notifications():
             return jsonify({'error': 'User not found'}), 404
             
         db_user.notifications = notifications
+        db_user.touch()
         db.session.commit()
         
+        notify_user_changed(db_user, 'settings', {'notifications': notifications})
+        
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error in update_notifications: {str(e)}")
@@ -599,8 +1084,11 @@ def update_daily_goal():
             return jsonify({'error': 'User not found'}), 404
             
         db_user.daily_goal = daily_goal
+        db_user.touch()
         db.session.commit()
         
+        notify_user_changed(db_user, 'settings', {'daily_goal': daily_goal})
+        
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error in update_daily_goal: {str(e)}")
@@ -629,75 +1117,114 @@ def update_break_reminder():
             return jsonify({'error': 'User not found'}), 404
             
         db_user.break_reminder = break_reminder
+        db_user.touch()
         db.session.commit()
         
+        notify_user_changed(db_user, 'settings', {'break_reminder': break_reminder})
+        
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error in update_break_reminder: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@with_app_context
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    if query.data.startswith("start_activity_"):
-        category_id = int(query.data.split("_")[2])
-        category = Category.query.get(category_id)
-        
-        if not category:
-            await query.message.reply_text("Категория не найдена")
-            return
-        
-        # Создаем новую активность
-        activity = Activity(
-            name=f"Активность в категории {category.name}",
-            category_id=category_id,
-            user_id=category.user_id,
-            start_time=datetime.now(pytz.UTC)
-        )
-        db.session.add(activity)
-        db.session.commit()
-        
-        await query.message.reply_text(
-            f"Начата новая активность в категории {category.name}"
-        )
-    
-    elif query.data.startswith("stop_activity_"):
-        activity_id = int(query.data.split("_")[2])
-        activity = Activity.query.get(activity_id)
+@app.route('/api/settings/timezone', methods=['POST'])
+def update_timezone():
+    try:
+        data = request.get_json()
+        user_data = data.get('user')
+        if not user_data:
+            return jsonify({'error': 'No user data'}), 400
+            
+        user = json.loads(user_data)
+        telegram_id = user.get('id')
         
-        if not activity:
-            await query.message.reply_text("Активность не найдена")
-            return
+        if not telegram_id:
+            return jsonify({'error': 'No Telegram ID'}), 400
+            
+        if not data.get('timezone'):
+            return jsonify({'error': 'No timezone specified'}), 400
+        try:
+            tz_name = resolve_timezone(data.get('timezone')).zone
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        activity.end_time = datetime.now(pytz.UTC)
+        db_user = User.query.filter_by(telegram_id=telegram_id).first()
+        if not db_user:
+            return jsonify({'error': 'User not found'}), 404
+            
+        db_user.timezone = tz_name
+        db_user.touch()
         db.session.commit()
         
-        duration = activity.end_time - activity.start_time
-        hours = duration.total_seconds() / 3600
+        notify_user_changed(db_user, 'settings', {'timezone': tz_name})
         
-        await query.message.reply_text(
-            f"Активность '{activity.name}' завершена.\n"
-            f"Продолжительность: {hours:.2f} часов"
-        )
+        return jsonify({'success': True, 'timezone': tz_name})
+    except Exception as e:
+        logger.error(f"Error in update_timezone: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/metrics', methods=['GET'])
+@admin_required
+def admin_metrics():
+    """Метрики процесса: кеш статистики, отказы лимитера, подписчики событий, heartbeat"""
+    return jsonify({
+        'pid': os.getpid(),
+        'stats_cache': stats_cache.snapshot(),
+        'rate_limiting': dict(rate_limiting.rejected),
+        'event_subscribers': broker.subscriber_count(),
+        'event_streams': dict(sse_metrics, limit=SSE_MAX_STREAMS),
+        'heartbeats': heartbeats.snapshot(),
+        'category_cache': category_cache.snapshot(),
+    })
 
-def run_flask():
-    """Запуск Flask приложения"""
-    app.run(debug=True, use_reloader=False)
+@app.route('/api/admin/leaderboard', methods=['GET'])
+@admin_required
+def admin_leaderboard():
+    """Топ пользователей по XP со всех шардов: top-N каждого шарда параллельно, затем слияние"""
+    try:
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def shard_top(shard):
+        rows = db.session.query(
+            User.telegram_id, User.first_name, User.username, User.xp, User.level
+        ).order_by(User.xp.desc(), User.telegram_id).limit(limit).all()
+        return [
+            {'telegram_id': telegram_id, 'first_name': first_name, 'username': username,
+             'xp': xp or 0, 'level': level, 'shard': shard}
+            for telegram_id, first_name, username, xp, level in rows
+        ]
 
-def run_bot():
-    """Запуск Telegram бота"""
-    application.run_polling(drop_pending_updates=True)
+    leaders = [row for rows in sharding.fan_out(app, shard_top) for row in rows]
+    leaders.sort(key=lambda row: (-row['xp'], row['telegram_id']))
+    return jsonify({'leaders': leaders[:limit], 'shards': sharding.shard_count()})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@admin_required
+def admin_profiles():
+    """Сохраненные профили этого процесса; ?format=collapsed - сумма стеков для flamegraph"""
+    kind = request.args.get('kind')
+    name = request.args.get('name')
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.merged(kind, name), mimetype='text/plain')
+    profiles = [
+        profile.summary() for profile in reversed(profiler.profiles)
+        if (kind is None or profile.kind == kind) and (name is None or profile.name == name)
+    ]
+    return jsonify({'enabled': profiler.enabled, 'sample_rate': profiler.sample_rate, 'profiles': profiles})
+
+@app.route('/api/admin/profiles/<int:profile_id>', methods=['GET'])
+@admin_required
+def admin_profile(profile_id):
+    """Один профиль в формате collapsed stacks"""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(profile.collapsed(), mimetype='text/plain')
 
 if __name__ == '__main__':
-    init_db()
-    
-    # Запускаем Flask в отдельном потоке
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.start()
-    
-    # Запускаем бота в основном потоке
-    run_bot()
-else:
-    init_db()  # Инициализируем базу данных при запуске через gunicorn 
\ No newline at end of file
+    # Веб и бот запускаются под супервизором (см. supervisor.py),
+    # он же один раз выполняет init_db() до старта воркеров
+    from supervisor import main
+    main()
\ No newline at end of file
@@ -0,0 +1,427 @@
+"""ASGI-режим: основные API-маршруты на async-обработчиках и async SQLAlchemy.
+
+Один процесс обслуживает сотни одновременных клиентов Mini App: пока
+запрос ждет базу, цикл событий обрабатывает другие. Маршруты, которых
+здесь нет (страницы, статика, служебные API), отдаются Flask-приложением
+через WSGI-адаптер, поэтому набор URL совпадает с WSGI-развертыванием.
+
+Запуск: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+from datetime import datetime
+
+import pytz
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, db
+from events import broker, format_sse, notify_user_changed
+from health import READY_TIMEOUT
+from heartbeat import heartbeats
+from json_provider import compact_number, dumps_bytes
+from models import DEFAULT_CATEGORIES, User, Category, Activity
+from ratelimit import TokenBucketLimiter, configured_limits
+from sharding import enabled as sharding_enabled, on_shard, shard_count, shard_for
+from stats_cache import stats_cache
+from tracking import AlreadyFinished, finish_activity as close_activity, finished_payload
+
+logger = logging.getLogger(__name__)
+
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = 300
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def create_engine_from_flask(shard=0):
+    """Async-движок на ту же базу (шард), что и у Flask-приложения"""
+    with on_shard(flask_app, shard):
+        url = db.engine.url
+    connect_args = {}
+    query = dict(url.query)
+    if query.pop('sslmode', None) == 'require':
+        connect_args['ssl'] = 'require'
+    url = url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername), query=query)
+
+    options = {'pool_pre_ping': True, 'connect_args': connect_args}
+    if url.get_backend_name() == 'postgresql':
+        options.update(
+            pool_size=int(os.getenv('ASGI_POOL_SIZE', 20)),
+            max_overflow=int(os.getenv('ASGI_MAX_OVERFLOW', 20)),
+            pool_recycle=300,
+        )
+    return create_async_engine(url, **options)
+
+
+engines = [create_engine_from_flask(shard) for shard in range(shard_count())]
+sessions = [async_sessionmaker(engine, expire_on_commit=False) for engine in engines]
+
+
+def user_session(telegram_id):
+    """Async-сессия на шарде пользователя"""
+    return sessions[shard_for(telegram_id) if sharding_enabled() else 0]()
+
+limiter = TokenBucketLimiter(configured_limits())
+
+
+class ApiError(Exception):
+    def __init__(self, message, status_code, headers=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.headers = headers
+
+
+class JSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content):
+        return dumps_bytes(content)
+
+
+async def api_error_handler(request, exc):
+    return JSONResponse({'error': exc.message}, status_code=exc.status_code, headers=exc.headers)
+
+
+def parse_user(raw):
+    """Разбирает параметр user: JSON-строка или объект с полем id"""
+    if not raw:
+        raise ApiError('No user data', 400)
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            raise ApiError('Invalid JSON data', 400)
+    telegram_id = raw.get('id') if isinstance(raw, dict) else None
+    if not telegram_id:
+        raise ApiError('No Telegram ID', 400)
+    return raw, telegram_id
+
+
+def check_rate(telegram_id, route_class):
+    retry_after = limiter.acquire(telegram_id, route_class)
+    if retry_after:
+        raise ApiError('Too many requests', 429, {'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        raise ApiError('Invalid JSON data', 400)
+    if not isinstance(data, dict):
+        raise ApiError('No data provided', 400)
+    return data
+
+
+async def get_existing_user(session, telegram_id):
+    db_user = await session.scalar(select(User).where(User.telegram_id == telegram_id))
+    if db_user is None:
+        raise ApiError('User not found', 404)
+    return db_user
+
+
+async def commit_and_notify(session, db_user, event=None, data=None):
+    """Коммитит изменения вместе с новой версией данных и публикует событие"""
+    db_user.data_version = User.data_version + 1
+    await session.commit()
+    await session.refresh(db_user, attribute_names=['data_version'])
+    await asyncio.to_thread(notify_user_changed, db_user, event, data)
+
+
+def user_payload(db_user):
+    return {
+        'id': db_user.id,
+        'telegram_id': db_user.telegram_id,
+        'username': db_user.username,
+        'first_name': db_user.first_name,
+        'last_name': db_user.last_name,
+        'level': db_user.level,
+        'xp': db_user.xp,
+        'theme': db_user.theme,
+        'notifications': db_user.notifications,
+        'daily_goal': db_user.daily_goal,
+        'break_reminder': db_user.break_reminder,
+        'timezone': db_user.timezone
+    }
+
+
+async def get_user(request):
+    user, telegram_id = parse_user(request.query_params.get('user'))
+    check_rate(telegram_id, 'read')
+
+    async with user_session(telegram_id) as session:
+        db_user = await session.scalar(select(User).where(User.telegram_id == telegram_id))
+        if db_user is None:
+            db_user = User(
+                telegram_id=telegram_id,
+                username=user.get('username'),
+                first_name=user.get('first_name'),
+                last_name=user.get('last_name')
+            )
+            session.add(db_user)
+            await session.flush()
+            session.add_all([Category(name=name, user_id=db_user.id) for name in DEFAULT_CATEGORIES])
+            await session.commit()
+            await session.refresh(db_user)
+            logger.info(f"User {telegram_id} created successfully.")
+        return JSONResponse(user_payload(db_user))
+
+
+async def get_daily_stats(request):
+    _, telegram_id = parse_user(request.query_params.get('user'))
+    check_rate(telegram_id, 'stats')
+
+    async with user_session(telegram_id) as session:
+        db_user = await get_existing_user(session, telegram_id)
+        today = datetime.now(pytz.UTC).date()
+        cached = stats_cache.lookup('daily', db_user, (today,))
+        if cached is not None:
+            return JSONResponse(cached)
+        total_tasks, total_seconds, productivity_sum = (await session.execute(
+            select(
+                func.count(Activity.id),
+                func.coalesce(func.sum(Activity.duration), 0),
+                func.coalesce(func.sum(Activity.productivity), 0)
+            ).where(
+                Activity.user_id == db_user.id,
+                func.date(Activity.start_time) == today
+            )
+        )).one()
+
+    total_time = total_seconds / 60
+    productivity = productivity_sum / total_tasks if total_tasks > 0 else 0
+    return JSONResponse(stats_cache.store('daily', db_user, {
+        'total_time': compact_number(total_time),
+        'total_tasks': total_tasks,
+        'productivity': round(productivity, 1)
+    }, (today,)))
+
+
+async def get_category_stats(request):
+    _, telegram_id = parse_user(request.query_params.get('user'))
+    check_rate(telegram_id, 'stats')
+
+    async with user_session(telegram_id) as session:
+        db_user = await get_existing_user(session, telegram_id)
+        cached = stats_cache.lookup('categories', db_user)
+        if cached is not None:
+            return JSONResponse(cached)
+        rows = (await session.execute(
+            select(
+                Category.id,
+                Category.name,
+                Category.position,
+                Category.archived,
+                func.coalesce(func.sum(Activity.duration), 0),
+                func.count(Activity.id)
+            )
+            .outerjoin(Activity, (Activity.category_id == Category.id) & (Activity.user_id == db_user.id))
+            .where(Category.user_id == db_user.id)
+            .group_by(Category.id, Category.name, Category.position, Category.archived)
+            .order_by(Category.position, Category.id)
+        )).all()
+
+    return JSONResponse(stats_cache.store('categories', db_user, [
+        {'id': id_, 'name': name, 'position': position, 'archived': archived,
+         'total_time': total_time, 'total_tasks': total_tasks}
+        for id_, name, position, archived, total_time, total_tasks in rows
+    ]))
+
+
+async def start_activity(request):
+    data = await read_json(request)
+    _, telegram_id = parse_user(data.get('user'))
+    category_id = data.get('category_id')
+    if not category_id:
+        raise ApiError('Telegram ID and category ID are required', 400)
+    check_rate(telegram_id, 'write')
+
+    async with user_session(telegram_id) as session:
+        db_user = await get_existing_user(session, telegram_id)
+        category = await session.get(Category, category_id)
+        if not category or category.user_id != db_user.id:
+            raise ApiError('Category not found', 404)
+        if category.archived:
+            raise ApiError('Category is archived', 400)
+
+        now = datetime.now(pytz.UTC)
+        activity = Activity(
+            user_id=db_user.id,
+            category_id=category.id,
+            name=data.get('name', 'Новая активность'),
+            start_time=now,
+            # Без отметки таймер, брошенный до первого пинга, никогда не закроется
+            last_heartbeat=now.replace(tzinfo=None)
+        )
+        session.add(activity)
+        await session.flush()
+        await commit_and_notify(session, db_user, 'activity_started', {
+            'id': activity.id,
+            'category_id': activity.category_id,
+            'name': activity.name,
+            'start_time': activity.start_time.isoformat()
+        })
+
+    return JSONResponse({'id': activity.id, 'start_time': activity.start_time.isoformat()})
+
+
+async def finish_activity(request):
+    data = await read_json(request)
+    _, telegram_id = parse_user(data.get('user'))
+    activity_id = data.get('activity_id')
+    if not activity_id:
+        raise ApiError('Telegram ID and activity ID are required', 400)
+    check_rate(telegram_id, 'write')
+
+    async with user_session(telegram_id) as session:
+        db_user = await get_existing_user(session, telegram_id)
+        # FOR UPDATE: одновременные завершения одной активности идут по очереди
+        activity = await session.get(Activity, activity_id, with_for_update=True)
+        if not activity or activity.user_id != db_user.id:
+            raise ApiError('Activity not found', 404)
+
+        try:
+            xp, _ = close_activity(
+                activity, db_user,
+                productivity=data.get('productivity'),
+                notes=data.get('notes')
+            )
+        except AlreadyFinished:
+            raise ApiError('Activity already finished', 409)
+        await commit_and_notify(session, db_user, 'activity_finished', finished_payload(activity))
+
+    return JSONResponse({**finished_payload(activity), 'xp_earned': xp})
+
+
+def settings_endpoint(field, error_message):
+    """Обработчик POST /api/settings/<field>, повторяющий Flask-версию"""
+    async def update_setting(request):
+        data = await read_json(request)
+        _, telegram_id = parse_user(data.get('user'))
+        value = data.get(field)
+        if value is None or (field == 'theme' and not value):
+            raise ApiError(error_message, 400)
+        check_rate(telegram_id, 'write')
+
+        async with user_session(telegram_id) as session:
+            db_user = await get_existing_user(session, telegram_id)
+            setattr(db_user, field, value)
+            await commit_and_notify(session, db_user, 'settings', {field: value})
+        return JSONResponse({'success': True})
+
+    update_setting.__name__ = f"update_{field}"
+    return update_setting
+
+
+async def stream_events(request):
+    _, telegram_id = parse_user(request.query_params.get('user'))
+    check_rate(telegram_id, 'stream')
+
+    async with user_session(telegram_id) as session:
+        db_user = await get_existing_user(session, telegram_id)
+        version = db_user.data_version
+
+    subscription = broker.subscribe_async(telegram_id)
+
+    async def generate():
+        loop = asyncio.get_running_loop()
+        try:
+            yield 'retry: 3000\n\n'
+            yield format_sse('stats', dumps_bytes({'version': version}).decode())
+            deadline = loop.time() + SSE_MAX_STREAM_SECONDS
+            while loop.time() < deadline:
+                # Ожидание в цикле событий: поток из пула на время ожидания не занимается
+                message = await subscription.get(SSE_HEARTBEAT_SECONDS)
+                if message is None:
+                    yield ': ping\n\n'
+                    continue
+                yield format_sse(message['event'], dumps_bytes(message['data']).decode())
+        finally:
+            subscription.close()
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+async def healthz(request):
+    return JSONResponse({'status': 'ok'})
+
+
+async def ping_engine(engine):
+    async with engine.connect() as conn:
+        await conn.execute(select(1))
+
+
+async def readyz(request):
+    """SELECT 1 через async-пул каждого шарда с общим таймаутом"""
+    try:
+        await asyncio.wait_for(asyncio.gather(*(ping_engine(engine) for engine in engines)), READY_TIMEOUT)
+    except asyncio.TimeoutError:
+        return JSONResponse({'status': 'unavailable', 'error': f"database did not answer in {READY_TIMEOUT:g}s"}, status_code=503)
+    except Exception as e:
+        logger.error(f"Error in readyz: {str(e)}")
+        return JSONResponse({'status': 'unavailable', 'error': str(e)}, status_code=503)
+    return JSONResponse({'status': 'ok'})
+
+
+routes = [
+    Route('/healthz', healthz, methods=['GET']),
+    Route('/readyz', readyz, methods=['GET']),
+    Route('/api/user', get_user, methods=['GET']),
+    Route('/api/events', stream_events, methods=['GET']),
+    Route('/api/stats/daily', get_daily_stats, methods=['GET']),
+    Route('/api/stats/categories', get_category_stats, methods=['GET']),
+    Route('/api/activity/start', start_activity, methods=['POST']),
+    Route('/api/activity/finish', finish_activity, methods=['POST']),
+    Route('/api/settings/theme', settings_endpoint('theme', 'No theme specified'), methods=['POST']),
+    Route('/api/settings/notifications', settings_endpoint('notifications', 'No notifications setting specified'), methods=['POST']),
+    Route('/api/settings/daily_goal', settings_endpoint('daily_goal', 'No daily goal specified'), methods=['POST']),
+    Route('/api/settings/break_reminder', settings_endpoint('break_reminder', 'No break reminder specified'), methods=['POST']),
+    # Все остальное (страницы, статика, прочие API) - через Flask
+    Mount('/', app=WSGIMiddleware(flask_app)),
+]
+
+
+async def warm_engines():
+    """Открывает pool_size соединений каждого движка до первых запросов"""
+    for engine in engines:
+        size = engine.pool.size() if hasattr(engine.pool, 'size') else 0
+        results = await asyncio.gather(*(engine.connect() for _ in range(size)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error warming async pool: {str(result)}")
+            else:
+                await result.close()
+
+
+async def start_heartbeats():
+    """Пинги идут через Flask под этим же процессом - поток сброса нужен и здесь"""
+    heartbeats.start()
+
+
+async def dispose_engine():
+    for engine in engines:
+        await engine.dispose()
+
+
+app = Starlette(
+    routes=routes,
+    exception_handlers={ApiError: api_error_handler},
+    on_startup=[warm_engines, start_heartbeats],
+    on_shutdown=[dispose_engine],
+)
@@ -0,0 +1,141 @@
+"""Статика с хешем содержимого в имени, предсжатием и долгим кешированием."""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+from flask import abort, current_app, request, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli не установлен - отдаем только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = {
+    'text/css',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def parse_accept_encoding(header):
+    """{кодировка: q} из заголовка Accept-Encoding; q=0 значит «нельзя»"""
+    qualities = {}
+    for item in header.split(','):
+        token, *params = [part.strip() for part in item.split(';')]
+        if not token:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[token.lower()] = quality
+    return qualities
+
+
+class Asset:
+    """Файл статики, загруженный в память вместе со сжатыми вариантами"""
+
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        digest = hashlib.sha256(content).hexdigest()
+        self.etag = digest[:16]
+        root, ext = os.path.splitext(filename)
+        self.hashed_name = f"{root}.{digest[:10]}{ext}"
+        self.variants = {'identity': content}
+        if self.mimetype in COMPRESSIBLE_TYPES:
+            self._add_variant('gzip', gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._add_variant('br', brotli.compress(content, quality=11))
+
+    def _add_variant(self, encoding, data):
+        if len(data) < len(self.variants['identity']):
+            self.variants[encoding] = data
+
+    def pick(self, accept_encoding):
+        """Выбирает лучший вариант, который поддерживает клиент (с наибольшим q, при равенстве - br)"""
+        qualities = parse_accept_encoding(accept_encoding)
+        best, best_quality = 'identity', 0.0
+        for encoding in ('br', 'gzip'):
+            quality = qualities.get(encoding, qualities.get('*', 0.0))
+            if encoding in self.variants and quality > best_quality:
+                best, best_quality = encoding, quality
+        return best, self.variants[best]
+
+
+class StaticAssets:
+    """Собирает манифест статики при старте и раздает файлы по хешированным URL.
+
+    В шаблонах используется asset_url('css/style.css') вместо
+    url_for('static', ...). Файлы, которых нет в манифесте, отдаются
+    стандартным обработчиком Flask.
+    """
+
+    def __init__(self, app=None, url_prefix='/assets'):
+        self.url_prefix = url_prefix
+        self.assets = {}
+        self.by_hashed_name = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.build(app.static_folder)
+        app.add_url_rule(
+            f"{self.url_prefix}/<path:filename>",
+            endpoint='hashed_static',
+            view_func=self.serve
+        )
+        app.jinja_env.globals['asset_url'] = self.url
+        app.extensions['static_assets'] = self
+
+    def build(self, static_folder):
+        """Считывает статику и строит манифест имя -> хешированное имя"""
+        self.assets.clear()
+        self.by_hashed_name.clear()
+        if not static_folder or not os.path.isdir(static_folder):
+            return
+        for root, _, files in os.walk(static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    asset = Asset(filename, f.read())
+                self.assets[filename] = asset
+                self.by_hashed_name[asset.hashed_name] = asset
+        logger.info(f"Static assets fingerprinted: {len(self.assets)} files")
+
+    def url(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            return url_for('static', filename=filename)
+        return url_for('hashed_static', filename=asset.hashed_name)
+
+    def serve(self, filename):
+        asset = self.by_hashed_name.get(filename)
+        if asset is None:
+            abort(404)
+
+        if request.if_none_match.contains_weak(asset.etag):
+            response = current_app.response_class(status=304)
+        else:
+            encoding, data = asset.pick(request.headers.get('Accept-Encoding', ''))
+            response = current_app.response_class(data, mimetype=asset.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(asset.etag, weak=True)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
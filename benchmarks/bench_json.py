@@ -0,0 +1,102 @@
+"""Микробенчмарк сериализации ответов статистики и истории.
+
+Сравнивает FastJSONProvider (orjson) со stdlib-вариантом того же формата
+и стандартным провайдером Flask.
+
+Запуск: python benchmarks/bench_json.py [--history-size 500] [--number 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import pytz
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_provider import FastJSONProvider, StdlibJSONProvider, compact_number, orjson  # noqa: E402
+
+CATEGORY_NAMES = ['Работа', 'Учеба', 'Отдых', 'Спорт', 'Другое', 'Чтение', 'Проекты', 'Встречи']
+
+
+def build_stats_payload():
+    """Ответ /api/stats/categories + /api/stats/daily для активного пользователя"""
+    categories = [
+        {
+            'id': i + 1,
+            'name': name,
+            'total_time': random.randint(0, 500_000),
+            'total_tasks': random.randint(0, 800),
+        }
+        for i, name in enumerate(CATEGORY_NAMES)
+    ]
+    daily = {
+        'total_time': compact_number(random.uniform(0, 600)),
+        'total_tasks': random.randint(0, 20),
+        'productivity': round(random.uniform(1, 5), 1),
+    }
+    return {'categories': categories, 'daily': daily}
+
+
+def build_history_payload(size):
+    """Страница истории активностей из size записей"""
+    now = datetime.now(pytz.UTC)
+    items = []
+    for i in range(size):
+        start = now - timedelta(minutes=90 * (i + 1), seconds=random.randint(0, 59))
+        duration = random.randint(60, 5400)
+        items.append({
+            'id': 100_000 - i,
+            'category_id': random.randint(1, len(CATEGORY_NAMES)),
+            'name': 'Задача по проекту',
+            'start_time': start,
+            'end_time': start + timedelta(seconds=duration),
+            'duration': duration,
+            'notes': 'Ревью кода и исправления' if i % 3 == 0 else None,
+            'productivity': random.randint(1, 5),
+        })
+    return {'items': items, 'next_cursor': 'eyJ0IjoiMjAyNC0wMS0wMVQwMDowMDowMFoiLCJpIjoxfQ'}
+
+
+def bench(label, provider, payload, number):
+    with provider._app.app_context():
+        provider.response(payload)  # прогрев
+        seconds = timeit.timeit(lambda: provider.response(payload), number=number)
+        size = len(provider.response(payload).get_data())
+    print(f"  {label:<10} {number / seconds:>10.0f} ops/s  {seconds / number * 1e6:>8.1f} us/op  {size:>7} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--history-size', type=int, default=500)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(42)
+    app = Flask(__name__)
+    providers = [
+        ('flask', DefaultJSONProvider(app)),
+        ('stdlib', StdlibJSONProvider(app)),
+    ]
+    if orjson is not None:
+        providers.append(('orjson', FastJSONProvider(app)))
+    else:
+        print("orjson не установлен, сравнение только со stdlib")
+
+    payloads = [
+        ('stats', build_stats_payload(), args.number),
+        ('history[50]', build_history_payload(50), args.number),
+        (f'history[{args.history_size}]', build_history_payload(args.history_size), max(args.number // 10, 1)),
+    ]
+    for name, payload, number in payloads:
+        print(name)
+        for label, provider in providers:
+            bench(label, provider, payload, number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Нагрузочное сравнение WSGI (gunicorn) и ASGI (uvicorn) развертываний.
+
+Оба сервера должны смотреть в одну базу и быть запущены заранее с
+отключенными лимитами частоты (иначе через несколько секунд замеряются
+дешевые отказы 429, а не обработчики), например:
+
+    flask --app app init-db
+    RATE_LIMITS=off gunicorn app:app --workers 4 --worker-class gthread --threads 32 --bind 127.0.0.1:8001
+    RATE_LIMITS=off uvicorn asgi:app --workers 1 --port 8002
+
+Запуск:
+
+    python benchmarks/compare_wsgi_asgi.py --wsgi-url http://127.0.0.1:8001 \\
+        --asgi-url http://127.0.0.1:8002 --concurrency 50 200 --duration 20
+
+Каждый виртуальный клиент повторяет сценарий открытия Mini App
+(/api/user, /api/stats/daily, /api/stats/categories) для своего
+пользователя. Задержки и req/s считаются только по ответам 200; ответы
+429/503 и ошибки выводятся отдельными счетчиками.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+OPEN_APP_PATHS = ['/api/user', '/api/stats/daily', '/api/stats/categories']
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def client_loop(session, base_url, telegram_id, deadline, result):
+    user = json.dumps({'id': telegram_id, 'first_name': f'Load {telegram_id}'})
+    while time.monotonic() < deadline:
+        for path in OPEN_APP_PATHS:
+            started = time.perf_counter()
+            try:
+                async with session.get(base_url + path, params={'user': user}) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError:
+                status = None
+            if status == 200:
+                result['latencies'].append(time.perf_counter() - started)
+                result['ok'] += 1
+            elif status in (429, 503):
+                result['throttled'] += 1
+            else:
+                result['errors'] += 1
+
+
+async def run_load(base_url, concurrency, duration, user_offset):
+    result = {'latencies': [], 'ok': 0, 'throttled': 0, 'errors': 0}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=130)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        # Создаем пользователей до замера, чтобы не мерить первичную регистрацию
+        await asyncio.gather(*[
+            session.get(f"{base_url}/api/user", params={'user': json.dumps({'id': user_offset + i})})
+            for i in range(concurrency)
+        ], return_exceptions=True)
+
+        started = time.monotonic()
+        deadline = started + duration
+        await asyncio.gather(*[
+            client_loop(session, base_url, user_offset + i, deadline, result)
+            for i in range(concurrency)
+        ])
+        elapsed = time.monotonic() - started
+
+    latencies = sorted(result['latencies'])
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'ok': result['ok'],
+        'throttled': result['throttled'],
+        'errors': result['errors'],
+    }
+
+
+async def main_async(args):
+    targets = [('wsgi', args.wsgi_url), ('asgi', args.asgi_url)]
+    print(f"{'mode':<6}{'conc':>6}{'ok/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'ok':>8}{'429/503':>9}{'errors':>8}")
+    for concurrency in args.concurrency:
+        for index, (name, url) in enumerate(targets):
+            if not url:
+                continue
+            # Разные диапазоны telegram_id, чтобы лимиты одного прогона не влияли на другой
+            offset = args.user_offset + (index + 1) * 1_000_000 + concurrency
+            stats = await run_load(url.rstrip('/'), concurrency, args.duration, offset)
+            print(f"{name:<6}{concurrency:>6}{stats['rps']:>10.0f}{stats['p50']:>10.1f}{stats['p99']:>10.1f}"
+                  f"{stats['ok']:>8}{stats['throttled']:>9}{stats['errors']:>8}")
+            if stats['throttled'] > stats['ok'] // 100:
+                print(f"  warning: {name} rejected {stats['throttled']} requests with 429/503 - "
+                      "start the server with RATE_LIMITS=off (and a larger API_MAX_CONCURRENCY)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение WSGI и ASGI под нагрузкой')
+    parser.add_argument('--wsgi-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--asgi-url', default='http://127.0.0.1:8002')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--user-offset', type=int, default=9_000_000_000)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,481 @@
+"""Локальная заглушка Telegram Bot API для замеров пропускной способности бота.
+
+Сервер на aiohttp отвечает на методы, которыми пользуется бот (getMe,
+getUpdates, setWebhook/deleteWebhook, sendMessage, sendPhoto,
+sendMediaGroup, answerCallbackQuery, editMessageText; прочие методы
+возвращают True), записывает все исходящие вызовы и умеет генерировать
+тысячи синтетических обновлений в секунду. Обновления отдаются через
+long polling getUpdates, а после setWebhook - POST-запросом на адрес вебхука.
+
+Application направляется на заглушку через base_url:
+
+    bot.build_application(token, base_url=server.url)
+
+Режимы:
+
+    # только сервер (управление: POST /_inject, GET /_stats, POST /_reset)
+    python benchmarks/fake_telegram.py --serve --port 8081
+
+    # замер: бот из bot.py в polling, 5000 команд от 200 пользователей,
+    # затем рассылка уведомления 2000 чатам
+    python benchmarks/fake_telegram.py --updates 5000 --users 200 --fanout 2000
+
+Задержка ответа считается от постановки обновления в очередь до первого
+исходящего сообщения в тот же чат, поэтому по умолчанию используются
+команды, отвечающие ровно одним сообщением.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_TOKEN = '123456:fake-bot-api'
+SINGLE_REPLY_COMMANDS = ['/start', '/status', '/help', '/categories']
+MAX_LONG_POLL = 30
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class FakeBotAPI:
+    """Состояние заглушки: очередь обновлений, вебхук, журнал исходящих вызовов"""
+
+    def __init__(self, record_limit=100000):
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.pending = deque()
+        self.webhook_url = None
+        self.calls = defaultdict(int)
+        self.sent = deque(maxlen=record_limit)
+        self.injected_at = defaultdict(deque)
+        self.latencies = []
+        self.first_injected = None
+        self.last_reply = None
+        self._new_updates = None
+        self._webhook_session = None
+        self._polls = set()
+        self.closing = False
+
+    # --- синтетические обновления ---
+
+    def message_update(self, chat_id, text):
+        update_id = next(self.update_ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback_update(self, chat_id, data):
+        update_id = next(self.update_ids)
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'chat_instance': str(chat_id),
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'text': '',
+                },
+            },
+        }
+
+    async def inject(self, updates):
+        """Ставит обновления в очередь (или отправляет на вебхук)"""
+        now = time.perf_counter()
+        if self.first_injected is None:
+            self.first_injected = now
+        for update in updates:
+            chat = (update.get('message') or update.get('callback_query', {}).get('message') or {}).get('chat')
+            if chat:
+                self.injected_at[chat['id']].append(now)
+        if self.webhook_url:
+            await asyncio.gather(*(self._post_webhook(update) for update in updates))
+        else:
+            self.pending.extend(updates)
+            self._new_updates.set()
+
+    async def _post_webhook(self, update):
+        if self._webhook_session is None:
+            self._webhook_session = aiohttp.ClientSession()
+        try:
+            async with self._webhook_session.post(self.webhook_url, json=update) as response:
+                await response.read()
+        except aiohttp.ClientError:
+            self.calls['webhook_errors'] += 1
+
+    # --- методы Bot API ---
+
+    def _record_reply(self, method, chat_id, params):
+        now = time.perf_counter()
+        self.last_reply = now
+        self.sent.append((now, method, chat_id, params))
+        queue = self.injected_at.get(chat_id)
+        if queue:
+            self.latencies.append(now - queue.popleft())
+
+    def _message(self, chat_id, **fields):
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            **fields,
+        }
+
+    def _photo(self, message_id):
+        file_id = f'fake-photo-{message_id}'
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}]
+
+    async def get_updates(self, params):
+        if self.webhook_url:
+            raise web.HTTPConflict(
+                text=json.dumps({'ok': False, 'error_code': 409,
+                                 'description': 'Conflict: can\'t use getUpdates method while webhook is active'}),
+                content_type='application/json'
+            )
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = min(float(params.get('timeout') or 0), MAX_LONG_POLL)
+        while self.pending and self.pending[0]['update_id'] < offset:
+            self.pending.popleft()
+        if not self.pending and timeout and not self.closing:
+            self._new_updates.clear()
+            # Отметка незавершенного long polling: close() дожидается всех
+            done = asyncio.get_running_loop().create_future()
+            self._polls.add(done)
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._polls.discard(done)
+                done.set_result(None)
+        return list(itertools.islice(self.pending, limit))
+
+    async def close(self):
+        """Отвечает на ожидающие getUpdates до остановки сервера"""
+        self.closing = True
+        if self._new_updates is not None:
+            self._new_updates.set()
+        if self._polls:
+            await asyncio.wait(list(self._polls), timeout=5)
+
+    async def dispatch(self, method, params):
+        self.calls[method] += 1
+        chat_id = params.get('chat_id')
+        chat_id = int(chat_id) if chat_id not in (None, '') else None
+
+        if method == 'getMe':
+            return {'id': int(FAKE_TOKEN.split(':')[0]), 'is_bot': True,
+                    'first_name': 'Fake', 'username': 'fake_bot',
+                    'can_join_groups': True, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url') or None
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            if str(params.get('drop_pending_updates')).lower() == 'true':
+                self.pending.clear()
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url or '', 'has_custom_certificate': False,
+                    'pending_update_count': len(self.pending)}
+        if method == 'sendMessage':
+            self._record_reply(method, chat_id, params)
+            return self._message(chat_id, text=params.get('text', ''))
+        if method == 'sendPhoto':
+            self._record_reply(method, chat_id, params)
+            message = self._message(chat_id)
+            message['photo'] = self._photo(message['message_id'])
+            return message
+        if method == 'sendMediaGroup':
+            self._record_reply(method, chat_id, params)
+            media = params.get('media') or '[]'
+            media = json.loads(media) if isinstance(media, str) else media
+            messages = [self._message(chat_id) for _ in media]
+            for message in messages:
+                message['photo'] = self._photo(message['message_id'])
+            return messages
+        if method == 'editMessageText':
+            self._record_reply(method, chat_id, params)
+            return self._message(chat_id, text=params.get('text', ''))
+        return True
+
+    # --- HTTP ---
+
+    async def handle_method(self, request):
+        params = {}
+        if request.content_type == 'application/json':
+            params = await request.json()
+        elif request.method == 'POST':
+            form = await request.post()
+            params = {key: value for key, value in form.items() if isinstance(value, str)}
+        params.update(request.query)
+        result = await self.dispatch(request.match_info['method'], params)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_inject(self, request):
+        """POST /_inject {"count": N, "users": M, "commands": [...]} или {"updates": [...]}"""
+        body = await request.json()
+        updates = body.get('updates')
+        if updates is None:
+            users = int(body.get('users', 100))
+            first_chat = int(body.get('first_chat_id', 1_000_000))
+            commands = body.get('commands') or SINGLE_REPLY_COMMANDS
+            updates = [
+                self.message_update(first_chat + random.randrange(users), random.choice(commands))
+                for _ in range(int(body.get('count', 1)))
+            ]
+        await self.inject(updates)
+        return web.json_response({'ok': True, 'injected': len(updates)})
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats())
+
+    async def handle_reset(self, request):
+        self.reset()
+        return web.json_response({'ok': True})
+
+    def reset(self):
+        self.pending.clear()
+        self.calls.clear()
+        self.sent.clear()
+        self.injected_at.clear()
+        self.latencies = []
+        self.first_injected = None
+        self.last_reply = None
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        replies = sum(self.calls.get(m, 0) for m in ('sendMessage', 'sendPhoto', 'sendMediaGroup', 'editMessageText'))
+        window = (self.last_reply - self.first_injected) if self.first_injected and self.last_reply else 0
+        return {
+            'calls': dict(self.calls),
+            'pending_updates': len(self.pending),
+            'replies': replies,
+            'answered_updates': len(latencies),
+            'updates_per_second': round(len(latencies) / window, 1) if window > 0 else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.50) * 1000, 1),
+                'p95': round(percentile(latencies, 0.95) * 1000, 1),
+                'p99': round(percentile(latencies, 0.99) * 1000, 1),
+            },
+        }
+
+    def make_app(self):
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_post('/_inject', self.handle_inject)
+        app.router.add_get('/_stats', self.handle_stats)
+        app.router.add_post('/_reset', self.handle_reset)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+
+        async def on_startup(_):
+            self._new_updates = asyncio.Event()
+
+        async def on_cleanup(_):
+            if self._webhook_session is not None:
+                await self._webhook_session.close()
+
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+
+class FakeServer:
+    """Заглушка в отдельном потоке со своим циклом событий"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.api = FakeBotAPI()
+        self.loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError('fake Bot API server did not start')
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        async def setup():
+            self._runner = web.AppRunner(self.api.make_app(), access_log=None)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+
+        self.loop.run_until_complete(setup())
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def call(self, coroutine):
+        """Выполняет корутину в цикле сервера и ждет результат"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def inject(self, updates):
+        self.call(self.api.inject(updates))
+
+    def stop(self):
+        if self.loop is not None:
+            # Сначала отвечаем на ожидающие long polling запросы, иначе cleanup
+            # оборвет их обработчики на середине
+            self.call(self.api.close())
+            self.call(self._runner.cleanup())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(10)
+
+
+async def run_benchmark(args):
+    from telegram.request import HTTPXRequest
+    import bot
+    from app import init_db
+
+    init_db()
+
+    server = FakeServer().start()
+    print(f"Fake Bot API at {server.url}")
+    api = server.api
+
+    # Исходящим сообщениям - пул соединений; long polling идет отдельным запросом
+    application = bot.build_application(
+        FAKE_TOKEN,
+        request=HTTPXRequest(connection_pool_size=args.connections),
+        base_url=server.url,
+        concurrent_updates=args.concurrent_updates
+    )
+
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    try:
+        # --- пропускная способность обработки обновлений ---
+        chats = [args.first_chat_id + i for i in range(args.users)]
+        server.inject([api.message_update(chat, '/start') for chat in chats])
+        await wait_for_replies(api, len(chats), args.timeout)
+        api.reset()
+
+        remaining = args.updates
+        batch = max(1, args.rate // 20) if args.rate else args.updates
+        started = time.perf_counter()
+        while remaining > 0:
+            size = min(batch, remaining)
+            server.inject([
+                api.message_update(random.choice(chats), random.choice(args.commands))
+                for _ in range(size)
+            ])
+            remaining -= size
+            if args.rate:
+                injected = args.updates - remaining
+                delay = started + injected / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        await wait_for_replies(api, args.updates, args.timeout)
+        stats = api.stats()
+        print(f"\nUpdates: {args.updates} from {args.users} users, "
+              f"concurrent_updates={args.concurrent_updates}, rate={args.rate or 'burst'}")
+        print(f"  answered: {stats['answered_updates']}, throughput: {stats['updates_per_second']} updates/s")
+        print(f"  reply latency ms: {stats['latency_ms']}")
+
+        # --- рассылка уведомлений ---
+        if args.fanout:
+            api.reset()
+            targets = [args.first_chat_id + i for i in range(args.fanout)]
+            semaphore = asyncio.Semaphore(args.connections)
+
+            async def notify(chat_id):
+                async with semaphore:
+                    await application.bot.send_message(chat_id, 'Пора сделать перерыв!')
+
+            started = time.perf_counter()
+            await asyncio.gather(*(notify(chat) for chat in targets))
+            elapsed = time.perf_counter() - started
+            print(f"\nFan-out: {args.fanout} messages in {elapsed:.2f}s "
+                  f"({args.fanout / elapsed:.0f} msg/s, {args.connections} connections)")
+            print(f"  recorded by server: {api.calls['sendMessage']}")
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        bot.shutdown_executor()
+        server.stop()
+
+
+async def wait_for_replies(api, expected, timeout):
+    deadline = time.monotonic() + timeout
+    while len(api.latencies) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if len(api.latencies) < expected:
+        print(f"Timed out: {len(api.latencies)} of {expected} updates answered")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка Telegram Bot API и замер пропускной способности бота')
+    parser.add_argument('--serve', action='store_true', help='только запустить сервер')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rate', type=int, default=0, help='обновлений в секунду (0 - все сразу)')
+    parser.add_argument('--commands', nargs='+', default=SINGLE_REPLY_COMMANDS)
+    parser.add_argument('--concurrent-updates', type=int, default=0,
+                        help='параллельная обработка обновлений в Application (0 - последовательно)')
+    parser.add_argument('--fanout', type=int, default=1000, help='размер рассылки (0 - не замерять)')
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--first-chat-id', type=int, default=8_000_000_000)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    if args.serve:
+        web.run_app(FakeBotAPI().make_app(), host=args.host, port=args.port)
+        return
+
+    if not os.getenv('DATABASE_URL'):
+        tmpdir = tempfile.mkdtemp(prefix='fake-telegram-')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'bot.db')}"
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', FAKE_TOKEN)
+    sys.path.insert(0, ROOT)
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == '__main__':
+    main()
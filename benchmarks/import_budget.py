@@ -0,0 +1,95 @@
+"""Бюджет времени импорта: холодный старт веб-воркера и процесса бота.
+
+Импортирует модуль в чистом интерпретаторе с `python -X importtime`
+несколько раз, берет медиану суммарного времени и падает с ненулевым
+кодом, если она больше бюджета или если веб-воркер загрузил модули,
+которые ему не нужны (стек python-telegram-bot, NumPy, matplotlib,
+alembic). Это ручная проверка: CI в репозитории нет, поэтому запускайте
+ее перед релизом и после изменений импортов или зависимостей:
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --module bot --budget-ms 3000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = {'app': 1200, 'asgi': 1800, 'bot': 2500}
+# Тяжелые зависимости, которые грузятся только в нужных им путях кода
+FORBIDDEN = ['telegram', 'numpy', 'matplotlib', 'pandas', 'alembic']
+ALLOWED = {'bot': ['telegram']}
+
+
+def parse_importtime(stderr):
+    """[(уровень вложенности, собственное время мкс, суммарное мкс, модуль)] из вывода -X importtime"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((depth, int(self_us), int(cumulative_us), name.strip()))
+    return entries
+
+
+def measure(module):
+    env = dict(os.environ)
+    env.setdefault('TELEGRAM_BOT_TOKEN', '1:import-budget')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def loaded(entries, prefixes):
+    names = {name for _, _, _, name in entries}
+    return sorted(
+        prefix for prefix in prefixes
+        if any(name == prefix or name.startswith(prefix + '.') for name in names)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, help='по умолчанию свой для app, asgi и bot')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=12, help='сколько самых дорогих импортов показать')
+    parser.add_argument('--allow', nargs='*', help='тяжелые модули, допустимые для этого модуля')
+    args = parser.parse_args()
+
+    budget = args.budget_ms or DEFAULT_BUDGET_MS.get(args.module, 1500)
+    allowed = ALLOWED.get(args.module, []) if args.allow is None else args.allow
+    forbidden = [prefix for prefix in FORBIDDEN if prefix not in allowed]
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    totals = [sum(cumulative for depth, _, cumulative, _ in entries if depth == 0) / 1000 for entries in runs]
+    median = statistics.median(totals)
+    entries = runs[totals.index(sorted(totals)[len(totals) // 2])]
+
+    print(f"import {args.module}: median {median:.0f} ms (min {min(totals):.0f}, max {max(totals):.0f}), budget {budget:.0f} ms")
+    print("Самые дорогие импорты (суммарное время):")
+    top = sorted((entry for entry in entries if entry[0] <= 1), key=lambda entry: -entry[2])[:args.top]
+    for depth, _, cumulative, name in top:
+        print(f"  {cumulative / 1000:8.1f} ms  {'  ' * depth}{name}")
+
+    failed = False
+    unwanted = loaded(entries, forbidden)
+    if unwanted:
+        print(f"FAIL: import {args.module} loads {', '.join(unwanted)}")
+        failed = True
+    if median > budget:
+        print(f"FAIL: import time {median:.0f} ms exceeds budget {budget:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""Нагрузочный тест: одновременные сессии Mini App и пользователи бота.
+
+Каждый пользователь Mini App повторяет реальный сценарий:
+открытие приложения (/api/user, /api/stats/daily, /api/stats/categories),
+пауза, /api/activity/start, выполнение задачи, /api/activity/finish
+с оценкой, иногда изменение настроек. Паузы распределены экспоненциально
+вокруг --think секунд, длительность задачи - вокруг --activity-seconds.
+
+Пользователи бота отправляют команды (/start, затем случайные /status,
+/statistics, /insights, /stop_activity). Обновления передаются прямо в
+Application из bot.py через process_update. Запросы к Bot API перехватывает
+заглушка и сразу отвечает успехом, так что измеряется только работа
+обработчиков. Бот работает в отдельном потоке со своим циклом событий:
+его обработчики ходят в базу синхронно и не должны тормозить HTTP-клиентов.
+
+Запуск вместе с локальным сервером (SQLite во временном каталоге):
+
+    python benchmarks/load_test.py --start --users 200 --bot-users 50 --duration 60
+
+Против уже запущенного сервера (бот должен смотреть в ту же базу):
+
+    DATABASE_URL=postgresql://... python benchmarks/load_test.py \\
+        --base-url http://127.0.0.1:8000 --users 1000 --think 5
+
+Для каждой операции выводятся число запросов, пропускная способность,
+p50/p95/p99 и доля ошибок. Ответы 429/503 учитываются отдельно.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOAD_BOT_TOKEN = '123456:load-test'
+BOT_COMMANDS = ['/status', '/statistics', '/insights', '/stop_activity', '/categories']
+BOT_COMMAND_WEIGHTS = [4, 2, 1, 1, 1]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Время и исход каждой операции; потокобезопасен (бот пишет из своего потока)"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: {'ok': 0, 'limited': 0, 'error': 0})
+        self._lock = threading.Lock()
+
+    def add(self, operation, seconds, outcome):
+        with self._lock:
+            self.latencies[operation].append(seconds)
+            self.outcomes[operation][outcome] += 1
+
+    def report(self, elapsed):
+        header = f"{'operation':<22}{'count':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'429/503':>9}{'errors':>8}{'err %':>7}"
+        print(header)
+        print('-' * len(header))
+        for operation in sorted(self.latencies):
+            latencies = sorted(self.latencies[operation])
+            outcome = self.outcomes[operation]
+            count = len(latencies)
+            print(
+                f"{operation:<22}{count:>8}{count / elapsed:>9.1f}"
+                f"{percentile(latencies, 0.50) * 1000:>9.1f}"
+                f"{percentile(latencies, 0.95) * 1000:>9.1f}"
+                f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+                f"{outcome['limited']:>9}{outcome['error']:>8}"
+                f"{outcome['error'] / count * 100 if count else 0:>7.2f}"
+            )
+
+
+async def call(session, recorder, operation, method, url, **kwargs):
+    """Выполняет запрос и записывает результат; возвращает JSON ответа или None"""
+    started = time.perf_counter()
+    try:
+        async with session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            status = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        recorder.add(operation, time.perf_counter() - started, 'error')
+        return None
+
+    elapsed = time.perf_counter() - started
+    if status in (429, 503):
+        recorder.add(operation, elapsed, 'limited')
+        return None
+    if status >= 400:
+        recorder.add(operation, elapsed, 'error')
+        return None
+    recorder.add(operation, elapsed, 'ok')
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+async def pause(mean_seconds, deadline):
+    delay = random.expovariate(1 / mean_seconds) if mean_seconds > 0 else 0
+    await asyncio.sleep(max(0, min(delay, deadline - time.monotonic())))
+
+
+async def miniapp_user(session, base_url, telegram_id, args, recorder, deadline):
+    user = json.dumps({'id': telegram_id, 'first_name': f'Load {telegram_id}'})
+    params = {'user': user}
+    await asyncio.sleep(random.uniform(0, args.ramp))
+
+    while time.monotonic() < deadline:
+        # Открытие Mini App
+        await call(session, recorder, 'open:user', 'GET', base_url + '/api/user', params=params)
+        await call(session, recorder, 'open:stats_daily', 'GET', base_url + '/api/stats/daily', params=params)
+        categories = await call(session, recorder, 'open:stats_categories', 'GET',
+                                base_url + '/api/stats/categories', params=params)
+        await pause(args.think, deadline)
+        if not categories or time.monotonic() >= deadline:
+            continue
+
+        started = await call(session, recorder, 'activity:start', 'POST', base_url + '/api/activity/start', json={
+            'user': user,
+            'category_id': random.choice(categories)['id'],
+            'name': f'Задача {random.randint(1, 1000)}',
+        })
+        if not started:
+            continue
+
+        await pause(args.activity_seconds, deadline)
+        await call(session, recorder, 'activity:finish', 'POST', base_url + '/api/activity/finish', json={
+            'user': user,
+            'activity_id': started['id'],
+            'productivity': random.randint(1, 5),
+            'notes': 'load test',
+        })
+
+        if random.random() < args.settings_rate:
+            await call(session, recorder, 'settings:daily_goal', 'POST', base_url + '/api/settings/daily_goal', json={
+                'user': user,
+                'daily_goal': random.choice([60, 120, 240, 480]),
+            })
+        await pause(args.think, deadline)
+
+
+def run_miniapp_users(args, base_url, recorder, deadline):
+    async def run():
+        timeout = aiohttp.ClientTimeout(total=30)
+        connector = aiohttp.TCPConnector(limit=args.connections)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            await asyncio.gather(*(
+                miniapp_user(session, base_url, args.first_id + i, args, recorder, deadline)
+                for i in range(args.users)
+            ))
+    return run()
+
+
+def make_null_request():
+    """BaseRequest, отвечающий на любой метод Bot API без сети"""
+    from telegram.request import BaseRequest
+
+    class NullRequest(BaseRequest):
+        def __init__(self):
+            self.message_ids = itertools.count(1)
+            self.calls = defaultdict(int)
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        def message(self, parameters, photo=False):
+            message = {
+                'message_id': next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(parameters.get('chat_id', 0)), 'type': 'private'},
+            }
+            if photo:
+                file_id = f'photo-{message["message_id"]}'
+                message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}]
+            else:
+                message['text'] = parameters.get('text', '')
+            return message
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            endpoint = url.rsplit('/', 1)[-1]
+            self.calls[endpoint] += 1
+            parameters = request_data.parameters if request_data is not None else {}
+            if endpoint == 'getMe':
+                result = {'id': int(LOAD_BOT_TOKEN.split(':')[0]), 'is_bot': True,
+                          'first_name': 'Load', 'username': 'load_test_bot'}
+            elif endpoint == 'sendPhoto':
+                result = self.message(parameters, photo=True)
+            elif endpoint == 'sendMediaGroup':
+                result = [self.message(parameters, photo=True) for _ in parameters.get('media', [])]
+            elif endpoint.startswith('send') or endpoint.startswith('edit'):
+                result = self.message(parameters)
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return NullRequest()
+
+
+def command_update(update_id, telegram_id, text):
+    command = text.split()[0]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': telegram_id, 'type': 'private'},
+            'from': {'id': telegram_id, 'is_bot': False, 'first_name': f'Load {telegram_id}'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        },
+    }
+
+
+def run_bot_users(args, recorder, ready, start):
+    """Поток с циклом событий бота: пользователи шлют команды в Application.
+
+    ready выставляется после инициализации Application; отсчет начинается,
+    когда главный поток запишет дедлайн в start['deadline'] и выставит start['event'].
+    """
+    from telegram import Update
+    import bot
+
+    failed = set()
+
+    async def record_error(update, context):
+        failed.add(update.update_id)
+
+    async def bot_user(application, telegram_id, update_ids, deadline):
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        texts = itertools.chain(['/start'], iter(lambda: random.choices(BOT_COMMANDS, BOT_COMMAND_WEIGHTS)[0], None))
+        for text in texts:
+            if time.monotonic() >= deadline:
+                break
+            update = Update.de_json(command_update(next(update_ids), telegram_id, text), application.bot)
+            started = time.perf_counter()
+            try:
+                await application.process_update(update)
+                outcome = 'error' if update.update_id in failed else 'ok'
+            except Exception:
+                outcome = 'error'
+            recorder.add(f"bot:{text.lstrip('/')}", time.perf_counter() - started, outcome)
+            await pause(args.bot_think, deadline)
+
+    async def run():
+        request = make_null_request()
+        application = bot.build_application(LOAD_BOT_TOKEN, request=request)
+        application.add_error_handler(record_error)
+        await application.initialize()
+        ready.set()
+        await asyncio.to_thread(start['event'].wait)
+        update_ids = itertools.count(1)
+        try:
+            await asyncio.gather(*(
+                bot_user(application, args.first_id + args.users + i, update_ids, start['deadline'])
+                for i in range(args.bot_users)
+            ))
+        finally:
+            await application.shutdown()
+            bot.shutdown_executor()
+        print(f"Bot API calls: {dict(request.calls)}")
+
+    asyncio.run(run())
+
+
+def start_server(args, port):
+    """Поднимает веб через supervisor.py и ждет, пока он начнет отвечать"""
+    process = subprocess.Popen(
+        [sys.executable, 'supervisor.py', '--web', '--workers', str(args.workers),
+         '--bind', f'127.0.0.1:{port}'],
+        cwd=ROOT,
+        env=os.environ.copy(),
+    )
+    base_url = f'http://127.0.0.1:{port}'
+
+    async def wait_ready():
+        deadline = time.monotonic() + 60
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if process.poll() is not None:
+                    raise RuntimeError('server exited during startup')
+                try:
+                    async with session.get(base_url + '/') as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.5)
+        raise RuntimeError('server did not start in 60s')
+
+    try:
+        asyncio.run(wait_ready())
+    except Exception:
+        process.terminate()
+        raise
+    return process, base_url
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=45)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест Mini App и бота')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--start', action='store_true', help='поднять локальный сервер через supervisor.py --web')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--users', type=int, default=100, help='пользователей Mini App')
+    parser.add_argument('--bot-users', type=int, default=20, help='пользователей бота')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--ramp', type=float, default=10, help='секунд на подключение всех пользователей')
+    parser.add_argument('--think', type=float, default=3, help='средняя пауза между действиями, с')
+    parser.add_argument('--activity-seconds', type=float, default=10, help='средняя длительность задачи, с')
+    parser.add_argument('--settings-rate', type=float, default=0.1, help='доля циклов с изменением настроек')
+    parser.add_argument('--bot-think', type=float, default=5, help='средняя пауза между командами бота, с')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--first-id', type=int, default=9_000_000_000, help='первый telegram_id тестовых пользователей')
+    args = parser.parse_args()
+
+    tmpdir = None
+    if args.start and not os.getenv('DATABASE_URL'):
+        tmpdir = tempfile.mkdtemp(prefix='load-test-')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'load.db')}"
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', LOAD_BOT_TOKEN)
+    sys.path.insert(0, ROOT)
+
+    server = None
+    base_url = args.base_url
+    if args.start:
+        server, base_url = start_server(args, args.port)
+        print(f"Server started at {base_url} ({os.environ['DATABASE_URL']})")
+
+    recorder = Recorder()
+    bot_thread = None
+    start = {'event': threading.Event()}
+    try:
+        if args.bot_users:
+            # Импорт бота и инициализация Application - до начала отсчета
+            ready = threading.Event()
+            bot_thread = threading.Thread(
+                target=run_bot_users, args=(args, recorder, ready, start), name='load-bot', daemon=True
+            )
+            bot_thread.start()
+            if not ready.wait(120):
+                raise RuntimeError('bot application did not initialize')
+
+        started = time.monotonic()
+        start['deadline'] = deadline = started + args.duration
+        start['event'].set()
+        asyncio.run(run_miniapp_users(args, base_url, recorder, deadline))
+        if bot_thread is not None:
+            bot_thread.join(timeout=60)
+        elapsed = time.monotonic() - started
+    finally:
+        start['event'].set()
+        if server is not None:
+            stop_server(server)
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(f"\n{args.users} Mini App users, {args.bot_users} bot users, {elapsed:.1f}s")
+    recorder.report(elapsed)
+
+
+if __name__ == '__main__':
+    main()
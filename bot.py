@@ -2,12 +2,31 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 import logging
 import os
+import signal
 from dotenv import load_dotenv
 import sys
 from datetime import datetime
 import pytz
+import asyncio
 import atexit
-from web import db, User, Category, Activity
+import threading
+from functools import wraps
+from categories import (
+    category_payload, create_categories, rename_categories, reorder_categories, set_archived
+)
+from category_cache import category_cache
+from dialect import resolve_timezone
+from charts import category_totals, daily_minutes, render_category_pie, render_weekly_bars, send_charts, shutdown_executor
+from events import notify_user_changed
+from leader import LeaderLock
+from profiling import profiler
+from reports import format_user_report, get_report, local_today, parse_range, parse_report_period
+from search import search_activities
+from sharding import user_shard
+from teams import GROUP_CHAT_TYPES, find_team, format_report, get_team_report, join_team, leave_team, parse_period
+from tracking import finish_activity, finished_payload
+from app import app
+from models import db, User, Category, Activity
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -19,39 +38,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def is_bot_running():
-    """Проверяет, запущен ли уже бот"""
-    lock_file = '/tmp/bot.lock'
-    if not os.path.exists(lock_file):
-        return False
-        
-    try:
-        with open(lock_file, 'r') as f:
-            pid = int(f.read().strip())
-        # Проверяем, существует ли процесс
-        os.kill(pid, 0)
-        return True
-    except (ValueError, ProcessLookupError):
-        # Если процесс не существует, удаляем файл блокировки
-        try:
-            os.remove(lock_file)
-        except:
-            pass
-        return False
-
-def create_lock():
-    """Создает файл блокировки"""
-    with open('/tmp/bot.lock', 'w') as f:
-        f.write(str(os.getpid()))
-
-def cleanup_lock():
-    """Очистка блокировки при выходе"""
-    try:
-        if os.path.exists('/tmp/bot.lock'):
-            os.remove('/tmp/bot.lock')
-    except:
-        pass
+def with_app_context(f):
+    """Выполняет обработчик в контексте Flask-приложения (нужно для запросов к БД)"""
+    @wraps(f)
+    async def decorated_function(update, *args, **kwargs):
+        # Запросы обработчика идут на шард пользователя, приславшего update
+        user = getattr(update, 'effective_user', None)
+        with user_shard(user.id if user else None), app.app_context():
+            return await f(update, *args, **kwargs)
+    return decorated_function
 
+@with_app_context
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     db_user = User.query.filter_by(telegram_id=user.id).first()
@@ -85,11 +82,24 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start_activity - Начать новую активность
 /stop_activity - Остановить текущую активность
 /status - Показать текущий статус
-/categories - Управление категориями
-/statistics - Показать статистику
+/categories - Список категорий
+/add_category, /rename_category, /archive_category, /restore_category, /reorder_categories - Изменение категорий (списком)
+/stats - Статистика за сегодня
+/statistics - Статистика по категориям
+/settings - Текущие настройки
+/find <текст> - Найти активности по названию и заметкам
+/insights - Аналитика продуктивности
+/report <day|week|month|year> [число] - Время по дням, неделям, месяцам или годам
+/timezone <зона> - Часовой пояс для отчетов, например Europe/Moscow
+
+В групповом чате:
+/team_join - Вступить в команду чата
+/team_leave - Выйти из команды
+/team_stats [дни] - Отчет команды за период (по умолчанию 7 дней)
     """
     await update.message.reply_text(help_text)
 
+@with_app_context
 async def start_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     db_user = User.query.filter_by(telegram_id=user.id).first()
@@ -105,17 +115,18 @@ async def start_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ).first()
     
     if active_activity:
+        category = category_cache.find(db_user, active_activity.category_id)
         await update.message.reply_text(
             f"У вас уже есть активная активность: {active_activity.name} "
-            f"в категории {active_activity.category.name}"
+            f"в категории {category.name if category else '-'}"
         )
         return
     
-    # Получаем категории пользователя
-    categories = Category.query.filter_by(user_id=db_user.id).all()
+    # Категории из кеша: при неизменной версии категорий запроса к базе нет
+    categories = category_cache.active(db_user)
     
     if not categories:
-        await update.message.reply_text("У вас нет категорий. Создайте хотя бы одну категорию.")
+        await update.message.reply_text("У вас нет категорий. Создайте хотя бы одну командой /add_category.")
         return
     
     # Создаем клавиатуру с категориями
@@ -132,51 +143,78 @@ async def start_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+@with_app_context
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await query.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
     if query.data.startswith("start_activity_"):
         category_id = int(query.data.split("_")[2])
-        category = Category.query.get(category_id)
+        # Кнопка могла прийти из чужого сообщения: ищем только среди своих категорий
+        category = category_cache.find(db_user, category_id)
         
         if not category:
             await query.message.reply_text("Категория не найдена")
             return
+        if category.archived:
+            await query.message.reply_text(f"Категория {category.name} в архиве")
+            return
         
         # Создаем новую активность
         activity = Activity(
             name=f"Активность в категории {category.name}",
-            category_id=category_id,
-            user_id=category.user_id,
+            category_id=category.id,
+            user_id=db_user.id,
             start_time=datetime.now(pytz.UTC)
         )
         db.session.add(activity)
+        db_user.touch()
         db.session.commit()
         
+        notify_user_changed(db_user, 'activity_started', {
+            'id': activity.id,
+            'category_id': activity.category_id,
+            'name': activity.name,
+            'start_time': activity.start_time.isoformat()
+        })
+        
         await query.message.reply_text(
             f"Начата новая активность в категории {category.name}"
         )
     
     elif query.data.startswith("stop_activity_"):
         activity_id = int(query.data.split("_")[2])
-        activity = Activity.query.get(activity_id)
+        activity = db.session.get(Activity, activity_id)
         
-        if not activity:
+        if not activity or activity.user_id != db_user.id:
             await query.message.reply_text("Активность не найдена")
             return
         
-        activity.end_time = datetime.now(pytz.UTC)
+        if activity.end_time is not None:
+            await query.message.reply_text("Активность уже завершена")
+            return
+        
+        xp, leveled_up = finish_activity(activity, db_user)
         db.session.commit()
         
-        duration = activity.end_time - activity.start_time
-        hours = duration.total_seconds() / 3600
+        notify_user_changed(db_user, 'activity_finished', finished_payload(activity))
         
-        await query.message.reply_text(
+        hours = activity.duration / 3600
+        message = (
             f"Активность '{activity.name}' завершена.\n"
-            f"Продолжительность: {hours:.2f} часов"
+            f"Продолжительность: {hours:.2f} часов\n"
+            f"Получено опыта: {xp} XP"
         )
+        if leveled_up:
+            message += f"\n🎉 Поздравляем! Вы достигли уровня {db_user.level}!"
+        await query.message.reply_text(message)
 
+@with_app_context
 async def stop_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     db_user = User.query.filter_by(telegram_id=user.id).first()
@@ -211,6 +249,7 @@ async def stop_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+@with_app_context
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     db_user = User.query.filter_by(telegram_id=user.id).first()
@@ -238,6 +277,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text("У вас нет активных активностей")
 
+@with_app_context
 async def categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     db_user = User.query.filter_by(telegram_id=user.id).first()
@@ -246,18 +286,158 @@ async def categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
         return
     
-    categories = Category.query.filter_by(user_id=db_user.id).all()
+    categories = category_cache.get(db_user)
     
     if not categories:
         await update.message.reply_text("У вас нет категорий")
         return
     
+    active = [category for category in categories if not category.archived]
+    archived = [category for category in categories if category.archived]
     message = "Ваши категории:\n\n"
-    for category in categories:
-        message += f"- {category.name}\n"
+    for number, category in enumerate(active, start=1):
+        message += f"{number}. {category.name}\n"
+    if archived:
+        message += "\nВ архиве:\n"
+        for category in archived:
+            message += f"- {category.name}\n"
+    message += (
+        "\nИзменить (можно несколько через запятую):\n"
+        "/add_category Чтение, Музыка\n"
+        "/rename_category Учеба = Курсы; Другое = Разное\n"
+        "/archive_category Спорт\n"
+        "/restore_category Спорт\n"
+        "/reorder_categories 3, 1, 2"
+    )
     
     await update.message.reply_text(message)
 
+def split_args(context, separator=','):
+    text = ' '.join(context.args or [])
+    return [part.strip() for part in text.split(separator) if part.strip()]
+
+def resolve_categories(db_user, names):
+    """Категории по названиям (без учета регистра) или номерам из /categories; (найденные, не найденные)"""
+    categories = category_cache.get(db_user)
+    by_name = {category.name.casefold(): category for category in categories}
+    active = [category for category in categories if not category.archived]
+    found, missing = [], []
+    for name in names:
+        category = by_name.get(name.casefold())
+        if category is None and name.isdigit() and 1 <= int(name) <= len(active):
+            category = active[int(name) - 1]
+        if category is None:
+            missing.append(name)
+        else:
+            found.append(category)
+    return found, missing
+
+async def apply_category_change(update, db_user, operation, done_text):
+    """Выполняет массовую операцию и сообщает результат"""
+    try:
+        categories = operation()
+    except (ValueError, LookupError) as e:
+        db.session.rollback()
+        await update.message.reply_text(f"Не удалось изменить категории: {e}")
+        return
+    notify_user_changed(db_user, 'categories_changed', {
+        'categories': [category_payload(category) for category in categories]
+    })
+    await update.message.reply_text(done_text)
+
+@with_app_context
+async def add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    names = split_args(context)
+    if not names:
+        await update.message.reply_text("Использование: /add_category Название1, Название2")
+        return
+    
+    await apply_category_change(
+        update, db_user, lambda: create_categories(db, db_user, names),
+        f"Добавлено категорий: {len(names)}"
+    )
+
+@with_app_context
+async def rename_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    pairs = [pair.split('=', 1) for pair in split_args(context, ';')]
+    if not pairs or any(len(pair) != 2 for pair in pairs):
+        await update.message.reply_text("Использование: /rename_category Старое = Новое; Другое = Разное")
+        return
+    
+    found, missing = resolve_categories(db_user, [old.strip() for old, _ in pairs])
+    if missing:
+        await update.message.reply_text(f"Категории не найдены: {', '.join(missing)}")
+        return
+    
+    renames = [(category.id, new) for category, (_, new) in zip(found, pairs)]
+    await apply_category_change(
+        update, db_user, lambda: rename_categories(db, db_user, renames),
+        f"Переименовано категорий: {len(renames)}"
+    )
+
+async def change_archived(update, context, archived):
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    command = 'archive_category' if archived else 'restore_category'
+    names = split_args(context)
+    if not names:
+        await update.message.reply_text(f"Использование: /{command} Название1, Название2")
+        return
+    
+    found, missing = resolve_categories(db_user, names)
+    if missing:
+        await update.message.reply_text(f"Категории не найдены: {', '.join(missing)}")
+        return
+    
+    ids = [category.id for category in found]
+    done_text = f"{'В архив' if archived else 'Из архива'}: {', '.join(category.name for category in found)}"
+    await apply_category_change(update, db_user, lambda: set_archived(db, db_user, ids, archived), done_text)
+
+@with_app_context
+async def archive_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await change_archived(update, context, True)
+
+@with_app_context
+async def restore_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await change_archived(update, context, False)
+
+@with_app_context
+async def reorder_categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    names = split_args(context)
+    if not names:
+        await update.message.reply_text("Использование: /reorder_categories 3, 1, 2 (номера или названия из /categories)")
+        return
+    
+    found, missing = resolve_categories(db_user, names)
+    if missing:
+        await update.message.reply_text(f"Категории не найдены: {', '.join(missing)}")
+        return
+    
+    ids = [category.id for category in found]
+    await apply_category_change(
+        update, db_user, lambda: reorder_categories(db, db_user, ids),
+        "Порядок категорий обновлен"
+    )
+
+@with_app_context
 async def statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     db_user = User.query.filter_by(telegram_id=user.id).first()
@@ -266,31 +446,303 @@ async def statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
         return
     
-    # Получаем статистику по категориям
-    categories = Category.query.filter_by(user_id=db_user.id).all()
+    # Получаем статистику по категориям одним запросом
+    totals = category_totals(db, db_user)
     
-    if not categories:
+    if not totals:
         await update.message.reply_text("У вас нет категорий")
         return
     
     message = "Статистика по категориям:\n\n"
-    for category in categories:
-        activities = Activity.query.filter_by(
-            category_id=category.id,
-            user_id=db_user.id
-        ).all()
-        
-        total_hours = 0
-        for activity in activities:
-            if activity.end_time:
-                duration = activity.end_time - activity.start_time
-                total_hours += duration.total_seconds() / 3600
-        
-        message += f"{category.name}:\n"
-        message += f"- Количество активностей: {len(activities)}\n"
-        message += f"- Общее время: {total_hours:.2f} часов\n\n"
+    for _, name, count, seconds in totals:
+        message += f"{name}:\n"
+        message += f"- Количество активностей: {count}\n"
+        message += f"- Общее время: {float(seconds) / 3600:.2f} часов\n\n"
     
     await update.message.reply_text(message)
+    
+    slices = [(name, float(seconds) / 3600) for _, name, _, seconds in totals if seconds > 0]
+    charts = [('week', 'last7', render_weekly_bars, (daily_minutes(db, db_user), db_user.daily_goal))]
+    if slices:
+        charts.append(('categories', 'all', render_category_pie, (slices,)))
+    try:
+        await send_charts(update.message, db_user, charts)
+    except Exception as e:
+        logger.error(f"Error sending statistics charts: {str(e)}")
+
+@with_app_context
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats"""
+    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not user:
+        await update.message.reply_text("Пользователь не найден. Используйте /start для начала работы.")
+        return
+    
+    # Получаем статистику за сегодня
+    today = datetime.now(pytz.UTC).date()
+    count_today, seconds_today = db.session.query(
+        db.func.count(Activity.id),
+        db.func.coalesce(db.func.sum(Activity.duration), 0)
+    ).filter(
+        Activity.user_id == user.id,
+        db.func.date(Activity.start_time) == today
+    ).one()
+    
+    total_today = int(seconds_today) // 60
+    
+    stats_text = (
+        f"📊 *Статистика за сегодня:*\n\n"
+        f"⏱ Общее время: {total_today} минут\n"
+        f"📝 Количество активностей: {count_today}\n"
+        f"🎯 Цель на день: {user.daily_goal} минут\n"
+        f"✨ Текущий уровень: {user.level}\n"
+        f"⭐️ Опыт: {user.xp} XP"
+    )
+    
+    await update.message.reply_text(stats_text, parse_mode='Markdown')
+    
+    try:
+        await send_charts(update.message, user, [
+            ('week', 'last7', render_weekly_bars, (daily_minutes(db, user), user.daily_goal))
+        ])
+    except Exception as e:
+        logger.error(f"Error sending stats chart: {str(e)}")
+
+@with_app_context
+async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /settings"""
+    user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not user:
+        await update.message.reply_text("Пользователь не найден. Используйте /start для начала работы.")
+        return
+    
+    settings_text = (
+        f"⚙️ *Текущие настройки:*\n\n"
+        f"🔔 Уведомления: {'включены' if user.notifications else 'выключены'}\n"
+        f"🎯 Цель на день: {user.daily_goal} минут\n"
+        f"⏰ Напоминание о перерыве: каждые {user.break_reminder} минут\n"
+        f"🎨 Тема: {user.theme}\n"
+        f"🌍 Часовой пояс: {user.timezone}\n\n"
+        "Для изменения настроек используйте веб-интерфейс."
+    )
+    
+    await update.message.reply_text(settings_text, parse_mode='Markdown')
+
+@with_app_context
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    db_user = User.query.filter_by(telegram_id=user.id).first()
+    
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    query = ' '.join(context.args or [])
+    if not query:
+        await update.message.reply_text("Использование: /find <текст>")
+        return
+    
+    results = search_activities(db, db_user.id, query, limit=10)
+    if not results:
+        await update.message.reply_text("Ничего не найдено")
+        return
+    
+    ids = [activity_id for activity_id, _ in results]
+    activities = {
+        activity.id: activity
+        for activity in Activity.query.options(db.joinedload(Activity.category)).filter(Activity.id.in_(ids)).all()
+    }
+    
+    message = f"Результаты поиска «{query}»:\n\n"
+    for activity_id in ids:
+        activity = activities.get(activity_id)
+        if activity:
+            message += (
+                f"- {activity.name} ({activity.category.name}, "
+                f"{activity.start_time.strftime('%Y-%m-%d %H:%M')})\n"
+            )
+    
+    await update.message.reply_text(message)
+
+@with_app_context
+async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /report <day|week|month|year> [число периодов]"""
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    args = context.args or []
+    try:
+        period = parse_report_period(args[0] if args else None)
+        count = int(args[1]) if len(args) > 1 else None
+        if count is not None and count < 1:
+            raise ValueError('Count must be positive')
+        first, last = parse_range(period, today=local_today(db_user.timezone), count=count)
+        data = get_report(db, db_user, period, first, last)
+    except ValueError:
+        await update.message.reply_text("Использование: /report <day|week|month|year> [число периодов]")
+        return
+    
+    await update.message.reply_text(format_user_report(data))
+
+@with_app_context
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /timezone <зона IANA>"""
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    if not context.args:
+        await update.message.reply_text(f"Часовой пояс: {db_user.timezone}\nИзменить: /timezone Europe/Moscow")
+        return
+    
+    try:
+        tz_name = resolve_timezone(context.args[0]).zone
+    except ValueError:
+        await update.message.reply_text("Неизвестный часовой пояс. Пример: /timezone Europe/Moscow")
+        return
+    
+    db_user.timezone = tz_name
+    db_user.touch()
+    db.session.commit()
+    notify_user_changed(db_user, 'settings', {'timezone': tz_name})
+    await update.message.reply_text(f"Часовой пояс для отчетов: {tz_name}")
+
+@with_app_context
+async def insights(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    db_user = User.query.filter_by(telegram_id=user.id).first()
+    
+    if not db_user:
+        await update.message.reply_text("Пожалуйста, сначала используйте команду /start")
+        return
+    
+    # NumPy загружается только при первом запросе аналитики
+    from insights import insights_cache
+    data = insights_cache.get(db, db_user, db_user.timezone)
+    averages = data['averages']
+    if not data['percentiles']['activity_minutes']:
+        await update.message.reply_text("Пока недостаточно завершенных активностей для аналитики")
+        return
+    
+    def rating(value):
+        return f"{value:.2f}" if value is not None else "нет оценок"
+    
+    message = "Аналитика продуктивности:\n\n"
+    message += f"Среднее время в день (7 дней): {averages['minutes_7d']:.0f} мин\n"
+    message += f"Среднее время в день (30 дней): {averages['minutes_30d']:.0f} мин\n"
+    message += f"Продуктивность (7 дней): {rating(averages['productivity_7d'])}\n"
+    message += f"Продуктивность (30 дней): {rating(averages['productivity_30d'])}\n"
+    
+    durations = data['percentiles']['activity_minutes']
+    message += f"\nДлительность активности: медиана {durations['p50']:.0f} мин, 90% - до {durations['p90']:.0f} мин\n"
+    
+    if data['best_hours']:
+        message += "\nЛучшие часы:\n"
+        for item in data['best_hours']:
+            message += f"- {item['hour']:02d}:00 - оценка {item['productivity']:.2f}\n"
+    
+    if data['categories']:
+        message += "\nКатегории за 7 дней:\n"
+        for item in data['categories']:
+            change = f" ({item['change']:+.0%})" if item['change'] is not None else ""
+            message += f"- {item['name']}: {item['minutes_7d']:.0f} мин{change}\n"
+    
+    await update.message.reply_text(message)
+
+async def require_group_chat(update):
+    if update.effective_chat.type not in GROUP_CHAT_TYPES:
+        await update.message.reply_text("Эта команда работает только в групповом чате")
+        return False
+    return True
+
+@with_app_context
+async def team_join(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_group_chat(update):
+        return
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user:
+        await update.message.reply_text("Сначала напишите боту /start в личных сообщениях")
+        return
+    
+    chat = update.effective_chat
+    team, joined = join_team(db, chat.id, chat.title, db_user)
+    if joined:
+        await update.message.reply_text(f"{update.effective_user.first_name} теперь в команде «{team.title}»")
+    else:
+        await update.message.reply_text("Вы уже в команде этого чата")
+
+@with_app_context
+async def team_leave(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_group_chat(update):
+        return
+    db_user = User.query.filter_by(telegram_id=update.effective_user.id).first()
+    if not db_user or not leave_team(db, update.effective_chat.id, db_user):
+        await update.message.reply_text("Вы не состоите в команде этого чата")
+        return
+    await update.message.reply_text(f"{update.effective_user.first_name} покинул(а) команду")
+
+@with_app_context
+async def team_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await require_group_chat(update):
+        return
+    try:
+        days = parse_period(context.args[0] if context.args else None)
+    except ValueError:
+        await update.message.reply_text("Использование: /team_stats [число дней]")
+        return
+    
+    team = find_team(update.effective_chat.id)
+    if not team:
+        await update.message.reply_text("В этом чате еще нет команды. Вступите в нее командой /team_join")
+        return
+    
+    await update.message.reply_text(format_report(get_team_report(db, team, days)))
+
+def build_application(token, request=None, base_url=None, concurrent_updates=False):
+    """Приложение бота со всеми обработчиками.
+
+    request - свой BaseRequest для вызовов Bot API (нагрузочные тесты
+    подставляют заглушку вместо сети), base_url - адрес сервера Bot API
+    вместо api.telegram.org (например, локальная заглушка
+    benchmarks/fake_telegram.py).
+    """
+    builder = Application.builder().token(token)
+    if concurrent_updates:
+        builder = builder.concurrent_updates(concurrent_updates)
+    if request is not None:
+        builder = builder.request(request)
+    if base_url is not None:
+        base_url = base_url.rstrip('/')
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
+    
+    # Регистрируем обработчики команд
+    application.add_handler(CommandHandler("start", profiler.bot_handler(start)))
+    application.add_handler(CommandHandler("help", profiler.bot_handler(help_command)))
+    application.add_handler(CommandHandler("start_activity", profiler.bot_handler(start_activity)))
+    application.add_handler(CommandHandler("stop_activity", profiler.bot_handler(stop_activity)))
+    application.add_handler(CommandHandler("status", profiler.bot_handler(status)))
+    application.add_handler(CommandHandler("categories", profiler.bot_handler(categories)))
+    application.add_handler(CommandHandler("add_category", profiler.bot_handler(add_category)))
+    application.add_handler(CommandHandler("rename_category", profiler.bot_handler(rename_category)))
+    application.add_handler(CommandHandler("archive_category", profiler.bot_handler(archive_category)))
+    application.add_handler(CommandHandler("restore_category", profiler.bot_handler(restore_category)))
+    application.add_handler(CommandHandler("reorder_categories", profiler.bot_handler(reorder_categories_command)))
+    application.add_handler(CommandHandler("stats", profiler.bot_handler(stats_command)))
+    application.add_handler(CommandHandler("statistics", profiler.bot_handler(statistics)))
+    application.add_handler(CommandHandler("settings", profiler.bot_handler(settings_command)))
+    application.add_handler(CommandHandler("find", profiler.bot_handler(find)))
+    application.add_handler(CommandHandler("insights", profiler.bot_handler(insights)))
+    application.add_handler(CommandHandler("report", profiler.bot_handler(report)))
+    application.add_handler(CommandHandler("timezone", profiler.bot_handler(timezone_command)))
+    application.add_handler(CommandHandler("team_join", profiler.bot_handler(team_join)))
+    application.add_handler(CommandHandler("team_leave", profiler.bot_handler(team_leave)))
+    application.add_handler(CommandHandler("team_stats", profiler.bot_handler(team_stats)))
+    application.add_handler(CallbackQueryHandler(profiler.bot_handler(button_handler)))
+    return application
 
 def main():
     try:
@@ -310,43 +762,48 @@ def main():
         logger.info(f"Bot ID: {bot_id}")
         logger.info("Token format is valid")
 
-        # Проверяем, не запущен ли уже бот
-        if is_bot_running():
-            logger.error("Another bot instance is already running")
-            sys.exit(1)
+        # Polling должен вести только один экземпляр: ждем лидерства
+        with app.app_context():
+            leader = LeaderLock(db.engine, 'telegram-bot')
+        atexit.register(leader.release)
+        atexit.register(shutdown_executor)
+        loop = asyncio.get_event_loop()
+        
+        while True:
+            leader.wait()
+            logger.info("Starting Telegram bot...")
             
-        # Создаем файл блокировки
-        create_lock()
+            application = build_application(token)
+            lost = threading.Event()
             
-        # Регистрируем очистку блокировки при выходе
-        atexit.register(cleanup_lock)
+            def on_lost(application=application, lost=lost):
+                # Блокировку сняла база (оборвалось соединение): другой
+                # экземпляр может начать polling, останавливаемся
+                lost.set()
+                loop.call_soon_threadsafe(application.stop_running)
             
-        logger.info("Starting Telegram bot...")
-        
-        # Создаем приложение бота
-        application = Application.builder().token(token).build()
-        
-        # Регистрируем обработчики команд
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("start_activity", start_activity))
-        application.add_handler(CommandHandler("stop_activity", stop_activity))
-        application.add_handler(CommandHandler("status", status))
-        application.add_handler(CommandHandler("categories", categories))
-        application.add_handler(CommandHandler("statistics", statistics))
-        application.add_handler(CallbackQueryHandler(button_handler))
-        
-        # Запускаем бота
-        application.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=Update.ALL_TYPES
-        )
+            watcher = leader.watch(on_lost)
+            # Запускаем бота. Накопившиеся обновления не сбрасываем: при смене
+            # лидера или перезапуске они должны быть обработаны новым экземпляром.
+            # SIGTERM останавливает polling и дожидается текущих обработчиков.
+            application.run_polling(
+                drop_pending_updates=False,
+                allowed_updates=Update.ALL_TYPES,
+                close_loop=False
+            )
+            watcher.set()
+            if not lost.is_set():
+                break
+            # Обработчики сигналов run_polling работают только при запущенном
+            # цикле - на время ожидания лидерства возвращаем стандартные
+            for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+                loop.remove_signal_handler(sig)
+            logger.warning("Leadership lost, polling stopped; waiting to become leader again")
     except Exception as e:
         logger.error(f"Error running bot: {str(e)}")
         if "401 Unauthorized" in str(e):
             logger.error("Bot token is invalid or has been revoked. Please check your TELEGRAM_BOT_TOKEN environment variable.")
             logger.error("Make sure you have copied the token correctly from BotFather and it is set in Railway variables.")
-        cleanup_lock()
         sys.exit(1)
 
 if __name__ == '__main__':
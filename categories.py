@@ -0,0 +1,140 @@
+"""Массовое управление категориями: создание, переименование, архив, порядок.
+
+Каждая операция принимает список и выполняется одной транзакцией: либо
+применяются все изменения, либо ни одного. Архивная категория скрыта из
+выбора при старте активности, но ее активности и статистика остаются.
+Названия уникальны у пользователя без учета регистра - по ним бот находит
+категории в командах.
+
+ValueError - некорректный запрос, LookupError - категория не найдена
+(или принадлежит другому пользователю). Commit выполняется здесь,
+notify_user_changed - за вызывающим кодом. Операции возвращают весь
+список категорий, перечитанный после commit одним запросом.
+"""
+import logging
+
+from models import Category
+
+logger = logging.getLogger(__name__)
+
+MAX_NAME_LENGTH = 80
+MAX_BATCH = 50
+
+
+def category_payload(category):
+    return {
+        'id': category.id,
+        'name': category.name,
+        'position': category.position,
+        'archived': category.archived,
+    }
+
+
+def user_categories(user):
+    return Category.query.filter_by(user_id=user.id).order_by(Category.position, Category.id).all()
+
+
+def clean_name(name):
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('Category name is required')
+    name = ' '.join(name.split())
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f"Category name is longer than {MAX_NAME_LENGTH} characters")
+    return name
+
+
+def list_param(data, key):
+    value = data.get(key)
+    if not isinstance(value, list):
+        raise ValueError(f"'{key}' must be a list")
+    return value
+
+
+def check_batch(items):
+    if not items:
+        raise ValueError('Nothing to change')
+    if len(items) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} categories per request")
+
+
+def owned(categories, ids):
+    """Категории пользователя по списку id в том же порядке"""
+    by_id = {category.id: category for category in categories}
+    selected = []
+    for category_id in ids:
+        valid = isinstance(category_id, int) and not isinstance(category_id, bool)
+        category = by_id.get(category_id) if valid else None
+        if category is None:
+            raise LookupError(f"Category {category_id} not found")
+        selected.append(category)
+    return selected
+
+
+def check_unique(categories, names, renamed=()):
+    """Новые названия не совпадают между собой и с оставшимися названиями пользователя"""
+    renamed_ids = {category.id for category in renamed}
+    taken = {category.name.casefold() for category in categories if category.id not in renamed_ids}
+    for name in names:
+        key = name.casefold()
+        if key in taken:
+            raise ValueError(f"Category '{name}' already exists")
+        taken.add(key)
+
+
+def create_categories(db, user, names):
+    check_batch(names)
+    names = [clean_name(name) for name in names]
+    categories = user_categories(user)
+    check_unique(categories, names)
+
+    position = max((category.position for category in categories), default=-1) + 1
+    created = [Category(name=name, user_id=user.id, position=position + i) for i, name in enumerate(names)]
+    db.session.add_all(created)
+    user.touch()
+    db.session.commit()
+    return user_categories(user)
+
+
+def rename_categories(db, user, renames):
+    """renames - список (id, новое название)"""
+    check_batch(renames)
+    categories = user_categories(user)
+    targets = owned(categories, [category_id for category_id, _ in renames])
+    names = [clean_name(name) for _, name in renames]
+    if len({category.id for category in targets}) != len(targets):
+        raise ValueError('Duplicate category id')
+    check_unique(categories, names, renamed=targets)
+
+    for category, name in zip(targets, names):
+        category.name = name
+    user.touch()
+    db.session.commit()
+    return user_categories(user)
+
+
+def set_archived(db, user, ids, archived=True):
+    check_batch(ids)
+    categories = user_categories(user)
+    for category in owned(categories, ids):
+        category.archived = archived
+    user.touch()
+    db.session.commit()
+    return user_categories(user)
+
+
+def reorder_categories(db, user, ids):
+    """Переданные категории - в начало в указанном порядке, остальные - следом в прежнем"""
+    check_batch(ids)
+    categories = user_categories(user)
+    first = owned(categories, ids)
+    if len({category.id for category in first}) != len(first):
+        raise ValueError('Duplicate category id')
+    first_ids = {category.id for category in first}
+    ordered = first + [category for category in categories if category.id not in first_ids]
+    for position, category in enumerate(ordered):
+        # Неизмененные строки не попадают в UPDATE
+        if category.position != position:
+            category.position = position
+    user.touch()
+    db.session.commit()
+    return user_categories(user)
@@ -0,0 +1,76 @@
+"""Кеш категорий пользователя для клавиатур бота и обработчика кнопок.
+
+Выбор категории и старт активности - самый частый путь в боте: клавиатура
+/start_activity и callback кнопки раньше каждый раз читали категории из
+базы. Теперь список категорий хранится в памяти процесса по (шард,
+user_id) вместе с users.categories_version, на которой он прочитан.
+
+Версию увеличивают события маппера Category (models.py) в той же
+транзакции, что и запись категории, поэтому кеш сбрасывается при любом
+изменении - из веба, бота или другого процесса - без отдельной рассылки:
+строка пользователя все равно загружается в каждом обработчике, и при
+совпадении версий запросов к categories нет.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from models import Category
+from sharding import current_shard
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = int(os.getenv('CATEGORY_CACHE_SIZE', 4096))
+
+CachedCategory = namedtuple('CachedCategory', ['id', 'name', 'position', 'archived'])
+
+
+class CategoryCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0}
+
+    def get(self, user):
+        """Все категории пользователя (и архивные) в порядке position"""
+        key = (current_shard(), user.id)
+        version = user.categories_version
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.metrics['hits'] += 1
+                return entry[1]
+            self.metrics['misses'] += 1
+
+        rows = Category.query.with_entities(
+            Category.id, Category.name, Category.position, Category.archived
+        ).filter(Category.user_id == user.id).order_by(Category.position, Category.id).all()
+        categories = tuple(CachedCategory(*row) for row in rows)
+
+        with self._lock:
+            self._entries[key] = (version, categories)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return categories
+
+    def active(self, user):
+        """Категории для выбора: без архивных"""
+        return [category for category in self.get(user) if not category.archived]
+
+    def find(self, user, category_id):
+        """Категория пользователя по id; None для чужой или несуществующей"""
+        for category in self.get(user):
+            if category.id == category_id:
+                return category
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.metrics, entries=len(self._entries))
+
+
+category_cache = CategoryCache()
@@ -0,0 +1,183 @@
+"""PNG-графики для отчетов бота: столбцы по дням недели и круговая по категориям.
+
+Отрисовка matplotlib занимает десятки миллисекунд CPU, поэтому выполняется
+в отдельном пуле процессов (CHART_WORKERS, по умолчанию 2), а цикл событий
+бота только ждет результат. Число одновременно ожидающих отрисовок тоже
+ограничено. Уже отправленная картинка не загружается повторно: Telegram
+возвращает file_id, который кешируется по (пользователь, график, период,
+версия данных) в общем кеше статистики.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from telegram import InputMediaPhoto
+
+from models import Activity, Category
+from stats_cache import stats_cache
+
+logger = logging.getLogger(__name__)
+
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', 2))
+MAX_PENDING = CHART_WORKERS * 4
+RENDER_TIMEOUT = 30
+WEEK_DAYS = 7
+WEEKDAY_NAMES = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+_executor = None
+_pending = None
+
+
+def category_totals(db, user):
+    """(id, название, число активностей, секунды завершенных) по категориям - один запрос"""
+    return db.session.query(
+        Category.id,
+        Category.name,
+        db.func.count(Activity.id),
+        db.func.coalesce(db.func.sum(Activity.duration), 0)
+    ).outerjoin(
+        Activity, (Activity.category_id == Category.id) & (Activity.user_id == user.id)
+    ).filter(
+        Category.user_id == user.id
+    ).group_by(Category.id, Category.name).order_by(Category.id).all()
+
+
+def daily_minutes(db, user, days=WEEK_DAYS, today=None):
+    """Минуты завершенных активностей по дням (UTC) за последние days дней"""
+    today = today or datetime.utcnow().date()
+    first_day = today - timedelta(days=days - 1)
+    day = db.func.date(Activity.start_time)
+    rows = db.session.query(day, db.func.sum(Activity.duration)).filter(
+        Activity.user_id == user.id,
+        Activity.start_time >= datetime.combine(first_day, datetime.min.time())
+    ).group_by(day).all()
+
+    totals = {str(row_day): float(total or 0) / 60 for row_day, total in rows}
+    dates = [first_day + timedelta(days=i) for i in range(days)]
+    return [(date, totals.get(date.isoformat(), 0)) for date in dates]
+
+
+def render_weekly_bars(points, daily_goal):
+    """PNG со столбцами минут по дням; выполняется в процессе пула"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    labels = [f"{WEEKDAY_NAMES[date.weekday()]}\n{date.strftime('%d.%m')}" for date, _ in points]
+    values = [minutes for _, minutes in points]
+    fig, ax = plt.subplots(figsize=(6, 3.5), dpi=120)
+    try:
+        bars = ax.bar(labels, values, color='#4caf50')
+        for bar, value in zip(bars, values):
+            if daily_goal and value >= daily_goal:
+                bar.set_color('#ff9800')
+        if daily_goal:
+            ax.axhline(daily_goal, color='#9e9e9e', linestyle='--', linewidth=1, label='Цель на день')
+            ax.legend(loc='upper left', fontsize=8)
+        ax.set_ylabel('Минуты')
+        ax.set_title('Время за неделю')
+        ax.spines[['top', 'right']].set_visible(False)
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def render_category_pie(slices):
+    """PNG с долями времени по категориям; выполняется в процессе пула"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(5, 4), dpi=120)
+    try:
+        ax.pie(
+            [hours for _, hours in slices],
+            labels=[name for name, _ in slices],
+            autopct='%1.0f%%',
+            startangle=90,
+            counterclock=False
+        )
+        ax.set_title('Время по категориям')
+        ax.axis('equal')
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn: процесс бота многопоточный, fork из него небезопасен
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def render(function, *args):
+    """Рисует график в пуле процессов, не блокируя цикл событий"""
+    global _pending
+    if _pending is None:
+        _pending = asyncio.Semaphore(MAX_PENDING)
+    async with _pending:
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(get_executor(), function, *args),
+                RENDER_TIMEOUT
+            )
+        except BrokenProcessPool:
+            # Упавший воркер ломает весь пул: следующий вызов создаст новый
+            shutdown_executor()
+            raise
+
+
+def chart_params(kind, period):
+    return (kind, period, datetime.utcnow().date())
+
+
+async def send_charts(message, user, charts):
+    """Отправляет графики одним альбомом.
+
+    charts - список (kind, period, function, args). Уже отправленные графики
+    берутся по file_id, остальные рисуются в пуле.
+    """
+    photos = []
+    uploaded = []
+    for kind, period, function, args in charts:
+        file_id = stats_cache.lookup('chart', user, chart_params(kind, period))
+        if file_id is None:
+            photos.append(await render(function, *args))
+            uploaded.append((kind, period))
+        else:
+            photos.append(file_id)
+            uploaded.append(None)
+
+    if len(photos) == 1:
+        sent = [await message.reply_photo(photos[0])]
+    else:
+        sent = await message.reply_media_group([InputMediaPhoto(photo) for photo in photos])
+
+    for sent_message, chart in zip(sent, uploaded):
+        if chart is not None and sent_message.photo:
+            stats_cache.store('chart', user, sent_message.photo[-1].file_id, chart_params(*chart))
+    return sent
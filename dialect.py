@@ -0,0 +1,81 @@
+"""Различия SQL-диалектов Postgres и SQLite для агрегаций на стороне базы."""
+from datetime import datetime
+
+import pytz
+from sqlalchemy import Date, Integer, case, cast, func, type_coerce
+
+PERIODS = ('day', 'week', 'month', 'year')
+
+
+def resolve_timezone(name):
+    """pytz-зона по имени IANA; ValueError для неизвестной зоны"""
+    try:
+        return pytz.timezone(name or 'UTC')
+    except pytz.UnknownTimeZoneError as e:
+        raise ValueError(f"Unknown timezone: {name}") from e
+
+
+def sqlite_offset_modifier(tz_name, at=None):
+    """Модификатор datetime() SQLite для сдвига UTC в локальное время зоны.
+
+    В SQLite нет базы часовых поясов, поэтому берется текущее смещение зоны
+    (без учета перехода на летнее время внутри диапазона).
+    """
+    tz = resolve_timezone(tz_name)
+    offset = tz.utcoffset((at or datetime.utcnow()).replace(tzinfo=None))
+    minutes = int(offset.total_seconds() // 60)
+    return f"{minutes:+d} minutes"
+
+
+def seconds_between(dialect_name, start, end):
+    """SQL-выражение: число секунд между двумя колонками DateTime"""
+    if dialect_name == 'postgresql':
+        return func.extract('epoch', end - start)
+    if dialect_name == 'sqlite':
+        return (func.julianday(end) - func.julianday(start)) * 86400
+    raise NotImplementedError(f"Date arithmetic is not implemented for {dialect_name}")
+
+
+def whole_minutes(dialect_name, seconds):
+    """Целые минуты (с округлением вниз) из неотрицательного числа секунд"""
+    if dialect_name == 'postgresql':
+        return cast(func.floor(seconds / 60), Integer)
+    return cast(seconds / 60, Integer)  # CAST в SQLite отбрасывает дробную часть
+
+
+def date_trunc(dialect_name, period, column, tz_name, at=None):
+    """SQL-выражение: дата начала периода в зоне tz_name, в который попадает UTC-время column.
+
+    Неделя начинается с понедельника. В Postgres - date_trunc по локальному
+    времени, в SQLite - strftime/date() со смещением зоны на момент at.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    if dialect_name == 'postgresql':
+        local = func.timezone(resolve_timezone(tz_name).zone, func.timezone('UTC', column))
+        return cast(func.date_trunc(period, local), Date)
+    if dialect_name == 'sqlite':
+        local = func.datetime(column, sqlite_offset_modifier(tz_name, at))
+        if period == 'day':
+            start = func.date(local)
+        elif period == 'week':
+            # 'weekday 0' - ближайшее воскресенье (или тот же день), минус 6 дней - понедельник
+            start = func.date(local, 'weekday 0', '-6 days')
+        elif period == 'month':
+            start = func.strftime('%Y-%m-01', local)
+        else:
+            start = func.strftime('%Y-01-01', local)
+        # Строка 'YYYY-MM-DD' - тип Date разбирает ее в datetime.date
+        return type_coerce(start, Date)
+    raise NotImplementedError(f"Date truncation is not implemented for {dialect_name}")
+
+
+def bucket_by_bounds(column, bounds):
+    """SQL-выражение: начало периода из bounds [(начало, начало в UTC, конец в UTC)], в который попадает column.
+
+    Для SQLite, где нет базы часовых поясов: границы периодов посчитаны в
+    Python и учитывают переход на летнее время внутри диапазона. Периоды
+    идут подряд; column раньше первого или позже последнего дает NULL.
+    """
+    whens = [(column < ends_at, start) for start, _, ends_at in bounds]
+    return type_coerce(case(*whens, else_=None), Date)
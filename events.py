@@ -0,0 +1,252 @@
+"""Pub/sub событий пользователя для SSE-потока.
+
+Внутри процесса события раздаются через EventBroker. Если веб и бот
+работают в разных процессах (или веб запущен в нескольких воркерах),
+включается транспорт через Postgres LISTEN/NOTIFY: publish() отправляет
+NOTIFY, а слушатель в каждом веб-процессе доставляет событие своим
+подписчикам.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import select
+import threading
+from collections import defaultdict
+
+from sqlalchemy import text
+
+from stats_cache import stats_cache
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'pixel_events'
+# Postgres отклоняет NOTIFY с полезной нагрузкой от 8000 байт
+MAX_NOTIFY_PAYLOAD = 7900
+
+
+class Subscription:
+    """Очередь событий одного SSE-клиента"""
+
+    def __init__(self, broker, telegram_id, maxsize):
+        self.broker = broker
+        self.telegram_id = telegram_id
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # Клиент не успевает читать: выбрасываем накопленное и просим перечитать данные
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait({'event': 'resync', 'data': {}})
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncSubscription:
+    """Очередь событий SSE-клиента ASGI-приложения.
+
+    Ожидание идет в цикле событий, а не в потоке: открытые потоки не
+    занимают пул потоков, через который пишут обработчики запросов.
+    Брокер кладет события из любого потока через call_soon_threadsafe.
+    """
+
+    def __init__(self, broker, telegram_id, maxsize, loop):
+        self.broker = broker
+        self.telegram_id = telegram_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Цикл событий уже остановлен, подписка вот-вот закроется
+            pass
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: выбрасываем накопленное и просим перечитать данные
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'event': 'resync', 'data': {}})
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self.transport = None
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, telegram_id):
+        return self._add(Subscription(self, telegram_id, self.max_queue))
+
+    def subscribe_async(self, telegram_id):
+        """Подписка для корутин: вызывается из работающего цикла событий"""
+        return self._add(AsyncSubscription(self, telegram_id, self.max_queue, asyncio.get_running_loop()))
+
+    def _add(self, subscription):
+        if self.transport is not None:
+            self.transport.ensure_listening()
+        telegram_id = subscription.telegram_id
+        with self._lock:
+            self._subscribers[telegram_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.telegram_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.telegram_id]
+
+    def publish(self, telegram_id, event, data=None):
+        """Публикует событие для всех подключений пользователя"""
+        message = {'event': event, 'data': data or {}}
+        if self.transport is not None:
+            try:
+                self.transport.send(telegram_id, message)
+                return
+            except Exception as e:
+                logger.error(f"Error sending event through {type(self.transport).__name__}: {str(e)}")
+        self.deliver(telegram_id, message)
+
+    def deliver(self, telegram_id, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(telegram_id, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class PostgresNotifyTransport:
+    """Доставка событий между процессами через LISTEN/NOTIFY"""
+
+    def __init__(self, broker, engine, channel=NOTIFY_CHANNEL):
+        self.broker = broker
+        self.engine = engine
+        self.channel = channel
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def send(self, telegram_id, message):
+        payload = json.dumps({'u': telegram_id, 'm': message}, separators=(',', ':'))
+        if len(payload.encode('utf-8')) >= MAX_NOTIFY_PAYLOAD:
+            # Большое событие (например, categories_changed с длинным списком)
+            # не влезает в NOTIFY: клиент перечитает данные сам
+            logger.info(f"Event '{message['event']}' is too large for NOTIFY, sending resync")
+            payload = json.dumps({'u': telegram_id, 'm': {'event': 'resync', 'data': {}}}, separators=(',', ':'))
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {'channel': self.channel, 'payload': payload})
+
+    def ensure_listening(self):
+        """Запускает поток-слушатель при первой подписке в этом процессе"""
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='events-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                connection = self.engine.raw_connection()
+                try:
+                    self._listen_on(connection.driver_connection)
+                finally:
+                    connection.close()
+            except Exception as e:
+                logger.error(f"Events listener error, reconnecting: {str(e)}")
+                threading.Event().wait(5)
+
+    def _listen_on(self, pg_connection):
+        pg_connection.autocommit = True
+        with pg_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        logger.info(f"Listening for events on channel {self.channel}")
+        while True:
+            if select.select([pg_connection], [], [], 30) == ([], [], []):
+                continue
+            pg_connection.poll()
+            while pg_connection.notifies:
+                notify = pg_connection.notifies.pop(0)
+                try:
+                    payload = json.loads(notify.payload)
+                    self.broker.deliver(payload['u'], payload['m'])
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Invalid event payload: {str(e)}")
+
+
+broker = EventBroker()
+
+
+def init_events(app, db):
+    """Выбирает транспорт событий по настройкам приложения.
+
+    EVENTS_TRANSPORT=memory|postgres; по умолчанию postgres для баз Postgres.
+    """
+    transport = os.getenv('EVENTS_TRANSPORT')
+    if transport is None:
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+        transport = 'postgres' if uri.startswith('postgresql') else 'memory'
+
+    if transport == 'postgres':
+        with app.app_context():
+            broker.transport = PostgresNotifyTransport(broker, db.engine)
+    else:
+        broker.transport = None
+    return broker
+
+
+def notify_user_changed(user, event=None, data=None):
+    """Публикует событие (если есть) и новую версию данных пользователя.
+
+    Вызывается после commit, когда user.data_version уже обновлена.
+    Заодно сбрасывает кеш статистики пользователя.
+    """
+    stats_cache.invalidate(user.telegram_id)
+    if event is not None:
+        broker.publish(user.telegram_id, event, data)
+    broker.publish(user.telegram_id, 'stats', {'version': user.data_version})
+
+
+def format_sse(event, data, event_id=None):
+    """Кадр text/event-stream"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {data}")
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,78 @@
+"""Проверки живости и готовности и прогрев пула соединений.
+
+/healthz не делает ввода-вывода: процесс жив и отвечает. /readyz
+выполняет SELECT 1 через пул на каждом шарде с общим таймаутом, поэтому
+балансировщик не шлет трафик воркеру, у которого нет базы. Проверка идет
+в отдельном потоке: зависшее соединение не держит поток запроса дольше
+READY_TIMEOUT, а следующая проверка, пока висит прошлая, сразу отвечает
+«не готов».
+
+warm_pool открывает при старте воркера pool_size соединений параллельно
+и возвращает их в пул, чтобы первые запросы после деплоя или
+масштабирования не ждали TCP и TLS рукопожатия с Postgres.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from sqlalchemy import text
+
+from sharding import fan_out, on_shard, shard_count
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT = float(os.getenv('READY_TIMEOUT', 2))
+
+_checker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='readyz')
+_pending = None
+_pending_lock = threading.Lock()
+
+
+def ping(db):
+    with db.engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+
+
+def check_ready(app, db, timeout=READY_TIMEOUT):
+    """(готов ли, описание ошибки) - SELECT 1 на всех шардах не дольше timeout"""
+    global _pending
+    with _pending_lock:
+        if _pending is not None and not _pending.done():
+            return False, 'previous check still running'
+        _pending = future = _checker.submit(fan_out, app, lambda shard: ping(db))
+    try:
+        future.result(timeout=timeout)
+    except TimeoutError:
+        return False, f"database did not answer in {timeout:g}s"
+    except Exception as e:
+        return False, str(e)
+    return True, None
+
+
+def warm_pool(app, db, size=None):
+    """Заполняет пул каждого шарда до size соединений (по умолчанию pool_size)"""
+    if size is None:
+        size = int(os.getenv('POOL_WARM_SIZE', app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).get('pool_size', 5)))
+    if size <= 0:
+        return 0
+    started = time.perf_counter()
+    opened = 0
+    for shard in range(shard_count()):
+        with on_shard(app, shard):
+            engine = db.engine
+        # Параллельно: рукопожатия идут одновременно, а не друг за другом
+        with ThreadPoolExecutor(max_workers=size, thread_name_prefix='pool-warmup') as pool:
+            futures = [pool.submit(engine.connect) for _ in range(size)]
+        connections = []
+        for future in futures:
+            try:
+                connections.append(future.result())
+            except Exception as e:
+                logger.error(f"Error warming connection pool on shard {shard}: {str(e)}")
+        opened += len(connections)
+        for connection in connections:
+            connection.close()
+    logger.info(f"Connection pool warmed: {opened} connections in {time.perf_counter() - started:.2f}s")
+    return opened
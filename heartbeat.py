@@ -0,0 +1,191 @@
+"""Heartbeat открытых активностей и автозакрытие брошенных таймеров.
+
+Mini App раз в HEARTBEAT_INTERVAL секунд сообщает, что таймер активности
+еще идет. Пинг только обновляет словарь в памяти процесса; фоновый поток
+раз в HEARTBEAT_FLUSH_SECONDS записывает накопленные отметки одним
+executemany UPDATE, поэтому число записей в базу не зависит от числа
+клиентов и частоты пингов.
+
+Тот же поток раз в HEARTBEAT_SWEEP_SECONDS закрывает активности, у которых
+last_heartbeat старше HEARTBEAT_STALE_SECONDS: окно Telegram закрыли, и
+таймер больше некому остановить. Активность завершается на последнем
+heartbeat, а не в момент обнаружения, так что длительность не раздувается.
+Активности без heartbeat (начатые в боте) не трогаются.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+
+from events import notify_user_changed
+from models import Activity, User
+from sharding import current_shard, fan_out, on_shard
+from tracking import finish_activity, finished_payload
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = int(os.getenv('HEARTBEAT_INTERVAL', 30))
+FLUSH_SECONDS = int(os.getenv('HEARTBEAT_FLUSH_SECONDS', 15))
+SWEEP_SECONDS = int(os.getenv('HEARTBEAT_SWEEP_SECONDS', 60))
+# Намного больше интервала сброса: отметка другого воркера успеет попасть в базу
+STALE_SECONDS = int(os.getenv('HEARTBEAT_STALE_SECONDS', 300))
+SWEEP_BATCH = 100
+
+
+class HeartbeatBuffer:
+    def __init__(self, flush_seconds=FLUSH_SECONDS, sweep_seconds=SWEEP_SECONDS, stale_seconds=STALE_SECONDS):
+        self.flush_seconds = flush_seconds
+        self.sweep_seconds = sweep_seconds
+        self.stale_seconds = stale_seconds
+        self.app = None
+        self.db = None
+        # Ключи - (шард, activity_id): id активностей на разных шардах совпадают
+        self._pending = {}
+        # (шард, activity_id) -> telegram_id владельца, проверенного при первом пинге
+        self._owners = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._last_sweep = 0.0
+        self.metrics = {'pings': 0, 'flushes': 0, 'rows_flushed': 0, 'swept': 0, 'errors': 0}
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        app.extensions['heartbeat'] = self
+        atexit.register(self.shutdown)
+
+    def owner(self, activity_id):
+        with self._lock:
+            return self._owners.get((current_shard(), activity_id))
+
+    def record(self, activity_id, telegram_id, at=None):
+        """Запоминает пинг (на шарде текущего запроса); в базу он попадет при следующем сбросе"""
+        key = (current_shard(), activity_id)
+        with self._lock:
+            self._pending[key] = at or datetime.utcnow()
+            self._owners[key] = telegram_id
+            self.metrics['pings'] += 1
+        self._ensure_worker()
+
+    def start(self):
+        """Запускает фоновый поток при старте воркера веба.
+
+        Проверка брошенных таймеров не должна ждать первого пинга: после
+        рестарта таймеры могли остаться только у закрытых клиентов.
+        """
+        self._ensure_worker()
+
+    def forget(self, activity_id):
+        """Активность завершена - ее пинги больше не нужны"""
+        key = (current_shard(), activity_id)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._owners.pop(key, None)
+
+    def _ensure_worker(self):
+        # Поток создается в процессе воркера (после fork gunicorn его еще нет) и
+        # перезапускается при пинге, если успел упасть
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name='heartbeat', daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+                if time.monotonic() - self._last_sweep >= self.sweep_seconds:
+                    self._last_sweep = time.monotonic()
+                    self.sweep()
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.error(f"Error in heartbeat worker: {str(e)}")
+
+    def flush(self):
+        """Записывает накопленные отметки: один UPDATE на пачку для каждого шарда"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        by_shard = {}
+        for (shard, activity_id), at in pending.items():
+            by_shard.setdefault(shard, []).append({'activity_id': activity_id, 'at': at})
+
+        activities = Activity.__table__
+        statement = activities.update().where(
+            activities.c.id == bindparam('activity_id'),
+            activities.c.end_time.is_(None)
+        ).values(last_heartbeat=bindparam('at'))
+        try:
+            for shard, rows in by_shard.items():
+                with on_shard(self.app, shard), self.db.engine.begin() as conn:
+                    conn.execute(statement, rows)
+                    flushed = {(shard, row['activity_id']) for row in rows}
+                pending = {key: at for key, at in pending.items() if key not in flushed}
+        except Exception:
+            # Не теряем отметки: более свежие пинги за это время важнее старых
+            with self._lock:
+                for key, at in pending.items():
+                    self._pending.setdefault(key, at)
+            raise
+        total = sum(len(rows) for rows in by_shard.values())
+        self.metrics['flushes'] += 1
+        self.metrics['rows_flushed'] += total
+        return total
+
+    def sweep(self, now=None):
+        """Закрывает активности с устаревшим heartbeat на всех шардах"""
+        return sum(fan_out(self.app, lambda shard: self._sweep_shard(now)))
+
+    def _sweep_shard(self, now=None):
+        db = self.db
+        deadline = (now or datetime.utcnow()) - timedelta(seconds=self.stale_seconds)
+        # SKIP LOCKED: воркеры, запустившие проверку одновременно, не закроют одно и то же
+        stale = Activity.query.filter(
+            Activity.end_time.is_(None),
+            Activity.last_heartbeat.isnot(None),
+            Activity.last_heartbeat < deadline
+        ).order_by(Activity.id).limit(SWEEP_BATCH).with_for_update(skip_locked=True).all()
+        if not stale:
+            db.session.rollback()
+            return 0
+
+        users = {user.id: user for user in User.query.filter(User.id.in_({a.user_id for a in stale})).all()}
+        closed = []
+        for activity in stale:
+            user = users[activity.user_id]
+            finish_activity(activity, user, now=activity.last_heartbeat)
+            closed.append((user, finished_payload(activity)))
+        db.session.commit()
+
+        for user, payload in closed:
+            self.forget(payload['id'])
+            notify_user_changed(user, 'activity_finished', payload)
+        with self._lock:
+            self.metrics['swept'] += len(closed)
+        logger.info(f"Closed {len(closed)} activities with stale heartbeat")
+        return len(closed)
+
+    def shutdown(self):
+        """Сбрасывает оставшиеся отметки (при остановке процесса)"""
+        if self.app is None:
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing heartbeats: {str(e)}")
+
+    def snapshot(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics['pending'] = len(self._pending)
+        return metrics
+
+
+heartbeats = HeartbeatBuffer()
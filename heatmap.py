@@ -0,0 +1,134 @@
+"""Тепловая карта по часам недели (7x24), считается одним SQL-запросом.
+
+Активность, пересекающая границы часов, делится на куски по часам:
+в Postgres через generate_series, в SQLite через рекурсивный CTE. Для
+каждой ячейки (категория, день недели, час) база возвращает минуты и
+сумму productivity * минуты, из которой считается средняя оценка,
+взвешенная по времени.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, bindparam, text
+
+from dialect import resolve_timezone, sqlite_offset_modifier
+from models import Category
+from stats_cache import stats_cache
+
+DAYS = 7
+HOURS = 24
+
+POSTGRES_HEATMAP = text("""
+    WITH local AS (
+        SELECT category_id, productivity,
+               timezone(:tz, timezone('UTC', start_time)) AS start_time,
+               timezone(:tz, timezone('UTC', end_time)) AS end_time
+        FROM activities
+        WHERE user_id = :user_id AND end_time IS NOT NULL
+          AND end_time > start_time AND start_time >= :since
+    ),
+    pieces AS (
+        SELECT local.category_id, local.productivity, h.hour,
+               EXTRACT(EPOCH FROM LEAST(local.end_time, h.hour + interval '1 hour')
+                                  - GREATEST(local.start_time, h.hour)) / 60 AS minutes
+        FROM local
+        CROSS JOIN LATERAL generate_series(
+            date_trunc('hour', local.start_time),
+            local.end_time - interval '1 microsecond',
+            interval '1 hour'
+        ) AS h(hour)
+    )
+    SELECT category_id,
+           CAST(EXTRACT(ISODOW FROM hour) AS INTEGER) - 1 AS day,
+           CAST(EXTRACT(HOUR FROM hour) AS INTEGER) AS hour,
+           SUM(minutes) AS minutes,
+           SUM(productivity * minutes) AS rated_sum,
+           SUM(CASE WHEN productivity IS NOT NULL THEN minutes ELSE 0 END) AS rated_minutes
+    FROM pieces
+    GROUP BY 1, 2, 3
+""").bindparams(bindparam('since', type_=DateTime()))
+
+SQLITE_HEATMAP = text("""
+    WITH RECURSIVE local AS (
+        SELECT category_id, productivity,
+               datetime(start_time, :offset) AS start_time,
+               datetime(end_time, :offset) AS end_time
+        FROM activities
+        WHERE user_id = :user_id AND end_time IS NOT NULL
+          AND end_time > start_time AND start_time >= :since
+    ),
+    hours(category_id, productivity, start_time, end_time, hour) AS (
+        SELECT category_id, productivity, start_time, end_time,
+               strftime('%Y-%m-%d %H:00:00', start_time)
+        FROM local
+        UNION ALL
+        SELECT category_id, productivity, start_time, end_time, datetime(hour, '+1 hour')
+        FROM hours
+        WHERE datetime(hour, '+1 hour') < end_time
+    ),
+    pieces AS (
+        SELECT category_id, productivity, hour,
+               (julianday(min(end_time, datetime(hour, '+1 hour')))
+                - julianday(max(start_time, hour))) * 1440 AS minutes
+        FROM hours
+    )
+    SELECT category_id,
+           (CAST(strftime('%w', hour) AS INTEGER) + 6) % 7 AS day,
+           CAST(strftime('%H', hour) AS INTEGER) AS hour,
+           SUM(minutes) AS minutes,
+           SUM(productivity * minutes) AS rated_sum,
+           SUM(CASE WHEN productivity IS NOT NULL THEN minutes ELSE 0 END) AS rated_minutes
+    FROM pieces
+    GROUP BY 1, 2, 3
+""").bindparams(bindparam('since', type_=DateTime()))
+
+def _empty_matrix():
+    return [[0] * HOURS for _ in range(DAYS)]
+
+
+def query_heatmap(db, user_id, tz_name='UTC', days=90):
+    """Строки (category_id, day, hour, minutes, rated_sum, rated_minutes); day 0 = понедельник"""
+    since = datetime.utcnow() - timedelta(days=days)
+    dialect_name = db.engine.dialect.name
+    if dialect_name == 'postgresql':
+        params = {'user_id': user_id, 'tz': resolve_timezone(tz_name).zone, 'since': since}
+        return db.session.execute(POSTGRES_HEATMAP, params).all()
+    if dialect_name == 'sqlite':
+        params = {'user_id': user_id, 'offset': sqlite_offset_modifier(tz_name), 'since': since}
+        return db.session.execute(SQLITE_HEATMAP, params).all()
+    raise NotImplementedError(f"Heatmap is not implemented for {dialect_name}")
+
+
+def build_heatmap(rows, categories, tz_name, days):
+    """Матрицы минут и средней продуктивности по категориям и в сумме"""
+    by_category = {}
+    total = _empty_matrix()
+    for category_id, day, hour, minutes, rated_sum, rated_minutes in rows:
+        cell = by_category.setdefault(category_id, {
+            'minutes': _empty_matrix(),
+            'productivity': [[None] * HOURS for _ in range(DAYS)],
+        })
+        cell['minutes'][day][hour] = round(minutes, 1)
+        if rated_minutes:
+            cell['productivity'][day][hour] = round(rated_sum / rated_minutes, 2)
+        total[day][hour] = round(total[day][hour] + minutes, 1)
+
+    return {
+        'timezone': tz_name,
+        'days': days,
+        'total': total,
+        'categories': [
+            {'id': category.id, 'name': category.name, **by_category[category.id]}
+            for category in categories
+            if category.id in by_category
+        ],
+    }
+
+
+def get_heatmap(db, user, tz_name='UTC', days=90):
+    """Тепловая карта из кеша статистики, если версия данных пользователя не менялась"""
+    def compute():
+        categories = Category.query.filter_by(user_id=user.id).order_by(Category.id).all()
+        return build_heatmap(query_heatmap(db, user.id, tz_name, days), categories, tz_name, days)
+
+    # Дата в ключе сдвигает окно days раз в сутки даже без новых данных
+    return stats_cache.get_or_compute('heatmap', user, compute, (tz_name, days, datetime.utcnow().date()))
@@ -0,0 +1,237 @@
+"""Аналитика продуктивности: скользящие средние, перцентили, лучшие часы, тренды.
+
+Для каждого пользователя в памяти хранятся NumPy-массивы завершенных
+активностей (начало, длительность, продуктивность, категория). При новых
+данных массивы дополняются только новыми строками: новыми id и теми, что
+при прошлой сборке еще были открыты. Все метрики считаются векторно.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from dialect import resolve_timezone
+from models import Activity, Category
+
+CACHE_SIZE = 512
+FULL_REBUILD_SECONDS = 6 * 3600  # Страховка от правок старых записей
+HISTORY_DAYS = 90
+SERIES_DAYS = 30
+MIN_BEST_HOUR_MINUTES = 30
+DAY = 86400
+
+
+def _epoch(value):
+    return (value - datetime(1970, 1, 1)).total_seconds() if value.tzinfo is None else value.timestamp()
+
+
+class UserSeries:
+    """Массивы активностей одного пользователя и данные для дозагрузки"""
+
+    def __init__(self):
+        self.starts = np.empty(0, dtype=np.float64)
+        self.durations = np.empty(0, dtype=np.float64)
+        self.productivity = np.empty(0, dtype=np.float64)
+        self.categories = np.empty(0, dtype=np.int64)
+        self.max_id = 0
+        self.open_ids = set()
+        self.version = None
+        self.built_at = time.monotonic()
+        self.results = {}
+        # Дозагрузка и расчеты над общим объектом идут по одному: иначе два
+        # запроса после изменения данных допишут одни и те же строки дважды
+        self.lock = threading.Lock()
+
+    def refresh(self, db, user):
+        """Догружает строки, завершенные с прошлой сборки"""
+        query = db.session.query(
+            Activity.id, Activity.start_time, Activity.end_time, Activity.duration,
+            Activity.productivity, Activity.category_id
+        ).filter(Activity.user_id == user.id)
+        if self.max_id:
+            condition = Activity.id > self.max_id
+            if self.open_ids:
+                condition = condition | Activity.id.in_(self.open_ids)
+            query = query.filter(condition)
+
+        starts, durations, productivity, categories = [], [], [], []
+        open_ids = set()
+        max_id = self.max_id
+        for activity_id, start_time, end_time, duration, rating, category_id in query:
+            max_id = max(max_id, activity_id)
+            if end_time is None:
+                open_ids.add(activity_id)
+                continue
+            starts.append(_epoch(start_time))
+            durations.append(float(duration or 0))
+            productivity.append(np.nan if rating is None else rating)
+            categories.append(category_id)
+
+        if starts:
+            self.starts = np.concatenate([self.starts, np.asarray(starts)])
+            self.durations = np.concatenate([self.durations, np.asarray(durations)])
+            self.productivity = np.concatenate([self.productivity, np.asarray(productivity, dtype=np.float64)])
+            self.categories = np.concatenate([self.categories, np.asarray(categories, dtype=np.int64)])
+            self.results.clear()
+        self.max_id = max_id
+        self.open_ids = open_ids
+        self.version = user.data_version
+
+
+def _rolling_mean(values, window):
+    """Скользящее среднее с неполным окном в начале ряда"""
+    sums = np.cumsum(np.insert(values, 0, 0.0))
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return (sums[1:] - sums[np.maximum(np.arange(1, len(values) + 1) - window, 0)]) / counts
+
+
+def _weighted_mean(values, weights):
+    mask = ~np.isnan(values) & (weights > 0)
+    if not mask.any():
+        return None
+    return float(np.average(values[mask], weights=weights[mask]))
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return None
+    p25, p50, p75, p90 = np.percentile(values, [25, 50, 75, 90])
+    return {'p25': round(float(p25), 1), 'p50': round(float(p50), 1),
+            'p75': round(float(p75), 1), 'p90': round(float(p90), 1)}
+
+
+def _round(value, digits=2):
+    return None if value is None else round(value, digits)
+
+
+def compute_insights(series, category_names, tz_name, now=None):
+    tz = resolve_timezone(tz_name)
+    now = now or datetime.utcnow()
+    offset = tz.utcoffset(now).total_seconds()
+
+    # Индекс локального дня для каждой активности; последний день - сегодня
+    local_starts = series.starts + offset
+    today = int((_epoch(now) + offset) // DAY)
+    day_index = (local_starts // DAY).astype(np.int64) - (today - HISTORY_DAYS + 1)
+    in_window = day_index >= 0
+    days = day_index[in_window]
+    durations = series.durations[in_window]
+    minutes = durations / 60
+    rating = series.productivity[in_window]
+    categories = series.categories[in_window]
+
+    daily_minutes = np.bincount(days, weights=minutes, minlength=HISTORY_DAYS)[:HISTORY_DAYS]
+    rated = ~np.isnan(rating)
+    daily_rated_minutes = np.bincount(days[rated], weights=minutes[rated], minlength=HISTORY_DAYS)[:HISTORY_DAYS]
+    daily_rated_sum = np.bincount(days[rated], weights=(rating * minutes)[rated], minlength=HISTORY_DAYS)[:HISTORY_DAYS]
+
+    rolling_7 = _rolling_mean(daily_minutes, 7)
+    rolling_30 = _rolling_mean(daily_minutes, 30)
+
+    def productivity_for_last(n):
+        rated_minutes = daily_rated_minutes[-n:].sum()
+        return float(daily_rated_sum[-n:].sum() / rated_minutes) if rated_minutes else None
+
+    # Лучшие часы: средняя продуктивность по часу начала, взвешенная по длительности
+    hours = ((local_starts[in_window] % DAY) // 3600).astype(np.int64)
+    hour_minutes = np.bincount(hours[rated], weights=minutes[rated], minlength=24)
+    hour_sum = np.bincount(hours[rated], weights=(rating * minutes)[rated], minlength=24)
+    eligible = np.flatnonzero(hour_minutes >= MIN_BEST_HOUR_MINUTES)
+    hour_productivity = hour_sum[eligible] / hour_minutes[eligible]
+    best = eligible[np.argsort(-hour_productivity, kind='stable')[:3]]
+
+    # Тренды по категориям: последние 7 дней против предыдущих 7 и наклон за 30 дней
+    category_ids = np.unique(categories)
+    trend_x = np.arange(SERIES_DAYS, dtype=np.float64)
+    category_trends = []
+    for category_id in category_ids:
+        mask = categories == category_id
+        per_day = np.bincount(days[mask], weights=minutes[mask], minlength=HISTORY_DAYS)[:HISTORY_DAYS]
+        last_7 = float(per_day[-7:].sum())
+        previous_7 = float(per_day[-14:-7].sum())
+        slope = float(np.polyfit(trend_x, per_day[-SERIES_DAYS:], 1)[0])
+        category_trends.append({
+            'id': int(category_id),
+            'name': category_names.get(int(category_id)),
+            'minutes_7d': round(last_7, 1),
+            'minutes_prev_7d': round(previous_7, 1),
+            'change': round((last_7 - previous_7) / previous_7, 3) if previous_7 else None,
+            'trend_per_day': round(slope, 2),
+        })
+    category_trends.sort(key=lambda item: item['minutes_7d'], reverse=True)
+
+    first_day = datetime.utcfromtimestamp((today - SERIES_DAYS + 1) * DAY).date()
+    return {
+        'timezone': tz_name,
+        'daily': {
+            'dates': [(first_day + timedelta(days=i)).isoformat() for i in range(SERIES_DAYS)],
+            'minutes': np.round(daily_minutes[-SERIES_DAYS:], 1).tolist(),
+            'rolling_7': np.round(rolling_7[-SERIES_DAYS:], 1).tolist(),
+            'rolling_30': np.round(rolling_30[-SERIES_DAYS:], 1).tolist(),
+        },
+        'averages': {
+            'minutes_7d': round(float(rolling_7[-1]), 1),
+            'minutes_30d': round(float(rolling_30[-1]), 1),
+            'productivity_7d': _round(productivity_for_last(7)),
+            'productivity_30d': _round(productivity_for_last(30)),
+            'productivity_all': _round(_weighted_mean(series.productivity, series.durations)),
+        },
+        'percentiles': {
+            'activity_minutes': _percentiles(minutes),
+            'daily_minutes': _percentiles(daily_minutes[-SERIES_DAYS:]),
+        },
+        'best_hours': [
+            {
+                'hour': int(hour),
+                'productivity': round(float(hour_sum[hour] / hour_minutes[hour]), 2),
+                'minutes': round(float(hour_minutes[hour]), 1),
+            }
+            for hour in best
+        ],
+        'categories': category_trends,
+    }
+
+
+class InsightsCache:
+    """LRU массивов по пользователям с инкрементальной дозагрузкой"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db, user, tz_name='UTC'):
+        with self._lock:
+            series = self._series.get(user.telegram_id)
+            if series is not None:
+                self._series.move_to_end(user.telegram_id)
+
+        if series is None or time.monotonic() - series.built_at > FULL_REBUILD_SECONDS:
+            series = UserSeries()
+
+        with series.lock:
+            # Версию проверяем под блокировкой: ожидавший запрос не повторит
+            # дозагрузку, которую уже сделал предыдущий
+            if series.version != user.data_version:
+                series.refresh(db, user)
+
+            key = (tz_name, datetime.utcnow().date())
+            result = series.results.get(key)
+            if result is None:
+                category_names = dict(
+                    db.session.query(Category.id, Category.name).filter(Category.user_id == user.id)
+                )
+                result = compute_insights(series, category_names, tz_name)
+                series.results[key] = result
+
+        with self._lock:
+            self._series[user.telegram_id] = series
+            self._series.move_to_end(user.telegram_id)
+            while len(self._series) > self.size:
+                self._series.popitem(last=False)
+        return result
+
+
+insights_cache = InsightsCache()
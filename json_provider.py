@@ -0,0 +1,96 @@
+"""JSON-провайдер Flask на orjson с запасным вариантом на stdlib json."""
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен - работаем на stdlib
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = (
+        orjson.OPT_NAIVE_UTC
+        | orjson.OPT_UTC_Z
+        | orjson.OPT_OMIT_MICROSECONDS
+        | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def compact_number(value, digits=1):
+    """Возвращает int для целых значений и округленный float для остальных"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, float):
+        return round(value, digits)
+    return value
+
+
+def _format_datetime(value):
+    """ISO 8601 с точностью до секунды; наивные даты считаются UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+
+
+def _default(value):
+    """Сериализация типов, которые не умеет json/orjson"""
+    if isinstance(value, datetime):
+        return _format_datetime(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return compact_number(float(value))
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(
+        obj, default=_default, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+
+
+# Кодировщик по умолчанию: orjson, если установлен
+dumps_bytes = _orjson_dumps if orjson is not None else _stdlib_dumps
+
+
+class FastJSONProvider(JSONProvider):
+    """Компактный JSON без сортировки ключей и отступов.
+
+    Использует orjson, если он установлен, иначе stdlib json с теми же
+    правилами кодирования дат.
+    """
+
+    mimetype = 'application/json'
+    _encode = staticmethod(dumps_bytes)
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+
+
+class StdlibJSONProvider(FastJSONProvider):
+    """Тот же формат, но всегда через stdlib json (для сравнения в бенчмарках)"""
+
+    _encode = staticmethod(_stdlib_dumps)
+
+    def loads(self, s, **kwargs):
+        return json.loads(s, **kwargs)
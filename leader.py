@@ -0,0 +1,167 @@
+"""Выбор единственного лидера среди процессов (например, для polling бота).
+
+На Postgres используется advisory lock на отдельном соединении: блокировка
+держится, пока живо соединение, и снимается базой автоматически, если
+процесс упал. Если соединение оборвется (перезапуск сервера, таймаут,
+сеть), база снимет блокировку молча, поэтому лидер проверяет ее в фоне
+(watch) и при потере прекращает работу. Для остальных баз (локальная SQLite) - flock на файл, который
+ОС тоже снимает при завершении процесса. В отличие от PID-файла, лидерство
+не "залипает" после падения и работает между контейнерами с общей базой.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', 10))
+
+# bigint-ключ pg_advisory_lock виден в pg_locks как classid (старшие 32 бита) и objid
+HELD_SQL = (
+    "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND granted "
+    "AND pid = pg_backend_pid() AND objsubid = 1 AND classid::bigint = %s AND objid::bigint = %s"
+)
+
+
+def lock_key(name):
+    """64-битный ключ advisory lock из имени"""
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+
+
+def lock_oids(key):
+    """(classid, objid) ключа в pg_locks"""
+    unsigned = key & 0xFFFFFFFFFFFFFFFF
+    return unsigned >> 32, unsigned & 0xFFFFFFFF
+
+
+class LeaderLock:
+    def __init__(self, engine, name):
+        self.engine = engine
+        self.name = name
+        self._connection = None
+        self._file = None
+
+    @property
+    def is_leader(self):
+        return self._connection is not None or self._file is not None
+
+    def try_acquire(self):
+        if self.is_leader:
+            return True
+        if self.engine.dialect.name == 'postgresql':
+            return self._try_acquire_advisory()
+        return self._try_acquire_file()
+
+    def wait(self, poll_interval=5.0):
+        """Блокируется, пока процесс не станет лидером"""
+        announced = False
+        while not self.try_acquire():
+            if not announced:
+                logger.info(f"Another instance holds leadership for '{self.name}', waiting")
+                announced = True
+            time.sleep(poll_interval)
+        logger.info(f"Acquired leadership for '{self.name}'")
+
+    def check(self):
+        """Держит ли процесс лидерство: соединение живо и блокировка на нем"""
+        if self._connection is None:
+            return self._file is not None
+        try:
+            cursor = self._connection.cursor()
+            try:
+                cursor.execute(HELD_SQL, lock_oids(lock_key(self.name)))
+                held = cursor.fetchone()[0] > 0
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.error(f"Error checking leader lock: {str(e)}")
+            held = False
+        if not held:
+            logger.warning(f"Lost leadership for '{self.name}'")
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+        return held
+
+    def watch(self, on_lost, interval=LEADER_CHECK_INTERVAL):
+        """Проверяет лидерство в фоновом потоке; on_lost вызывается один раз при потере.
+
+        Возвращает Event: set() останавливает проверку.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                if not self.check():
+                    on_lost()
+                    return
+
+        threading.Thread(target=run, name=f"leader-watch-{self.name}", daemon=True).start()
+        return stop
+
+    def release(self):
+        if self._connection is not None:
+            try:
+                cursor = self._connection.cursor()
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (lock_key(self.name),))
+                cursor.close()
+                self._connection.close()
+            except Exception as e:
+                logger.error(f"Error releasing leader lock: {str(e)}")
+            self._connection = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _try_acquire_advisory(self):
+        # Отдельное соединение вне пула: лидерство живет ровно столько, сколько оно
+        connection = self.engine.raw_connection()
+        connection.detach()
+        connection.driver_connection.autocommit = True
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (lock_key(self.name),))
+            acquired = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        if acquired:
+            self._connection = connection
+        else:
+            connection.close()
+        return acquired
+
+    def _try_acquire_file(self):
+        if fcntl is None:
+            logger.warning("File locks are not supported on this platform, assuming leadership")
+            self._file = open(os.devnull)
+            return True
+        path = os.path.join(tempfile.gettempdir(), f"pixel-tracker-{self.name}.lock")
+        lock_file = open(path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
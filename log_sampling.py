@@ -0,0 +1,19 @@
+"""Выборочное debug-логирование для горячих путей."""
+import logging
+import os
+import random
+
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv('PAYLOAD_LOG_SAMPLE_RATE', '0.01'))
+
+
+def sampled_debug(logger, msg, *args, rate=None):
+    """Пишет debug-сообщение для доли вызовов, заданной rate.
+
+    Форматирование откладывается до записи, поэтому при выключенном
+    DEBUG вызов стоит одну проверку уровня.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= (PAYLOAD_LOG_SAMPLE_RATE if rate is None else rate):
+        return
+    logger.debug(msg, *args)
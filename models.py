@@ -0,0 +1,215 @@
+"""Модели данных, общие для веб-приложения и бота."""
+from datetime import datetime, timezone
+import asyncio
+
+from sqlalchemy import event, inspect
+
+from sharding import ShardedSQLAlchemy
+
+db = ShardedSQLAlchemy()
+
+DEFAULT_CATEGORIES = ['Работа', 'Учеба', 'Отдых', 'Спорт', 'Другое']
+
+class User(db.Model):
+    __tablename__ = 'users'
+    id = db.Column(db.Integer, primary_key=True)
+    telegram_id = db.Column(db.BigInteger, unique=True)
+    username = db.Column(db.String(80))
+    first_name = db.Column(db.String(80))
+    last_name = db.Column(db.String(80))
+    level = db.Column(db.Integer, default=1)
+    xp = db.Column(db.Integer, default=0)
+    theme = db.Column(db.String(20), default='light')
+    notifications = db.Column(db.Boolean, default=True)
+    daily_goal = db.Column(db.Integer, default=120)  # Цель в минутах
+    break_reminder = db.Column(db.Integer, default=60)  # Напоминание о перерыве каждые X минут
+    timezone = db.Column(db.String(64), default='UTC', nullable=False)  # IANA-зона для отчетов
+    data_version = db.Column(db.Integer, default=0, nullable=False)  # Растет при каждом изменении данных
+    categories_version = db.Column(db.Integer, default=0, nullable=False)  # Растет при изменении категорий (см. category_cache)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    activities = db.relationship('Activity', backref='user', lazy=True)
+    categories = db.relationship('Category', backref='user', lazy=True)
+    achievements = db.relationship('Achievement', backref='user', lazy=True)
+
+    def touch(self):
+        """Атомарно увеличивает версию данных пользователя при следующем commit"""
+        self.data_version = User.data_version + 1
+
+    def calculate_level(self):
+        new_level = 1 + (self.xp // 1000)
+        if new_level > self.level:
+            self.level = new_level
+            return True
+        return False
+
+    def add_xp(self, amount):
+        self.xp += amount
+        if self.calculate_level():
+            asyncio.run(self.notify_level_up())
+        db.session.commit()
+
+    async def notify_level_up(self):
+        if self.notifications:
+            await bot.send_message(
+                chat_id=self.telegram_id,
+                text=f'🎉 Поздравляем! Вы достигли уровня {self.level}!'
+            )
+
+class Category(db.Model):
+    __tablename__ = 'categories'
+    __table_args__ = (
+        # Дельта-синхронизация: WHERE user_id = ? AND updated_at > ?
+        db.Index('ix_categories_user_updated', 'user_id', 'updated_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    position = db.Column(db.Integer, default=0, nullable=False)  # Порядок в списках и клавиатурах
+    archived = db.Column(db.Boolean, default=False, nullable=False)  # Скрыта из выбора, история сохраняется
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    activities = db.relationship('Activity', backref='category', lazy=True)
+
+class Activity(db.Model):
+    __tablename__ = 'activities'
+    __table_args__ = (
+        # Keyset-пагинация истории: WHERE user_id = ? AND (start_time, id) < (?, ?)
+        db.Index('ix_activities_user_start_id', 'user_id', 'start_time', 'id'),
+        # Дельта-синхронизация: WHERE user_id = ? AND (updated_at, id) > (?, ?)
+        db.Index('ix_activities_user_updated_id', 'user_id', 'updated_at', 'id'),
+        # Поиск брошенных таймеров: WHERE end_time IS NULL AND last_heartbeat < ?
+        db.Index('ix_activities_open_heartbeat', 'end_time', 'last_heartbeat'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime)
+    duration = db.Column(db.Integer)  # в секундах
+    notes = db.Column(db.Text)
+    productivity = db.Column(db.Integer)  # Оценка продуктивности (1-5)
+    last_heartbeat = db.Column(db.DateTime)  # Последний пинг открытого таймера из Mini App
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Achievement(db.Model):
+    __tablename__ = 'achievements'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.String(200), nullable=False)
+    icon = db.Column(db.String(50), nullable=False)
+    earned_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Team(db.Model):
+    """Команда, привязанная к групповому чату Telegram"""
+    __tablename__ = 'teams'
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.BigInteger, unique=True, nullable=False)
+    title = db.Column(db.String(255))
+    data_version = db.Column(db.Integer, default=0, nullable=False)  # Растет при вступлении и выходе участников
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    members = db.relationship('TeamMember', backref='team', lazy=True)
+
+class TeamMember(db.Model):
+    __tablename__ = 'team_members'
+    __table_args__ = (
+        db.Index('ix_team_members_user', 'user_id'),
+    )
+    team_id = db.Column(db.Integer, db.ForeignKey('teams.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User')
+
+class Tombstone(db.Model):
+    """Отметка об удалении строки для дельта-синхронизации (/api/sync)"""
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        db.Index('ix_tombstones_user_deleted', 'user_id', 'deleted_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(20), nullable=False)  # 'category' или 'activity'
+    entity_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class ReportRollup(db.Model):
+    """Итоги закрытого периода для /api/reports: после конца периода они не меняются"""
+    __tablename__ = 'report_rollups'
+    __table_args__ = (
+        db.Index('ix_report_rollups_user_span', 'user_id', 'starts_at'),
+    )
+    user_id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), primary_key=True)  # day, week, month, year
+    timezone = db.Column(db.String(64), primary_key=True)
+    starts_on = db.Column(db.Date, primary_key=True)  # Начало периода в зоне timezone
+    starts_at = db.Column(db.DateTime, nullable=False)  # Границы периода в UTC
+    ends_at = db.Column(db.DateTime, nullable=False)
+    seconds = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    categories = db.Column(db.JSON, nullable=False)  # [[category_id, seconds, count], ...]
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def _record_deletion(entity):
+    def listener(mapper, connection, target):
+        # Пишем в той же транзакции, что и DELETE. Массовый query.delete()
+        # событий не вызывает - такие удаления нужно отмечать вручную.
+        connection.execute(Tombstone.__table__.insert().values(
+            user_id=target.user_id,
+            entity=entity,
+            entity_id=target.id,
+            deleted_at=datetime.utcnow()
+        ))
+    return listener
+
+def _bump_categories_version(mapper, connection, target):
+    # Любая запись категории (из веба, бота или init_db) меняет версию
+    # категорий владельца в той же транзакции - так кеши категорий во всех
+    # процессах узнают об изменении по уже загруженной строке пользователя
+    users = User.__table__
+    connection.execute(users.update().where(users.c.id == target.user_id).values(
+        categories_version=users.c.categories_version + 1
+    ))
+
+def _drop_rollups(connection, user_id, start_time):
+    rollups = ReportRollup.__table__
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+    connection.execute(rollups.delete().where(
+        rollups.c.user_id == user_id,
+        rollups.c.starts_at <= start_time,
+        rollups.c.ends_at > start_time
+    ))
+
+def _activity_deleted(mapper, connection, target):
+    _drop_rollups(connection, target.user_id, target.start_time)
+
+def _activity_updated(mapper, connection, target):
+    state = inspect(target)
+    end_time = state.attrs.end_time.history
+    # Завершение открытой активности (end_time был NULL) закрытые итоги не
+    # трогает: период с открытой активностью не сохраняется (см. reports.py).
+    # Если прежнее значение неизвестно, считаем это правкой.
+    closed_now = end_time.added and end_time.added[0] is not None and list(end_time.deleted) == [None]
+    start_time = state.attrs.start_time.history
+    if start_time.has_changes():
+        # Активность уходит из периода прежнего начала и приходит в период нового
+        for previous in start_time.deleted:
+            if previous is not None:
+                _drop_rollups(connection, target.user_id, previous)
+        _drop_rollups(connection, target.user_id, target.start_time)
+        return
+    if closed_now:
+        return
+    changed = (end_time, state.attrs.duration.history, state.attrs.category_id.history)
+    if any(history.has_changes() for history in changed):
+        _drop_rollups(connection, target.user_id, target.start_time)
+
+event.listen(Category, 'after_delete', _record_deletion('category'))
+event.listen(Activity, 'after_delete', _record_deletion('activity'))
+event.listen(Activity, 'after_delete', _activity_deleted)
+event.listen(Activity, 'after_update', _activity_updated)
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event, _bump_categories_version)
@@ -0,0 +1,43 @@
+"""Keyset-пагинация: непрозрачные курсоры и разбор параметров диапазона."""
+import base64
+import json
+from datetime import datetime, timezone
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(start_time, activity_id):
+    """Курсор на позицию после записи (start_time, id)"""
+    raw = json.dumps({'t': start_time.isoformat(), 'i': activity_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (start_time, id); ValueError для поврежденного курсора"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        start_time = datetime.fromisoformat(data['t'])
+        if start_time.tzinfo is not None:
+            start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+        return start_time, int(data['i'])
+    except (TypeError, KeyError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    limit = int(value)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_datetime_param(value):
+    """ISO-дата или дата-время из запроса в наивное UTC, как хранится в БД"""
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
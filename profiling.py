@@ -0,0 +1,208 @@
+"""Выборочное профилирование запросов Flask и обработчиков бота (по желанию).
+
+Включается переменной PROFILE_SAMPLE_RATE (доля профилируемых вызовов,
+например 0.01). Если она не задана или равна 0, хуки не регистрируются
+вовсе и накладных расходов нет.
+
+Профилировщик сэмплирующий: один фоновый поток раз в PROFILE_INTERVAL_MS
+(по умолчанию 5 мс) снимает стек каждого профилируемого потока через
+sys._current_frames(). Результат - collapsed stacks ("a;b;c 12"),
+которые понимают flamegraph.pl и speedscope. Каждый профиль помечен видом
+(request/bot), маршрутом или командой и telegram_id пользователя.
+
+Последние PROFILE_KEEP профилей хранятся в памяти (их отдают служебные
+маршруты /api/admin/profiles); если задан PROFILE_DIR, каждый профиль
+еще и пишется туда файлом *.collapsed.
+"""
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from functools import wraps
+
+from flask import g, request
+
+from ratelimit import extract_telegram_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCLUDE = {'static', 'hashed_static', 'stream_events', 'admin_profiles', 'admin_profile', 'healthz', 'readyz'}
+MAX_STACK_DEPTH = 128
+
+
+class Profile:
+    def __init__(self, profile_id, kind, name, user_id, thread_id):
+        self.id = profile_id
+        self.kind = kind
+        self.name = name
+        self.user_id = user_id
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.stacks = Counter()
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'user_id': self.user_id,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 1) if self.duration is not None else None,
+            'samples': self.samples,
+        }
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """Стек от корня к листу через ';'"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profiler:
+    def __init__(self, sample_rate=None, interval=None, directory=None, keep=None, exclude=None):
+        self.sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', 0) if sample_rate is None else sample_rate)
+        self.interval = (int(os.getenv('PROFILE_INTERVAL_MS', 5)) if interval is None else interval) / 1000
+        self.directory = os.getenv('PROFILE_DIR') if directory is None else directory
+        self.keep = int(os.getenv('PROFILE_KEEP', 200)) if keep is None else keep
+        if exclude is None:
+            exclude = set(filter(None, os.getenv('PROFILE_EXCLUDE', '').split(','))) or DEFAULT_EXCLUDE
+        self.exclude = exclude
+        self.profiles = deque(maxlen=self.keep)
+        self._active = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    # --- сэмплирование ---
+
+    def _ensure_sampler(self):
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for profile in active:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.stacks[collapse_stack(frame)] += 1
+
+    def start(self, kind, name, user_id=None):
+        """Начинает профиль текущего потока, если вызов попал в выборку"""
+        if random.random() >= self.sample_rate:
+            return None
+        profile = Profile(next(self._ids), kind, name, user_id, threading.get_ident())
+        with self._lock:
+            self._active[profile.id] = profile
+        self._ensure_sampler()
+        return profile
+
+    def stop(self, profile):
+        with self._lock:
+            self._active.pop(profile.id, None)
+        profile.duration = time.perf_counter() - profile.started
+        self.profiles.append(profile)
+        if self.directory:
+            try:
+                self._write(profile)
+            except OSError as e:
+                logger.error(f"Error writing profile: {str(e)}")
+
+    def _write(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = re.sub(r'[^\w.-]+', '_', str(profile.name))
+        filename = (
+            f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(profile.started_at))}-{os.getpid()}-{profile.id}"
+            f"-{profile.kind}-{safe_name}-{profile.user_id or 'anon'}.collapsed"
+        )
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            f.write(profile.collapsed())
+
+    # --- выборка для служебных маршрутов ---
+
+    def get(self, profile_id):
+        for profile in self.profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def merged(self, kind=None, name=None):
+        """Сумма стеков всех сохраненных профилей (с фильтром по виду и имени)"""
+        stacks = Counter()
+        for profile in list(self.profiles):
+            if (kind is None or profile.kind == kind) and (name is None or profile.name == name):
+                stacks.update(profile.stacks)
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    # --- интеграция ---
+
+    def init_app(self, app):
+        """Хуки Flask; при выключенном профилировании ничего не регистрирует"""
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        logger.info(f"Request profiling enabled, sample rate {self.sample_rate}")
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        endpoint = request.endpoint or request.path
+        if endpoint in self.exclude:
+            return
+        g._profile = self.start('request', endpoint, extract_telegram_id())
+
+    def _teardown_request(self, exc):
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            self.stop(profile)
+
+    def bot_handler(self, f):
+        """Декоратор обработчика бота; при выключенном профилировании возвращает f как есть"""
+        if not self.enabled:
+            return f
+
+        @wraps(f)
+        async def decorated_function(update, context, *args, **kwargs):
+            user = getattr(update, 'effective_user', None)
+            profile = self.start('bot', f.__name__, user.id if user else None)
+            try:
+                return await f(update, context, *args, **kwargs)
+            finally:
+                if profile is not None:
+                    self.stop(profile)
+        return decorated_function
+
+
+profiler = Profiler()
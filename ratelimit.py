@@ -0,0 +1,193 @@
+"""Ограничение частоты запросов к API и сброс нагрузки при занятом пуле БД.
+
+Проверки выполняются в before_request, до любых обращений к базе:
+- token bucket на пару (telegram_id, класс маршрута) -> 429 и Retry-After;
+- общий лимит одновременных запросов к API -> 503 и Retry-After, вместо
+  ожидания свободного соединения до таймаута gunicorn.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+from log_sampling import sampled_debug
+
+logger = logging.getLogger(__name__)
+
+# Класс маршрута -> (токенов в секунду, размер корзины)
+DEFAULT_LIMITS = {
+    'write': (1.0, 10),
+    'stats': (2.0, 20),
+    'read': (5.0, 30),
+    'stream': (0.2, 5),
+}
+
+# Лимит, который фактически не срабатывает (RATE_LIMITS=off)
+UNLIMITED = (1e9, 1e9)
+
+
+def configured_limits(overrides=None):
+    """DEFAULT_LIMITS с учетом переменной RATE_LIMITS и overrides.
+
+    RATE_LIMITS - JSON {"класс": [токенов в секунду, размер корзины]} или
+    off, чтобы отключить лимиты (например, на время нагрузочных замеров).
+    """
+    limits = dict(DEFAULT_LIMITS)
+    raw = os.getenv('RATE_LIMITS')
+    if raw:
+        if raw.strip().lower() == 'off':
+            limits = {route_class: UNLIMITED for route_class in limits}
+        else:
+            try:
+                limits.update({route_class: tuple(value) for route_class, value in json.loads(raw).items()})
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.error(f"Invalid RATE_LIMITS, using defaults: {str(e)}")
+    limits.update(overrides or {})
+    return limits
+
+
+# Эндпоинты, не занимающие соединение с БД на все время ответа
+UNCAPPED_CLASSES = {'stream'}
+
+
+class TokenBucketLimiter:
+    """Token bucket в памяти процесса с вытеснением давно не использованных ключей"""
+
+    def __init__(self, limits, max_keys=100_000):
+        self.limits = limits
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, route_class):
+        """Списывает токен. Возвращает 0, если запрос разрешен, иначе секунды до следующего токена"""
+        rate, burst = self.limits[route_class]
+        now = time.monotonic()
+        bucket_key = (key, route_class)
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                tokens = burst
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                self._buckets.move_to_end(bucket_key)
+
+            if tokens >= 1:
+                self._buckets[bucket_key] = [tokens - 1, now]
+                retry_after = 0
+            else:
+                self._buckets[bucket_key] = [tokens, now]
+                retry_after = (1 - tokens) / rate
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class ConcurrencyLimiter:
+    """Ограничивает число одновременно обрабатываемых запросов"""
+
+    def __init__(self, max_concurrent, acquire_timeout=0.5):
+        self.max_concurrent = max_concurrent
+        self.acquire_timeout = acquire_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def acquire(self):
+        return self._semaphore.acquire(timeout=self.acquire_timeout)
+
+    def release(self):
+        self._semaphore.release()
+
+
+def extract_telegram_id():
+    """Достает telegram_id из параметра user (query string или JSON) без обращения к БД"""
+    user_data = request.args.get('user')
+    if user_data is None and request.is_json:
+        body = request.get_json(silent=True) or {}
+        user_data = body.get('user') if isinstance(body, dict) else None
+    if isinstance(user_data, str):
+        try:
+            user_data = json.loads(user_data)
+        except json.JSONDecodeError:
+            return None
+    if isinstance(user_data, dict):
+        return user_data.get('id')
+    return None
+
+
+class RateLimiting:
+    """Flask-расширение: лимиты по пользователю и общий лимит конкурентности.
+
+    route_classes сопоставляет имя эндпоинта с классом из DEFAULT_LIMITS;
+    остальные эндпоинты /api/ относятся к классу 'read'. Лимиты можно
+    переопределить через app.config['RATE_LIMITS'] или переменную RATE_LIMITS
+    (см. configured_limits), размер общего лимита - через API_MAX_CONCURRENCY
+    (по умолчанию pool_size + max_overflow).
+    """
+
+    def __init__(self, app=None, route_classes=None):
+        self.route_classes = route_classes or {}
+        self.limiter = None
+        self.concurrency = None
+        self.rejected = {'rate_limited': 0, 'shed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limiter = TokenBucketLimiter(configured_limits(app.config.get('RATE_LIMITS')))
+
+        engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        max_concurrent = app.config.get(
+            'API_MAX_CONCURRENCY',
+            int(os.getenv('API_MAX_CONCURRENCY', 0))
+            or engine_options.get('pool_size', 5) + engine_options.get('max_overflow', 10)
+        )
+        self.concurrency = ConcurrencyLimiter(max_concurrent)
+
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+        app.extensions['rate_limiting'] = self
+
+    def classify(self):
+        if request.endpoint in self.route_classes:
+            return self.route_classes[request.endpoint]
+        if request.path.startswith('/api/'):
+            return 'read'
+        return None
+
+    def before_request(self):
+        route_class = self.classify()
+        if route_class is None:
+            return None
+
+        key = extract_telegram_id() or request.remote_addr
+        retry_after = self.limiter.acquire(key, route_class)
+        if retry_after:
+            self.rejected['rate_limited'] += 1
+            sampled_debug(logger, "Rate limited %s on %s", key, request.endpoint)
+            return self._reject(429, 'Too many requests', retry_after)
+
+        if route_class in UNCAPPED_CLASSES:
+            return None
+        if not self.concurrency.acquire():
+            self.rejected['shed'] += 1
+            sampled_debug(logger, "Shedding %s: concurrency limit reached", request.endpoint)
+            return self._reject(503, 'Server is busy', 1)
+        g.concurrency_slot = True
+        return None
+
+    def teardown_request(self, exc):
+        if g.pop('concurrency_slot', False):
+            self.concurrency.release()
+
+    @staticmethod
+    def _reject(status, message, retry_after):
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
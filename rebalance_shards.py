@@ -0,0 +1,174 @@
+"""Перенос пользователей на их шард после изменения SHARD_URLS.
+
+Шард пользователя - jump_hash(telegram_id, число шардов): при добавлении
+шарда на него должна переехать примерно 1/N пользователей, остальные
+остаются на месте. Скрипт проходит пользователей каждого шарда порциями
+по --chunk-size и переносит тех, чей шард изменился, вместе с категориями,
+активностями, достижениями и членством в командах. Новые id выдает
+целевой шард, внешние ключи пересчитываются.
+
+Копирование на целевой шард идет в одной транзакции и начинается с
+удаления возможной частичной копии, поэтому прерванный перенос можно
+просто запустить заново. Запускать при остановленных приложении и боте:
+
+    SHARD_URLS=sqlite:///shard1.db,sqlite:///shard2.db python rebalance_shards.py --dry-run
+    SHARD_URLS=sqlite:///shard1.db,sqlite:///shard2.db python rebalance_shards.py
+"""
+import argparse
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import app, db
+from models import Achievement, Activity, Category, ReportRollup, Team, TeamMember, Tombstone, User
+from sharding import on_shard, shard_count, shard_for
+
+logger = logging.getLogger('rebalance_shards')
+
+users = User.__table__
+categories = Category.__table__
+activities = Activity.__table__
+achievements = Achievement.__table__
+teams = Team.__table__
+team_members = TeamMember.__table__
+tombstones = Tombstone.__table__
+report_rollups = ReportRollup.__table__
+
+
+def shard_engines():
+    engines = []
+    for shard in range(shard_count()):
+        with on_shard(app, shard):
+            engines.append(db.engine)
+    return engines
+
+
+def misplaced_users(engine, source, chunk_size):
+    """(id, telegram_id) пользователей шарда source, которым место на другом шарде"""
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(users.c.id, users.c.telegram_id).where(users.c.id > last_id).order_by(users.c.id).limit(chunk_size)
+            ).all()
+        if not rows:
+            return
+        for user_id, telegram_id in rows:
+            if telegram_id is not None and shard_for(telegram_id) != source:
+                yield user_id, telegram_id
+        last_id = rows[-1].id
+
+
+def copy_values(row, **overrides):
+    """Значения строки для вставки на другой шард: без id, с новыми внешними ключами"""
+    values = {key: value for key, value in row._mapping.items() if key != 'id'}
+    values.update(overrides)
+    return values
+
+
+def delete_user_rows(conn, user_id):
+    """Удаляет пользователя со всеми его строками; команды, из которых он ушел, меняют версию"""
+    team_ids = conn.execute(select(team_members.c.team_id).where(team_members.c.user_id == user_id)).scalars().all()
+    if team_ids:
+        conn.execute(teams.update().where(teams.c.id.in_(team_ids)).values(data_version=teams.c.data_version + 1))
+    conn.execute(team_members.delete().where(team_members.c.user_id == user_id))
+    conn.execute(activities.delete().where(activities.c.user_id == user_id))
+    conn.execute(categories.delete().where(categories.c.user_id == user_id))
+    conn.execute(achievements.delete().where(achievements.c.user_id == user_id))
+    conn.execute(tombstones.delete().where(tombstones.c.user_id == user_id))
+    # Итоги отчетов не переносятся: на новом шарде они пересчитаются
+    conn.execute(report_rollups.delete().where(report_rollups.c.user_id == user_id))
+    conn.execute(users.delete().where(users.c.id == user_id))
+
+
+def ensure_team(conn, chat_id, title):
+    team_id = conn.execute(select(teams.c.id).where(teams.c.chat_id == chat_id)).scalar()
+    if team_id is None:
+        team_id = conn.execute(teams.insert().values(chat_id=chat_id, title=title)).inserted_primary_key[0]
+    return team_id
+
+
+def move_user(source_engine, target_engine, user_id, telegram_id, now=None):
+    """Копирует пользователя на целевой шард и удаляет с исходного; число перенесенных активностей"""
+    now = now or datetime.utcnow()
+    with source_engine.connect() as src:
+        user = src.execute(select(users).where(users.c.id == user_id)).one()
+        user_categories = src.execute(select(categories).where(categories.c.user_id == user_id).order_by(categories.c.id)).all()
+        user_activities = src.execute(select(activities).where(activities.c.user_id == user_id).order_by(activities.c.id)).all()
+        user_achievements = src.execute(select(achievements).where(achievements.c.user_id == user_id)).all()
+        memberships = src.execute(
+            select(team_members.c.joined_at, teams.c.chat_id, teams.c.title).join(
+                teams, teams.c.id == team_members.c.team_id
+            ).where(team_members.c.user_id == user_id)
+        ).all()
+
+    with target_engine.begin() as dst:
+        stale_id = dst.execute(select(users.c.id).where(users.c.telegram_id == telegram_id)).scalar()
+        if stale_id is not None:
+            delete_user_rows(dst, stale_id)
+
+        # Новая версия и updated_at: кеши и клиенты синхронизации не примут старые данные за актуальные
+        new_user_id = dst.execute(users.insert().values(copy_values(
+            user, data_version=(user.data_version or 0) + 1, updated_at=now
+        ))).inserted_primary_key[0]
+        category_ids = {
+            row.id: dst.execute(categories.insert().values(copy_values(
+                row, user_id=new_user_id, updated_at=now
+            ))).inserted_primary_key[0]
+            for row in user_categories
+        }
+        if user_activities:
+            dst.execute(activities.insert(), [
+                copy_values(row, user_id=new_user_id, category_id=category_ids[row.category_id], updated_at=now)
+                for row in user_activities
+            ])
+        if user_achievements:
+            dst.execute(achievements.insert(), [copy_values(row, user_id=new_user_id) for row in user_achievements])
+        for joined_at, chat_id, title in memberships:
+            team_id = ensure_team(dst, chat_id, title)
+            dst.execute(team_members.insert().values(team_id=team_id, user_id=new_user_id, joined_at=joined_at))
+            dst.execute(teams.update().where(teams.c.id == team_id).values(data_version=teams.c.data_version + 1))
+
+    with source_engine.begin() as src:
+        delete_user_rows(src, user_id)
+    return len(user_activities)
+
+
+def rebalance(chunk_size=1000, dry_run=False):
+    engines = shard_engines()
+    stats = {'moved': 0, 'activities': 0, 'by_shard': {}}
+    started = time.perf_counter()
+    for source, engine in enumerate(engines):
+        # Список целиком: перенос удаляет строки, по которым идет выборка
+        for user_id, telegram_id in list(misplaced_users(engine, source, chunk_size)):
+            target = shard_for(telegram_id)
+            route = f"{source}->{target}"
+            stats['by_shard'][route] = stats['by_shard'].get(route, 0) + 1
+            stats['moved'] += 1
+            if dry_run:
+                continue
+            stats['activities'] += move_user(engine, engines[target], user_id, telegram_id)
+            if stats['moved'] % chunk_size == 0:
+                logger.info(f"Moved {stats['moved']} users, {stats['activities']} activities")
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перенос пользователей на их шард после изменения SHARD_URLS')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true', help='посчитать переносы без записи')
+    args = parser.parse_args()
+
+    stats = rebalance(args.chunk_size, args.dry_run)
+    routes = ', '.join(f"{route}: {count}" for route, count in sorted(stats['by_shard'].items())) or 'nothing to move'
+    print(
+        f"{'Would move' if args.dry_run else 'Moved'} {stats['moved']} users "
+        f"({stats['activities']} activities) across {shard_count()} shards in {stats['seconds']}s ({routes})"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Пересчет опыта и уровней всех пользователей по истории активностей.
+
+XP начисляется по 1 за каждую полную минуту завершенной активности,
+уровень равен 1 + xp // 1000 (как в User.add_xp и User.calculate_level).
+Пересчет нужен, потому что часть путей завершения активностей XP не
+начисляла, а calculate_level никогда не понижает уровень.
+
+Пользователи читаются потоком (yield_per) порциями по --chunk-size. Для
+каждой порции выполняется один агрегирующий запрос по диапазону user_id,
+а изменившиеся строки обновляются одним executemany. Память не зависит от
+размера таблиц, поэтому задачу можно запускать по ночам:
+
+    python recompute_xp.py --chunk-size 2000
+    python recompute_xp.py --dry-run
+
+При шардировании (SHARD_URLS) шарды обрабатываются параллельно.
+"""
+import argparse
+import logging
+import time
+
+from sqlalchemy import bindparam, func, select
+
+from app import app, db
+from dialect import whole_minutes
+from models import Activity, User
+from sharding import fan_out
+
+logger = logging.getLogger('recompute_xp')
+
+XP_PER_LEVEL = 1000
+
+
+def level_for(xp):
+    return 1 + xp // XP_PER_LEVEL
+
+
+def xp_by_user(connection, first_id, last_id):
+    """{user_id: (xp, число активностей)} для пользователей из диапазона одним запросом"""
+    # duration заполнен у всех завершенных активностей (tracking.backfill_durations)
+    query = select(
+        Activity.user_id,
+        func.sum(whole_minutes(connection.dialect.name, Activity.duration)),
+        func.count()
+    ).where(
+        Activity.user_id.between(first_id, last_id),
+        Activity.duration > 0
+    ).group_by(Activity.user_id)
+    return {user_id: (int(xp or 0), count) for user_id, xp, count in connection.execute(query)}
+
+
+def recompute_xp(chunk_size=1000, dry_run=False):
+    users = User.__table__
+    update_statement = users.update().where(users.c.id == bindparam('user_id')).values(
+        xp=bindparam('new_xp'),
+        level=bindparam('new_level')
+    )
+    stats = {'users': 0, 'activities': 0, 'updated': 0, 'chunks': 0}
+    started = time.perf_counter()
+
+    with db.engine.connect() as reader, db.engine.connect() as second:
+        # В Postgres чтение идет серверным курсором на отдельном соединении:
+        # commit обновлений не закрывает поток пользователей. В SQLite второе
+        # соединение не смогло бы писать, пока открыт курсор чтения, а на
+        # том же соединении commit при открытом курсоре допустим.
+        writer = reader if db.engine.dialect.name == 'sqlite' else second
+        rows = reader.execution_options(yield_per=chunk_size).execute(
+            select(users.c.id, users.c.xp, users.c.level).order_by(users.c.id)
+        )
+        for chunk in rows.partitions():
+            totals = xp_by_user(writer, chunk[0].id, chunk[-1].id)
+            changes = []
+            for user_id, xp, level in chunk:
+                new_xp, activities = totals.get(user_id, (0, 0))
+                stats['activities'] += activities
+                new_level = level_for(new_xp)
+                if new_xp != xp or new_level != level:
+                    changes.append({'user_id': user_id, 'new_xp': new_xp, 'new_level': new_level})
+
+            if changes and not dry_run:
+                writer.execute(update_statement, changes)
+            writer.commit()
+
+            stats['users'] += len(chunk)
+            stats['updated'] += len(changes)
+            stats['chunks'] += 1
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Chunk {stats['chunks']}: {stats['users']} users, {stats['updated']} updated, "
+                f"{stats['users'] / elapsed:.0f} users/s, {stats['activities'] / elapsed:.0f} activities/s"
+            )
+
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    stats['users_per_second'] = round(stats['users'] / stats['seconds']) if stats['seconds'] else None
+    stats['activities_per_second'] = round(stats['activities'] / stats['seconds']) if stats['seconds'] else None
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересчет XP и уровней по истории активностей')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true', help='посчитать изменения без записи')
+    args = parser.parse_args()
+
+    # Шарды пересчитываются параллельно, каждый своим потоком
+    per_shard = fan_out(app, lambda shard: recompute_xp(args.chunk_size, args.dry_run))
+    stats = {key: sum(shard[key] for shard in per_shard) for key in ('users', 'activities', 'updated', 'chunks')}
+    stats['seconds'] = max(shard['seconds'] for shard in per_shard)
+    stats['users_per_second'] = round(stats['users'] / stats['seconds']) if stats['seconds'] else None
+    stats['activities_per_second'] = round(stats['activities'] / stats['seconds']) if stats['seconds'] else None
+    print(
+        f"{'Would update' if args.dry_run else 'Updated'} {stats['updated']} of {stats['users']} users "
+        f"in {stats['seconds']}s ({stats['users_per_second']} users/s, "
+        f"{stats['activities_per_second']} activities/s, {stats['chunks']} chunks)"
+    )
+
+
+if __name__ == '__main__':
+    main()
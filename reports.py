@@ -0,0 +1,268 @@
+"""Отчеты: суммы времени по дням, неделям, месяцам и годам за произвольный диапазон.
+
+Активности группируются по началу периода в зоне пользователя одним
+SQL-запросом (date_trunc в Postgres; в SQLite - CASE по UTC-границам
+периодов из spans(), см. dialect.py); активность целиком относится к
+периоду, в котором она началась. Границы диапазона расширяются до целых
+периодов.
+
+Итоги закрытых периодов сохраняются в report_rollups навсегда: активности
+начинаются только «сейчас», поэтому в прошедший период новые не попадут.
+Период считается закрытым, если он кончился и в нем не началась еще
+открытая активность - ее длительность появится только при завершении.
+Удаление или правка завершенной активности сбрасывает итоги ее периодов
+(события маппера в models.py). Открытые периоды пересчитываются и
+кешируются в stats_cache до следующего изменения данных пользователя.
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+
+import pytz
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from category_cache import category_cache
+from dialect import PERIODS, bucket_by_bounds, date_trunc, resolve_timezone
+from models import Activity, ReportRollup
+from stats_cache import stats_cache
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних периодов показывать, если диапазон не задан
+DEFAULT_COUNTS = {'day': 7, 'week': 8, 'month': 6, 'year': 3}
+MAX_BUCKETS = 366
+
+
+def parse_report_period(value):
+    period = (value or 'day').lower()
+    if period not in PERIODS:
+        raise ValueError(f"Period must be one of: {', '.join(PERIODS)}")
+    return period
+
+
+def period_start(day, period):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def shift(start, period, count):
+    """Начало периода, отстоящего от start на count периодов"""
+    if period == 'day':
+        return start + timedelta(days=count)
+    if period == 'week':
+        return start + timedelta(weeks=count)
+    if period == 'month':
+        years, month = divmod(start.month - 1 + count, 12)
+        return date(start.year + years, month + 1, 1)
+    return date(start.year + count, 1, 1)
+
+
+def local_today(tz_name, now=None):
+    now = now or datetime.utcnow()
+    return pytz.UTC.localize(now).astimezone(resolve_timezone(tz_name)).date()
+
+
+def parse_range(period, start=None, end=None, today=None, count=None):
+    """(первый день, последний день) из строк YYYY-MM-DD; по умолчанию - последние count периодов"""
+    try:
+        last = date.fromisoformat(end) if end else today
+        first = date.fromisoformat(start) if start else None
+    except ValueError as e:
+        raise ValueError('Dates must be in YYYY-MM-DD format') from e
+    if first is None:
+        first = shift(period_start(last, period), period, -((count or DEFAULT_COUNTS[period]) - 1))
+    if first > last:
+        raise ValueError("'from' must not be after 'to'")
+    return first, last
+
+
+def utc_midnight(day, tz):
+    """Наивное UTC-время начала дня day в зоне tz"""
+    return tz.localize(datetime.combine(day, time.min)).astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def spans(period, first, last, tz):
+    """[(начало периода, начало в UTC, конец в UTC)] от периода first до периода last"""
+    result = []
+    start = period_start(first, period)
+    while start <= last:
+        if len(result) >= MAX_BUCKETS:
+            raise ValueError(f"At most {MAX_BUCKETS} periods per report")
+        end = shift(start, period, 1)
+        result.append((start, utc_midnight(start, tz), utc_midnight(end, tz)))
+        start = end
+    return result
+
+
+def final_before(db, user_id, now):
+    """Периоды, кончившиеся до этого момента, больше не изменятся"""
+    open_since = db.session.query(func.min(Activity.start_time)).filter(
+        Activity.user_id == user_id,
+        Activity.end_time.is_(None)
+    ).scalar()
+    return min(now, open_since) if open_since else now
+
+
+def query_totals(db, user_id, period, tz_name, periods):
+    """{начало периода: {category_id: [секунды, число]}} для активностей из периодов spans()"""
+    dialect_name = db.engine.dialect.name
+    since, until = periods[0][1], periods[-1][2]
+    if dialect_name == 'sqlite':
+        # Одно смещение зоны на весь диапазон разошлось бы с starts_at/ends_at
+        # сохраненных итогов на переходе на летнее время
+        bucket = bucket_by_bounds(Activity.start_time, periods)
+    else:
+        bucket = date_trunc(dialect_name, period, Activity.start_time, tz_name)
+    rows = db.session.query(
+        bucket.label('bucket'), Activity.category_id, Activity.duration
+    ).filter(
+        Activity.user_id == user_id,
+        Activity.duration.isnot(None),
+        Activity.start_time >= since,
+        Activity.start_time < until
+    ).subquery()
+    # Группировка по колонке подзапроса: Postgres не считает одинаковыми два
+    # выражения date_trunc с разными параметрами в SELECT и GROUP BY
+    grouped = db.session.query(
+        rows.c.bucket, rows.c.category_id, func.sum(rows.c.duration), func.count()
+    ).group_by(rows.c.bucket, rows.c.category_id)
+
+    totals = {}
+    for start, category_id, seconds, count in grouped:
+        totals.setdefault(start, {})[category_id] = [int(seconds or 0), count]
+    return totals
+
+
+def store_rollups(db, rollups):
+    db.session.add_all(rollups)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Тот же период одновременно сохранил другой воркер - итоги совпадают
+        db.session.rollback()
+        logger.debug('Report rollups already stored by another worker')
+
+
+def build_report(db, user, period, first, last, tz_name, now=None):
+    now = now or datetime.utcnow()
+    tz = resolve_timezone(tz_name)
+    periods = spans(period, first, last, tz)
+
+    # Только значения: commit ниже сбросил бы загруженные объекты
+    stored = {
+        rollup.starts_on: rollup.categories
+        for rollup in ReportRollup.query.filter(
+            ReportRollup.user_id == user.id,
+            ReportRollup.period == period,
+            ReportRollup.timezone == tz.zone,
+            ReportRollup.starts_on >= periods[0][0],
+            ReportRollup.starts_on <= periods[-1][0]
+        )
+    }
+    missing = [span for span in periods if span[0] not in stored]
+    computed = {}
+    if missing:
+        # Один запрос на все недостающие периоды вместе с сохраненными между ними
+        first_missing, last_missing = periods.index(missing[0]), periods.index(missing[-1])
+        computed = query_totals(db, user.id, period, tz.zone, periods[first_missing:last_missing + 1])
+        closed_until = final_before(db, user.id, now)
+        rollups = []
+        for start, starts_at, ends_at in missing:
+            if ends_at > closed_until:
+                continue
+            by_category = computed.get(start, {})
+            rollups.append(ReportRollup(
+                user_id=user.id, period=period, timezone=tz.zone, starts_on=start,
+                starts_at=starts_at, ends_at=ends_at,
+                seconds=sum(seconds for seconds, _ in by_category.values()),
+                count=sum(count for _, count in by_category.values()),
+                categories=[[category_id, seconds, count] for category_id, (seconds, count) in by_category.items()]
+            ))
+        if rollups:
+            store_rollups(db, rollups)
+
+    names = {category.id: category.name for category in category_cache.get(user)}
+    totals = {}
+    buckets = []
+    for start, starts_at, ends_at in periods:
+        if start in stored:
+            by_category = {category_id: [seconds, count] for category_id, seconds, count in stored[start]}
+        else:
+            by_category = computed.get(start, {})
+        for category_id, (seconds, count) in by_category.items():
+            total = totals.setdefault(category_id, [0, 0])
+            total[0] += seconds
+            total[1] += count
+        buckets.append({
+            'start': start.isoformat(),
+            'end': shift(start, period, 1).isoformat(),
+            'closed': ends_at <= now,
+            'seconds': sum(seconds for seconds, _ in by_category.values()),
+            'count': sum(count for _, count in by_category.values()),
+            'categories': category_rows(by_category, names),
+        })
+
+    return {
+        'period': period,
+        'timezone': tz.zone,
+        'from': periods[0][0].isoformat(),
+        'to': shift(periods[-1][0], period, 1).isoformat(),
+        'total': {
+            'seconds': sum(seconds for seconds, _ in totals.values()),
+            'count': sum(count for _, count in totals.values()),
+        },
+        'categories': category_rows(totals, names),
+        'buckets': buckets,
+    }
+
+
+def category_rows(by_category, names):
+    rows = [
+        {'id': category_id, 'name': names.get(category_id, '?'), 'seconds': seconds, 'count': count}
+        for category_id, (seconds, count) in by_category.items()
+    ]
+    return sorted(rows, key=lambda row: -row['seconds'])
+
+
+def get_report(db, user, period, first, last, tz_name=None):
+    """Отчет из кеша статистики, если версия данных пользователя не менялась"""
+    tz_name = resolve_timezone(tz_name or user.timezone).zone
+    # Дата в ключе: в полночь меняется признак closed у текущего периода
+    params = (period, first.isoformat(), last.isoformat(), tz_name, local_today(tz_name))
+    return stats_cache.get_or_compute('report', user, lambda: build_report(db, user, period, first, last, tz_name), params)
+
+
+def format_duration(seconds):
+    hours, rest = divmod(seconds // 60, 60)
+    return f"{hours} ч {rest} мин" if hours else f"{rest} мин"
+
+
+PERIOD_TITLES = {'day': 'по дням', 'week': 'по неделям', 'month': 'по месяцам', 'year': 'по годам'}
+
+
+def bucket_label(start, period):
+    if period == 'day':
+        return start.strftime('%d.%m.%Y')
+    if period == 'week':
+        return f"нед. с {start.strftime('%d.%m.%Y')}"
+    if period == 'month':
+        return start.strftime('%m.%Y')
+    return str(start.year)
+
+
+def format_user_report(report):
+    """Текст отчета для бота"""
+    lines = [f"📅 Отчет {PERIOD_TITLES[report['period']]} ({report['timezone']})", '']
+    for bucket in report['buckets']:
+        start = date.fromisoformat(bucket['start'])
+        lines.append(f"{bucket_label(start, report['period'])}: {format_duration(bucket['seconds'])} ({bucket['count']})")
+    lines.append('')
+    lines.append(f"Всего: {format_duration(report['total']['seconds'])}, активностей: {report['total']['count']}")
+    for category in report['categories'][:5]:
+        lines.append(f"• {category['name']}: {format_duration(category['seconds'])}")
+    return '\n'.join(lines)
@@ -0,0 +1,55 @@
+"""Докатка новых колонок и индексов на существующую базу.
+
+db.create_all() создает только отсутствующие таблицы, поэтому колонки и
+индексы, добавленные в модели позже, дописываются здесь через ALTER TABLE
+и CREATE INDEX. Операции идемпотентны и выполняются при каждом init_db().
+"""
+import logging
+
+from sqlalchemy import inspect, literal, text
+
+logger = logging.getLogger(__name__)
+
+
+def _default_clause(column, dialect):
+    """DEFAULT для новой колонки, чтобы заполнить уже существующие строки"""
+    if column.server_default is not None:
+        return f" DEFAULT {column.server_default.arg}"
+    default = column.default
+    if default is None or not default.is_scalar:
+        return ""
+    value = literal(default.arg, type_=column.type).compile(
+        dialect=dialect, compile_kwargs={'literal_binds': True}
+    )
+    return f" DEFAULT {value}"
+
+
+def add_column_sql(table, column, dialect):
+    preparer = dialect.identifier_preparer
+    sql = (
+        f"ALTER TABLE {preparer.format_table(table)} "
+        f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=dialect)}"
+    )
+    default = _default_clause(column, dialect)
+    sql += default
+    if default and not column.nullable:
+        sql += " NOT NULL"
+    return sql
+
+
+def upgrade_schema(db):
+    """Добавляет недостающие колонки и индексы для всех моделей"""
+    engine = db.engine
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                conn.execute(text(add_column_sql(table, column, engine.dialect)))
+                logger.info(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
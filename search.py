@@ -0,0 +1,117 @@
+"""Полнотекстовый поиск по названиям и заметкам активностей.
+
+Индекс выбирается по диалекту базы:
+- SQLite: FTS5-таблица activities_fts с внешним содержимым (content=activities),
+  синхронизируется триггерами на insert/update/delete;
+- Postgres: генерируемая колонка search_vector (tsvector) с GIN-индексом,
+  база пересчитывает ее сама при каждой записи;
+- прочие диалекты: запасной вариант через LIKE.
+"""
+import logging
+import re
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TOKENS = 8
+
+SQLITE_SETUP = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5(
+        name, notes, content='activities', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS activities_fts_ai AFTER INSERT ON activities BEGIN
+        INSERT INTO activities_fts(rowid, name, notes) VALUES (new.id, new.name, new.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS activities_fts_ad AFTER DELETE ON activities BEGIN
+        INSERT INTO activities_fts(activities_fts, rowid, name, notes) VALUES ('delete', old.id, old.name, old.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS activities_fts_au AFTER UPDATE OF name, notes ON activities BEGIN
+        INSERT INTO activities_fts(activities_fts, rowid, name, notes) VALUES ('delete', old.id, old.name, old.notes);
+        INSERT INTO activities_fts(rowid, name, notes) VALUES (new.id, new.name, new.notes);
+    END""",
+]
+
+POSTGRES_SETUP = [
+    """ALTER TABLE activities ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(notes, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_activities_search_vector ON activities USING GIN (search_vector)",
+]
+
+SQLITE_SEARCH = text("""
+    SELECT activities.id, -bm25(activities_fts) AS rank
+    FROM activities_fts JOIN activities ON activities.id = activities_fts.rowid
+    WHERE activities_fts MATCH :match AND activities.user_id = :user_id
+    ORDER BY rank DESC, activities.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+POSTGRES_SEARCH = text("""
+    SELECT id, ts_rank_cd(search_vector, query) AS rank
+    FROM activities, to_tsquery('simple', :match) AS query
+    WHERE user_id = :user_id AND search_vector @@ query
+    ORDER BY rank DESC, id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+LIKE_SEARCH = text("""
+    SELECT id, 0 AS rank FROM activities
+    WHERE user_id = :user_id AND (lower(name) LIKE :match OR lower(coalesce(notes, '')) LIKE :match)
+    ORDER BY start_time DESC, id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def setup_search(db):
+    """Создает поисковый индекс, если его еще нет (идемпотентно)"""
+    engine = db.engine
+    with engine.begin() as conn:
+        if engine.dialect.name == 'sqlite':
+            # Триггеров нет - индекс новый или таблица activities пересоздана: заполняем заново
+            needs_rebuild = conn.execute(text(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = 'activities_fts_ai'"
+            )).scalar() == 0
+            for statement in SQLITE_SETUP:
+                conn.execute(text(statement))
+            if needs_rebuild:
+                conn.execute(text("INSERT INTO activities_fts(activities_fts) VALUES ('rebuild')"))
+                logger.info("Activities FTS index rebuilt")
+        elif engine.dialect.name == 'postgresql':
+            for statement in POSTGRES_SETUP:
+                conn.execute(text(statement))
+        else:
+            logger.warning(f"Full-text search index is not supported for {engine.dialect.name}, using LIKE")
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())[:MAX_TOKENS]
+
+
+def build_match(dialect_name, tokens):
+    """Строит запрос к индексу: все слова обязательны, последнее - по префиксу"""
+    if dialect_name == 'sqlite':
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+    if dialect_name == 'postgresql':
+        return ' & '.join(tokens) + ':*'
+    return '%' + ' '.join(tokens) + '%'
+
+
+def search_activities(db, user_id, query, limit=20, offset=0):
+    """Возвращает список (activity_id, rank) по убыванию релевантности"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    dialect_name = db.engine.dialect.name
+    statement = {'sqlite': SQLITE_SEARCH, 'postgresql': POSTGRES_SEARCH}.get(dialect_name, LIKE_SEARCH)
+    rows = db.session.execute(statement, {
+        'match': build_match(dialect_name, tokens),
+        'user_id': user_id,
+        'limit': limit,
+        'offset': offset,
+    })
+    return [(row.id, row.rank) for row in rows]
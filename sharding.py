@@ -0,0 +1,159 @@
+"""Необязательное горизонтальное шардирование данных пользователей по telegram_id.
+
+Шард 0 - основная база (DATABASE_URL), дополнительные шарды перечисляются
+в SHARD_URLS через запятую. Без SHARD_URLS шардирования нет и все работает
+как раньше. Для локальной проверки достаточно нескольких файлов SQLite:
+
+    SHARD_URLS=sqlite:///shard1.db,sqlite:///shard2.db
+
+Пользователь живет на шарде jump_hash(telegram_id, число шардов) вместе со
+всеми своими категориями, активностями и членством в командах. Шард
+выбирается контекстной переменной: на время запроса Flask, обработчика бота
+или фоновой задачи ShardedSQLAlchemy подменяет движок по умолчанию
+(db.engine, db.session, create_all) движком этого шарда, поэтому
+запросы к моделям не меняются. Для каждого шарда используется отдельный
+контекст приложения, а значит и отдельная сессия: одна identity map не
+смешивает строки разных баз с одинаковыми id.
+
+Глобальные задачи (пересчет XP, heartbeat, отчеты команд, рейтинг)
+проходят по всем шардам через fan_out, параллельно в потоках.
+Перенос пользователей после добавления шарда - rebalance_shards.py.
+"""
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import g
+from flask_sqlalchemy import SQLAlchemy
+
+from ratelimit import extract_telegram_id
+
+logger = logging.getLogger(__name__)
+
+SHARD_URLS = [url.strip() for url in os.getenv('SHARD_URLS', '').split(',') if url.strip()]
+
+_current_shard = contextvars.ContextVar('current_shard', default=None)
+
+
+def normalize_url(url):
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    if url.startswith('postgresql') and '?' not in url:
+        url += '?sslmode=require'
+    return url
+
+
+def enabled():
+    return bool(SHARD_URLS)
+
+
+def shard_count():
+    return 1 + len(SHARD_URLS)
+
+
+def bind_key(index):
+    """Ключ SQLALCHEMY_BINDS шарда; шард 0 - движок по умолчанию"""
+    return f"shard{index}" if index else None
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping, Veach): при добавлении шарда
+    переезжает только 1/N пользователей, и все - на новый шард"""
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(telegram_id, count=None):
+    return jump_hash(int(telegram_id), count or shard_count())
+
+
+def current_shard():
+    return _current_shard.get() or 0
+
+
+class ShardedSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy, у которого движок по умолчанию - движок текущего шарда"""
+
+    @property
+    def engines(self):
+        engines = super().engines
+        index = _current_shard.get()
+        if not index:
+            return engines
+        return {**engines, None: engines[bind_key(index)]}
+
+
+def configure(app):
+    """Регистрирует дополнительные шарды как binds приложения"""
+    if not enabled():
+        return
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for index, url in enumerate(SHARD_URLS, start=1):
+        binds[bind_key(index)] = normalize_url(url)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    logger.info(f"Sharding enabled: {shard_count()} shards")
+
+
+@contextmanager
+def use_shard(index):
+    """Направляет запросы к шарду index (внутри уже открытого контекста - до первого запроса)"""
+    token = _current_shard.set(index)
+    try:
+        yield index
+    finally:
+        _current_shard.reset(token)
+
+
+@contextmanager
+def user_shard(telegram_id):
+    """Шард пользователя; без telegram_id или без шардирования - шард 0"""
+    index = shard_for(telegram_id) if enabled() and telegram_id is not None else None
+    with use_shard(index):
+        yield index
+
+
+@contextmanager
+def on_shard(app, index):
+    """Новый контекст приложения (и своя сессия) на шарде index"""
+    with use_shard(index), app.app_context():
+        yield index
+
+
+def fan_out(app, function, parallel=True):
+    """function(index) на каждом шарде в своем контексте; список результатов по шардам"""
+    def run(index):
+        with on_shard(app, index):
+            return function(index)
+
+    count = shard_count()
+    if count == 1 or not parallel:
+        return [run(index) for index in range(count)]
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix='shard') as pool:
+        return list(pool.map(run, range(count)))
+
+
+def init_app(app):
+    """Выбирает шард пользователя на время каждого запроса"""
+    if not enabled():
+        return
+
+    @app.before_request
+    def select_shard():
+        try:
+            index = shard_for(extract_telegram_id())
+        except (TypeError, ValueError):
+            return  # Запрос без пользователя (страницы, служебные API) - шард 0
+        g._shard_token = _current_shard.set(index)
+
+    @app.teardown_request
+    def reset_shard(exc):
+        token = g.pop('_shard_token', None)
+        if token is not None:
+            _current_shard.reset(token)
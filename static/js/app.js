@@ -3,6 +3,10 @@ let currentUser = null;
 let currentActivity = null;
 let timer = null;
 let startTime = null;
+let eventSource = null;
+let statsVersion = null;
+let heartbeatTimer = null;
+let heartbeatInterval = 30000;
 
 // Инициализация при загрузке страницы
 document.addEventListener('DOMContentLoaded', async () => {
@@ -42,11 +46,17 @@ document.addEventListener('DOMContentLoaded', async () => {
         // Загружаем статистику
         await loadStats();
         
+        // Команды групповых чатов загружаются в фоне
+        loadTeams();
+        
         // Настраиваем обработчики событий
         setupEventListeners();
         
         // Обновляем интерфейс
         updateUserInterface();
+        
+        // Подписываемся на изменения с других устройств и из бота
+        subscribeToEvents();
     } catch (error) {
         console.error('Error initializing app:', error);
         showError('Ошибка инициализации приложения');
@@ -65,6 +75,7 @@ async function loadUserData() {
         console.log('Received user data:', userData);
         currentUser = { ...currentUser, ...userData };
         updateUserInterface();
+        syncTimezone();
     } catch (error) {
         console.error('Error loading user data:', error);
         showError('Ошибка загрузки данных пользователя');
@@ -102,6 +113,49 @@ async function loadStats() {
     }
 }
 
+// Загрузка отчетов команд
+async function loadTeams() {
+    try {
+        const userParam = encodeURIComponent(JSON.stringify({ id: currentUser.telegram_id }));
+        const response = await fetch(`/api/teams?user=${userParam}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const teams = await response.json();
+        const reports = await Promise.all(teams.map(async team => {
+            const teamResponse = await fetch(`/api/teams/${team.chat_id}/stats?user=${userParam}&days=7`);
+            return teamResponse.ok ? teamResponse.json() : null;
+        }));
+        updateTeams(reports.filter(Boolean));
+    } catch (error) {
+        console.error('Error loading teams:', error);
+    }
+}
+
+// Отображение отчетов команд
+function updateTeams(reports) {
+    const section = document.getElementById('teamsSection');
+    const container = document.getElementById('teamStats');
+    if (!section || !container) return;
+    
+    section.classList.toggle('hidden', reports.length === 0);
+    container.innerHTML = '';
+    reports.forEach(report => {
+        const title = document.createElement('h4');
+        title.textContent = `${report.team.title || 'Команда'}: ${(report.total_time / 3600).toFixed(1)} ч`;
+        container.appendChild(title);
+        
+        const list = document.createElement('ul');
+        list.className = 'team-members';
+        report.members.forEach(member => {
+            const item = document.createElement('li');
+            item.textContent = `${member.name} - ${(member.total_time / 3600).toFixed(1)} ч (${member.total_tasks})`;
+            list.appendChild(item);
+        });
+        container.appendChild(list);
+    });
+}
+
 // Настройка обработчиков событий
 function setupEventListeners() {
     // Навигация
@@ -194,8 +248,8 @@ function updateUserInterface() {
     if (dailyGoalInput) dailyGoalInput.value = currentUser.daily_goal;
     if (breakReminderInput) breakReminderInput.value = currentUser.break_reminder;
     
-    // Применяем тему
-    updateTheme(currentUser.theme);
+    // Применяем тему (без сохранения на сервер, иначе каждое обновление данных порождает новое событие)
+    document.body.className = currentUser.theme;
 }
 
 // Обновление списка категорий
@@ -205,6 +259,8 @@ function updateCategoriesList(categories) {
     
     categorySelect.innerHTML = '<option value="">Выберите категорию</option>';
     categories.forEach(category => {
+        // Архивные категории остаются в статистике, но не в выборе
+        if (category.archived) return;
         const option = document.createElement('option');
         option.value = category.id;
         option.textContent = category.name;
@@ -270,17 +326,7 @@ async function startTask() {
         }
         
         const data = await response.json();
-        currentActivity = data;
-        startTime = new Date();
-        
-        // Обновляем UI
-        document.getElementById('startTimer').disabled = true;
-        document.getElementById('finishTimer').disabled = false;
-        document.getElementById('categorySelect').disabled = true;
-        document.getElementById('taskName').disabled = true;
-        
-        // Запускаем таймер
-        startTimer();
+        showActivityStarted(data);
         
         // Показываем уведомление
         showNotification('Задача начата!');
@@ -318,36 +364,157 @@ async function finishTask() {
         }
         
         const data = await response.json();
+        showActivityFinished();
         
-        // Останавливаем таймер
-        stopTimer();
-        
-        // Сбрасываем UI
-        document.getElementById('startTimer').disabled = false;
-        document.getElementById('finishTimer').disabled = true;
-        document.getElementById('categorySelect').disabled = false;
-        document.getElementById('taskName').disabled = false;
-        document.getElementById('taskNotes').value = '';
-        document.getElementById('productivityRating').value = '3';
-        
-        // Обновляем статистику
-        await loadStats();
+        // Статистику обновит событие из SSE-потока, если он подключен
+        if (!eventSource) {
+            await loadStats();
+        }
         
         // Показываем уведомление
         showNotification(`Задача завершена! Получено ${data.xp_earned} XP`);
-        
-        currentActivity = null;
-        startTime = null;
     } catch (error) {
         console.error('Error finishing task:', error);
         showError('Ошибка завершения задачи');
     }
 }
 
+// Переключение интерфейса таймера
+function showActivityStarted(activity) {
+    currentActivity = activity;
+    startTime = activity.start_time ? new Date(activity.start_time) : new Date();
+    
+    document.getElementById('startTimer').disabled = true;
+    document.getElementById('finishTimer').disabled = false;
+    document.getElementById('categorySelect').disabled = true;
+    document.getElementById('taskName').disabled = true;
+    
+    startTimer();
+}
+
+function showActivityFinished() {
+    stopTimer();
+    
+    document.getElementById('startTimer').disabled = false;
+    document.getElementById('finishTimer').disabled = true;
+    document.getElementById('categorySelect').disabled = false;
+    document.getElementById('taskName').disabled = false;
+    document.getElementById('taskNotes').value = '';
+    document.getElementById('productivityRating').value = '3';
+    
+    currentActivity = null;
+    startTime = null;
+}
+
+// Поток событий сервера (SSE)
+function subscribeToEvents() {
+    if (!window.EventSource || !currentUser || !currentUser.telegram_id) return;
+    
+    eventSource = new EventSource(`/api/events?user=${encodeURIComponent(JSON.stringify({ id: currentUser.telegram_id }))}`);
+    
+    eventSource.addEventListener('activity_started', (event) => {
+        const activity = JSON.parse(event.data);
+        if (!currentActivity) {
+            showActivityStarted(activity);
+        }
+    });
+    
+    eventSource.addEventListener('activity_finished', (event) => {
+        const activity = JSON.parse(event.data);
+        if (currentActivity && currentActivity.id === activity.id) {
+            showActivityFinished();
+        }
+    });
+    
+    eventSource.addEventListener('categories_changed', (event) => {
+        const { categories } = JSON.parse(event.data);
+        updateCategoriesList(categories);
+    });
+    
+    eventSource.addEventListener('stats', (event) => {
+        const { version } = JSON.parse(event.data);
+        if (statsVersion !== null && version !== statsVersion) {
+            loadStats();
+            loadUserData();
+        }
+        statsVersion = version;
+    });
+    
+    eventSource.addEventListener('resync', () => {
+        loadStats();
+        loadUserData();
+    });
+    
+    // Сервер отказал в потоке (503 при исчерпании лимита потоков): EventSource
+    // не переподключается сам, пока ждем - статистика обновляется запросами
+    eventSource.onerror = () => {
+        if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+            eventSource = null;
+            setTimeout(subscribeToEvents, 30000);
+        }
+    };
+}
+
+// Heartbeat: сервер закроет таймер, если окно закрыли и пинги прекратились
+async function sendHeartbeat() {
+    if (!currentActivity) return;
+    try {
+        const response = await fetch('/api/activity/heartbeat', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                user: JSON.stringify({ id: currentUser.telegram_id }),
+                activity_id: currentActivity.id
+            })
+        });
+        if (response.status === 404 || response.status === 409) {
+            // Активность уже завершена в боте или на другом устройстве
+            showActivityFinished();
+            return;
+        }
+        if (response.ok) {
+            const { interval } = await response.json();
+            if (heartbeatTimer && interval && interval * 1000 !== heartbeatInterval) {
+                heartbeatInterval = interval * 1000;
+                // Только новый интервал: этот пинг уже отправлен
+                clearInterval(heartbeatTimer);
+                heartbeatTimer = setInterval(sendHeartbeat, heartbeatInterval);
+            }
+        }
+    } catch (error) {
+        console.error('Error sending heartbeat:', error);
+    }
+}
+
+function startHeartbeat() {
+    if (heartbeatTimer) return;
+    // Первый пинг сразу: окно могут закрыть раньше, чем пройдет интервал
+    sendHeartbeat();
+    heartbeatTimer = setInterval(sendHeartbeat, heartbeatInterval);
+}
+
+function stopHeartbeat() {
+    if (heartbeatTimer) {
+        clearInterval(heartbeatTimer);
+        heartbeatTimer = null;
+    }
+}
+
+// Свернутое окно Telegram может пропускать интервалы - пингуем при возврате
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'visible') {
+        sendHeartbeat();
+    }
+});
+
 // Таймер
 function startTimer() {
     if (timer) return;
     
+    startHeartbeat();
+    
     timer = setInterval(() => {
         const now = new Date();
         const diff = now - startTime;
@@ -360,6 +527,7 @@ function startTimer() {
 }
 
 function stopTimer() {
+    stopHeartbeat();
     if (timer) {
         clearInterval(timer);
         timer = null;
@@ -453,6 +621,30 @@ async function updateBreakReminder(minutes) {
     }
 }
 
+// Отчеты по дням и неделям считаются в зоне пользователя: берем ее из браузера
+async function syncTimezone() {
+    const timezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
+    if (!timezone || !currentUser || !currentUser.telegram_id || currentUser.timezone === timezone) return;
+    try {
+        const response = await fetch('/api/settings/timezone', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                user: { id: currentUser.telegram_id },
+                timezone: timezone
+            })
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        currentUser.timezone = timezone;
+    } catch (error) {
+        console.error('Error updating timezone:', error);
+    }
+}
+
 // Уведомления
 function showNotification(message) {
     const notification = document.createElement('div');
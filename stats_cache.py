@@ -0,0 +1,218 @@
+"""Кеш вычисленной статистики (дневная, по категориям, тепловая карта, аналитика).
+
+Два уровня:
+- локальный LRU в памяти процесса;
+- общий (необязательный) SQLite-файл STATS_CACHE_PATH, который видят все
+  воркеры gunicorn на одной машине.
+
+Ключ включает вид статистики, telegram_id, User.data_version и параметры,
+поэтому после любой записи старые значения больше не читаются ни одним
+процессом. Дополнительно notify_user_changed вызывает invalidate(), чтобы
+сразу освободить место под записи пользователя в этом процессе и в общем
+файле. Значения хранятся в JSON, поэтому кешировать можно только то, что
+и так отдается клиенту.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from json_provider import dumps_bytes
+
+logger = logging.getLogger(__name__)
+
+LOCAL_SIZE = int(os.getenv('STATS_CACHE_SIZE', 2048))
+SHARED_PATH = os.getenv('STATS_CACHE_PATH')
+SHARED_MAX_ENTRIES = int(os.getenv('STATS_CACHE_SHARED_SIZE', 50000))
+SHARED_TTL = int(os.getenv('STATS_CACHE_TTL', 24 * 3600))
+PRUNE_EVERY = 500  # Записей в общий кеш между проверками его размера
+
+_MISSING = object()
+
+
+class SharedCache:
+    """Общий для процессов кеш в SQLite (WAL, отдельное соединение на поток)"""
+
+    def __init__(self, path, max_entries=SHARED_MAX_ENTRIES, ttl=SHARED_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stats_cache (
+                    key TEXT PRIMARY KEY,
+                    telegram_id INTEGER NOT NULL,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_stats_cache_user ON stats_cache (telegram_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_stats_cache_expires ON stats_cache (expires_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM stats_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return _MISSING if row is None else json.loads(row[0])
+
+    def set(self, key, telegram_id, value):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO stats_cache (key, telegram_id, value, expires_at) VALUES (?, ?, ?, ?)",
+            (key, telegram_id, dumps_bytes(value), time.time() + self.ttl)
+        )
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            return self.prune()
+        return 0
+
+    def invalidate(self, telegram_id):
+        self._connection().execute("DELETE FROM stats_cache WHERE telegram_id = ?", (telegram_id,))
+
+    def prune(self):
+        """Удаляет просроченные записи и самые старые сверх лимита; возвращает число удаленных"""
+        conn = self._connection()
+        removed = conn.execute("DELETE FROM stats_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        excess = conn.execute("SELECT count(*) FROM stats_cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            removed += conn.execute(
+                "DELETE FROM stats_cache WHERE key IN "
+                "(SELECT key FROM stats_cache ORDER BY expires_at LIMIT ?)", (excess,)
+            ).rowcount
+        return removed
+
+    def size(self):
+        return self._connection().execute("SELECT count(*) FROM stats_cache").fetchone()[0]
+
+
+class StatsCache:
+    def __init__(self, size=LOCAL_SIZE, shared_path=SHARED_PATH):
+        self.size = size
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.shared = None
+        if shared_path:
+            try:
+                self.shared = SharedCache(shared_path)
+            except sqlite3.Error as e:
+                logger.error(f"Shared stats cache disabled: {str(e)}")
+        self.metrics = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'local_evictions': 0,
+            'shared_evictions': 0,
+            'invalidations': 0,
+            'errors': 0,
+        }
+
+    @staticmethod
+    def make_key(kind, user, params=()):
+        return ':'.join([kind, str(user.telegram_id), str(user.data_version)] + [str(p) for p in params])
+
+    def lookup(self, kind, user, params=()):
+        """Значение из кеша или None"""
+        key = self.make_key(kind, user, params)
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                self._entries.move_to_end(key)
+                self.metrics['local_hits'] += 1
+                return entry
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except sqlite3.Error as e:
+                value = _MISSING
+                self.metrics['errors'] += 1
+                logger.error(f"Error reading shared stats cache: {str(e)}")
+            if value is not _MISSING:
+                self._store_local(key, user.telegram_id, value)
+                with self._lock:
+                    self.metrics['shared_hits'] += 1
+                return value
+
+        with self._lock:
+            self.metrics['misses'] += 1
+        return None
+
+    def store(self, kind, user, value, params=()):
+        """Записывает значение в оба уровня"""
+        key = self.make_key(kind, user, params)
+        self._store_local(key, user.telegram_id, value)
+        if self.shared is not None:
+            try:
+                removed = self.shared.set(key, user.telegram_id, value)
+            except sqlite3.Error as e:
+                self.metrics['errors'] += 1
+                logger.error(f"Error writing shared stats cache: {str(e)}")
+            else:
+                with self._lock:
+                    self.metrics['shared_evictions'] += removed
+        return value
+
+    def get_or_compute(self, kind, user, compute, params=()):
+        value = self.lookup(kind, user, params)
+        if value is None:
+            value = self.store(kind, user, compute(), params)
+        return value
+
+    def invalidate(self, telegram_id):
+        """Сбрасывает все записи пользователя (вызывается после записи его данных)"""
+        with self._lock:
+            for key in self._keys_by_user.pop(telegram_id, ()):
+                self._entries.pop(key, None)
+            self.metrics['invalidations'] += 1
+        if self.shared is not None:
+            try:
+                self.shared.invalidate(telegram_id)
+            except sqlite3.Error as e:
+                self.metrics['errors'] += 1
+                logger.error(f"Error invalidating shared stats cache: {str(e)}")
+
+    def _store_local(self, key, telegram_id, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(telegram_id, set()).add(key)
+            while len(self._entries) > self.size:
+                old_key, _ = self._entries.popitem(last=False)
+                old_user = int(old_key.split(':', 2)[1])
+                user_keys = self._keys_by_user.get(old_user)
+                if user_keys is not None:
+                    user_keys.discard(old_key)
+                    if not user_keys:
+                        del self._keys_by_user[old_user]
+                self.metrics['local_evictions'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics['local_size'] = len(self._entries)
+        lookups = metrics['local_hits'] + metrics['shared_hits'] + metrics['misses']
+        metrics['hit_rate'] = round((metrics['local_hits'] + metrics['shared_hits']) / lookups, 4) if lookups else None
+        if self.shared is not None:
+            try:
+                metrics['shared_size'] = self.shared.size()
+            except sqlite3.Error:
+                metrics['shared_size'] = None
+        return metrics
+
+
+stats_cache = StatsCache()
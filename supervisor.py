@@ -0,0 +1,183 @@
+"""Единая точка запуска: веб-воркеры и процесс бота под присмотром.
+
+    python supervisor.py            # веб + бот
+    python supervisor.py --web      # только веб (gunicorn)
+    python supervisor.py --bot      # только бот
+
+Перед запуском детей схема базы создается и докатывается один раз
+(init_db в отдельном процессе), а не при импорте приложения в каждом
+воркере. Веб запускается через gunicorn с WEB_CONCURRENCY воркерами (по умолчанию
+2 * CPU + 1, gthread). Приложение импортируется в каждом воркере после
+fork, а сами дочерние процессы стартуют через spawn, поэтому соединения с
+БД между процессами не делятся. SIGTERM/SIGINT пересылается детям:
+gunicorn дожидается текущих запросов (graceful_timeout), бот останавливает
+polling и дорабатывает полученные обновления. Упавший процесс
+перезапускается с экспоненциальной задержкой.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('supervisor')
+
+GRACEFUL_TIMEOUT = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+MAX_RESTART_DELAY = 60
+HEALTHY_UPTIME = 60  # После стольких секунд работы задержка перезапуска сбрасывается
+
+
+def default_workers():
+    return int(os.getenv('WEB_CONCURRENCY', (os.cpu_count() or 1) * 2 + 1))
+
+
+def run_web(workers, threads, bind):
+    """Процесс веб-сервера: gunicorn master со своими воркерами"""
+    from gunicorn.app.base import BaseApplication
+
+    # По числу потоков приложение выбирает лимит одновременных SSE-потоков
+    os.environ['WEB_THREADS'] = str(threads)
+
+    class WebServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            self.cfg.set('timeout', 120)
+            self.cfg.set('graceful_timeout', GRACEFUL_TIMEOUT)
+            self.cfg.set('preload_app', False)
+
+        def load(self):
+            # Воркер импортирует приложение после fork, сразу наполняет пул
+            # и запускает сброс heartbeat с поиском брошенных таймеров
+            from app import app, db, warm_pool
+            from heartbeat import heartbeats
+            warm_pool(app, db)
+            heartbeats.start()
+            return app
+
+    WebServer().run()
+
+
+def run_init_db():
+    """Одноразовый процесс: схема, миграции и backfill на всех шардах"""
+    from app import init_db
+    init_db()
+
+
+def run_bot():
+    """Процесс бота (polling под leader lock)"""
+    import bot
+    bot.main()
+
+
+class Child:
+    def __init__(self, name, target, args=()):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.process = None
+        self.started_at = 0
+        self.restart_delay = 1
+        self.restart_at = None
+
+    def start(self, context):
+        self.process = context.Process(target=self.target, args=self.args, name=self.name)
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        logger.info(f"Started {self.name} (pid {self.process.pid})")
+
+    def schedule_restart(self):
+        if time.monotonic() - self.started_at > HEALTHY_UPTIME:
+            self.restart_delay = 1
+        self.restart_at = time.monotonic() + self.restart_delay
+        logger.warning(f"{self.name} exited with code {self.process.exitcode}, restarting in {self.restart_delay}s")
+        self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+
+
+class Supervisor:
+    def __init__(self, children):
+        self.children = children
+        self.context = multiprocessing.get_context('spawn')
+        self.stopping = False
+
+    def handle_signal(self, signum, frame):
+        if not self.stopping:
+            logger.info(f"Received {signal.Signals(signum).name}, shutting down")
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+
+        for child in self.children:
+            child.start(self.context)
+
+        while not self.stopping:
+            for child in self.children:
+                if child.restart_at is not None:
+                    if time.monotonic() >= child.restart_at:
+                        child.start(self.context)
+                elif not child.process.is_alive():
+                    child.schedule_restart()
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def shutdown(self):
+        alive = [child for child in self.children if child.process is not None and child.process.is_alive()]
+        for child in alive:
+            os.kill(child.process.pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        for child in alive:
+            child.process.join(max(0, deadline - time.monotonic()))
+            if child.process.is_alive():
+                logger.warning(f"{child.name} did not stop in time, killing")
+                child.process.kill()
+                child.process.join()
+        logger.info("All processes stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Запуск веб-воркеров и бота')
+    parser.add_argument('--web', action='store_true', help='запустить только веб')
+    parser.add_argument('--bot', action='store_true', help='запустить только бота')
+    parser.add_argument('--no-init-db', action='store_true', help='не создавать и не докатывать схему перед запуском')
+    parser.add_argument('--workers', type=int, default=default_workers())
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', 32)))
+    parser.add_argument('--bind', default=f"0.0.0.0:{os.getenv('PORT', 8000)}")
+    args = parser.parse_args(argv)
+
+    run_all = not args.web and not args.bot
+    if not args.no_init_db:
+        init = multiprocessing.get_context('spawn').Process(target=run_init_db, name='init-db')
+        init.start()
+        init.join()
+        if init.exitcode != 0:
+            logger.error(f"Database initialization failed with code {init.exitcode}")
+            return 1
+    children = []
+    if args.web or run_all:
+        children.append(Child('web', run_web, (args.workers, args.threads, args.bind)))
+    if args.bot or run_all:
+        children.append(Child('bot', run_bot))
+
+    Supervisor(children).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Дельта-синхронизация для офлайн-клиентов: GET /api/sync?since=<token>.
+
+Клиент хранит непрозрачный токен из прошлого ответа и получает только
+строки, у которых updated_at больше отметки в токене, плюс tombstones
+удаленных строк. Выборки идут по индексам (user_id, updated_at), поэтому
+повторное открытие Mini App стоит несколько килобайт и range scan вместо
+полной выгрузки.
+
+Отметка нового токена берется на SYNC_OVERLAP раньше начала запроса:
+updated_at выставляется при flush, а строка становится видна только после
+commit, и запись из долгой транзакции иначе можно пропустить. Из-за этого
+часть строк приходит повторно - клиент применяет их как upsert по id.
+Активностей может быть много, поэтому они отдаются страницами по
+(updated_at, id); пока has_more, клиент сразу запрашивает следующую.
+"""
+import base64
+import json
+import logging
+from datetime import datetime, timedelta
+
+from models import Activity, Category, Tombstone, User
+from sharding import current_shard
+
+logger = logging.getLogger(__name__)
+
+SYNC_OVERLAP = timedelta(seconds=10)
+SYNC_PAGE_SIZE = 500
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+
+def encode_token(watermark, next_watermark=None, after=None):
+    # s - шард: после переноса пользователя id строк другие, нужна полная выгрузка
+    data = {'t': watermark.isoformat() if watermark else None, 's': current_shard()}
+    if after is not None:
+        # Середина выгрузки: отметка для следующей синхронизации и позиция страницы
+        data['n'] = next_watermark.isoformat()
+        data['a'] = [after[0].isoformat(), after[1]]
+    raw = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """(отметка, отметка следующего токена, позиция страницы); ValueError для поврежденного"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        watermark = datetime.fromisoformat(data['t']) if data['t'] else None
+        if data.get('s', 0) != current_shard():
+            return None, None, None
+        if 'a' not in data:
+            return watermark, None, None
+        after_time, after_id = data['a']
+        return watermark, datetime.fromisoformat(data['n']), (datetime.fromisoformat(after_time), int(after_id))
+    except (TypeError, KeyError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid sync token') from e
+
+
+def changes_since(db, user, token=None, limit=SYNC_PAGE_SIZE, now=None):
+    """Изменения пользователя после токена.
+
+    Возвращает dict с моделями (user - None, если не менялся), tombstones,
+    новым токеном, has_more и reset (токен слишком старый или его нет -
+    клиенту нужно заменить локальные данные целиком).
+    """
+    now = now or datetime.utcnow()
+    since, next_watermark, after = decode_token(token) if token else (None, None, None)
+    # Полная выгрузка начинается с первой страницы без токена
+    reset = since is None and after is None
+    if after is None and since is not None and since < now - TOMBSTONE_RETENTION:
+        # Tombstones старше срока хранения удалены - частичная синхронизация невозможна
+        since, next_watermark, after, reset = None, None, None, True
+    if next_watermark is None:
+        next_watermark = now - SYNC_OVERLAP
+
+    activities = Activity.query.filter(Activity.user_id == user.id)
+    if since is not None:
+        activities = activities.filter(Activity.updated_at > since)
+    if after is not None:
+        activities = activities.filter(db.tuple_(Activity.updated_at, Activity.id) > after)
+    activities = activities.order_by(Activity.updated_at, Activity.id).limit(limit + 1).all()
+
+    has_more = len(activities) > limit
+    if has_more:
+        activities = activities[:limit]
+        last = activities[-1]
+        new_token = encode_token(since, next_watermark, (last.updated_at, last.id))
+    else:
+        new_token = encode_token(next_watermark)
+
+    changes = {
+        'user': None,
+        'categories': [],
+        'activities': activities,
+        'tombstones': [],
+        'token': new_token,
+        'has_more': has_more,
+        'reset': reset,
+    }
+    if after is not None:
+        # Профиль, категории и удаления уже отданы первой страницей
+        return changes
+
+    if since is None or (user.updated_at is not None and user.updated_at > since):
+        changes['user'] = user
+    categories = Category.query.filter(Category.user_id == user.id)
+    if since is not None:
+        categories = categories.filter(Category.updated_at > since)
+    changes['categories'] = categories.order_by(Category.id).all()
+    if since is not None:
+        changes['tombstones'] = Tombstone.query.filter(
+            Tombstone.user_id == user.id,
+            Tombstone.deleted_at > since
+        ).order_by(Tombstone.deleted_at).all()
+    return changes
+
+
+def backfill_updated_at(db):
+    """updated_at = created_at для строк, созданных до появления колонки"""
+    updated = 0
+    with db.engine.begin() as conn:
+        for model in (User, Category, Activity):
+            table = model.__table__
+            updated += conn.execute(
+                table.update().where(table.c.updated_at.is_(None)).values(
+                    updated_at=db.func.coalesce(table.c.created_at, datetime.utcnow())
+                )
+            ).rowcount
+    if updated:
+        logger.info(f"Backfilled updated_at for {updated} rows")
+    return updated
+
+
+def prune_tombstones(db, retention=TOMBSTONE_RETENTION):
+    """Удаляет tombstones старше срока хранения"""
+    with db.engine.begin() as conn:
+        deleted = conn.execute(
+            Tombstone.__table__.delete().where(Tombstone.deleted_at < datetime.utcnow() - retention)
+        ).rowcount
+    if deleted:
+        logger.info(f"Pruned {deleted} tombstones")
+    return deleted
@@ -0,0 +1,251 @@
+"""Команды в групповых чатах: участники и общий отчет за период.
+
+Отчет по команде строится одним агрегирующим запросом по всем участникам
+(team_members -> users -> activities -> categories с GROUP BY участник и
+категория), а не статистикой каждого участника по отдельности. Результат
+кешируется в stats_cache по chat_id группы; версия ключа - data_version
+команды (вступления и выходы) и сумма data_version участников, поэтому
+любая запись участника делает старый отчет недостижимым.
+
+При шардировании команда и членство лежат на шарде каждого участника, а
+отчет складывается из отчетов шардов (sharded_team_report).
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from flask import current_app
+
+from models import Activity, Category, Team, TeamMember, User
+from sharding import enabled as sharding_enabled, fan_out
+from stats_cache import stats_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERIOD_DAYS = 7
+MAX_PERIOD_DAYS = 90
+GROUP_CHAT_TYPES = ('group', 'supergroup')
+
+
+class TeamCacheKey:
+    """Ключ команды для stats_cache в форме пользователя.
+
+    chat_id групп отрицательный и не пересекается с telegram_id пользователей.
+    """
+
+    def __init__(self, chat_id, version):
+        self.telegram_id = chat_id
+        self.data_version = version
+
+
+def parse_period(value):
+    """Число дней отчета из аргумента; ValueError для некорректного"""
+    if value is None:
+        return DEFAULT_PERIOD_DAYS
+    days = int(value)
+    if days < 1:
+        raise ValueError('Period must be positive')
+    return min(days, MAX_PERIOD_DAYS)
+
+
+def member_name(first_name, username, telegram_id):
+    if first_name:
+        return first_name
+    if username:
+        return f"@{username}"
+    return f"id{telegram_id}"
+
+
+def find_team(chat_id):
+    return Team.query.filter_by(chat_id=chat_id).first()
+
+
+def join_team(db, chat_id, title, user):
+    """Добавляет пользователя в команду чата (создает ее при первом вступлении).
+
+    Возвращает (команда, вступил ли только что).
+    """
+    team = find_team(chat_id)
+    if team is None:
+        team = Team(chat_id=chat_id, title=title)
+        db.session.add(team)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Команду этого чата одновременно создал другой участник
+            db.session.rollback()
+            team = Team.query.filter_by(chat_id=chat_id).one()
+    elif title and team.title != title:
+        team.title = title
+
+    if db.session.get(TeamMember, (team.id, user.id)) is not None:
+        db.session.commit()
+        return team, False
+    db.session.add(TeamMember(team_id=team.id, user_id=user.id))
+    team.data_version = Team.data_version + 1
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return team, False
+    return team, True
+
+
+def leave_team(db, chat_id, user):
+    """Удаляет пользователя из команды чата; False, если он в ней не состоял"""
+    team = find_team(chat_id)
+    if team is None:
+        return False
+    member = db.session.get(TeamMember, (team.id, user.id))
+    if member is None:
+        return False
+    db.session.delete(member)
+    team.data_version = Team.data_version + 1
+    db.session.commit()
+    return True
+
+
+def user_teams(user):
+    return Team.query.join(TeamMember, TeamMember.team_id == Team.id).filter(
+        TeamMember.user_id == user.id
+    ).order_by(Team.title).all()
+
+
+def is_member(db, team, user):
+    return db.session.get(TeamMember, (team.id, user.id)) is not None
+
+
+def member_versions(db, team):
+    """Сумма data_version участников - один запрос по индексу team_members"""
+    return db.session.query(db.func.coalesce(db.func.sum(User.data_version), 0)).join(
+        TeamMember, TeamMember.user_id == User.id
+    ).filter(TeamMember.team_id == team.id).scalar()
+
+
+def team_report(db, team, days, today=None):
+    """Минуты и число активностей по участникам и категориям за последние days дней (UTC)"""
+    today = today or datetime.utcnow().date()
+    since = datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+    rows = db.session.query(
+        User.id,
+        User.telegram_id,
+        User.first_name,
+        User.username,
+        Category.name,
+        db.func.coalesce(db.func.sum(Activity.duration), 0),
+        db.func.count(Activity.id)
+    ).select_from(TeamMember).join(
+        User, User.id == TeamMember.user_id
+    ).outerjoin(
+        Activity,
+        (Activity.user_id == User.id) & (Activity.start_time >= since) & Activity.duration.isnot(None)
+    ).outerjoin(
+        Category, Category.id == Activity.category_id
+    ).filter(
+        TeamMember.team_id == team.id
+    ).group_by(
+        User.id, User.telegram_id, User.first_name, User.username, Category.name
+    ).all()
+
+    members = {}
+    categories = {}
+    for user_id, telegram_id, first_name, username, category, seconds, count in rows:
+        member = members.get(user_id)
+        if member is None:
+            member = members[user_id] = {
+                'id': user_id,
+                'name': member_name(first_name, username, telegram_id),
+                'total_time': 0,
+                'total_tasks': 0,
+                'categories': {}
+            }
+        if category is None:
+            continue
+        member['total_time'] += seconds
+        member['total_tasks'] += count
+        member['categories'][category] = member['categories'].get(category, 0) + seconds
+        totals = categories.setdefault(category, {'name': category, 'total_time': 0, 'total_tasks': 0})
+        totals['total_time'] += seconds
+        totals['total_tasks'] += count
+
+    return {
+        'team': {'chat_id': team.chat_id, 'title': team.title},
+        'days': days,
+        'since': since.date().isoformat(),
+        'total_time': sum(member['total_time'] for member in members.values()),
+        'total_tasks': sum(member['total_tasks'] for member in members.values()),
+        'members': sorted(members.values(), key=lambda member: -member['total_time']),
+        'categories': sorted(categories.values(), key=lambda category: -category['total_time'])
+    }
+
+
+def get_team_report(db, team, days=DEFAULT_PERIOD_DAYS):
+    today = datetime.utcnow().date()
+    if sharding_enabled():
+        return sharded_team_report(db, team.chat_id, days, today)
+    key = TeamCacheKey(team.chat_id, f"{team.data_version}.{member_versions(db, team)}")
+    return stats_cache.get_or_compute(
+        'team', key, lambda: team_report(db, team, days, today), (days, today)
+    )
+
+
+def sharded_team_report(db, chat_id, days, today):
+    """Отчет команды, участники которой живут на разных шардах.
+
+    Команда и членство хранятся на шарде каждого участника. Версия
+    собирается со всех шардов (один короткий запрос на шард), а при промахе
+    кеша отчеты шардов считаются параллельно и складываются.
+    """
+    app = current_app._get_current_object()
+
+    def shard_version(shard):
+        team = find_team(chat_id)
+        return f"{team.data_version}.{member_versions(db, team)}" if team else '-'
+
+    def shard_report(shard):
+        team = find_team(chat_id)
+        return team_report(db, team, days, today) if team else None
+
+    def compute():
+        return merge_reports([report for report in fan_out(app, shard_report) if report])
+
+    key = TeamCacheKey(chat_id, '|'.join(fan_out(app, shard_version)))
+    return stats_cache.get_or_compute('team', key, compute, (days, today))
+
+
+def merge_reports(reports):
+    """Сумма отчетов одной команды с разных шардов"""
+    merged = dict(reports[0], members=[], categories=[])
+    categories = {}
+    for report in reports:
+        merged['members'].extend(report['members'])
+        for category in report['categories']:
+            totals = categories.setdefault(category['name'], dict(category, total_time=0, total_tasks=0))
+            totals['total_time'] += category['total_time']
+            totals['total_tasks'] += category['total_tasks']
+    merged['total_time'] = sum(report['total_time'] for report in reports)
+    merged['total_tasks'] = sum(report['total_tasks'] for report in reports)
+    merged['members'].sort(key=lambda member: -member['total_time'])
+    merged['categories'] = sorted(categories.values(), key=lambda category: -category['total_time'])
+    return merged
+
+
+def format_report(report, limit=20):
+    """Текст отчета для группового чата"""
+    title = report['team']['title'] or 'Команда'
+    message = f"Команда «{title}» за {report['days']} дн.:\n"
+    message += f"Всего: {report['total_time'] / 3600:.1f} ч, активностей: {report['total_tasks']}\n"
+
+    if report['members']:
+        message += "\nУчастники:\n"
+        for member in report['members'][:limit]:
+            message += f"- {member['name']}: {member['total_time'] / 3600:.1f} ч ({member['total_tasks']})\n"
+        if len(report['members']) > limit:
+            message += f"...и еще {len(report['members']) - limit}\n"
+
+    if report['categories']:
+        message += "\nКатегории:\n"
+        for category in report['categories']:
+            message += f"- {category['name']}: {category['total_time'] / 3600:.1f} ч\n"
+    return message
@@ -0,0 +1,83 @@
+"""Завершение активности - единое для Flask, ASGI и бота.
+
+Длительность в секундах сохраняется в activities.duration при каждом
+завершении, поэтому статистика считается в базе простым SUM(duration),
+без разбора start_time/end_time в Python. Строки, завершенные до появления
+этого модуля, дозаполняет backfill_durations при init_db().
+"""
+import logging
+from datetime import datetime
+
+import pytz
+from sqlalchemy import Integer, cast, func, update
+
+from dialect import seconds_between
+from models import Activity
+
+logger = logging.getLogger(__name__)
+
+XP_PER_MINUTE = 1
+
+
+class AlreadyFinished(Exception):
+    """Повторное завершение: XP и длительность уже начислены"""
+
+
+def utc_naive(value):
+    """datetime в UTC без tzinfo - так время хранится в колонках DateTime"""
+    if value.tzinfo is not None:
+        value = value.astimezone(pytz.UTC).replace(tzinfo=None)
+    return value
+
+
+def finish_activity(activity, user, productivity=None, notes=None, now=None):
+    """Закрывает активность, сохраняет длительность и начисляет XP.
+
+    Commit и notify_user_changed остаются за вызывающим кодом (сессии у
+    Flask и ASGI разные). Возвращает (начисленный XP, повышен ли уровень).
+    Уже завершенную активность не трогает - AlreadyFinished.
+    """
+    if activity.end_time is not None:
+        raise AlreadyFinished(f"Activity {activity.id} is already finished")
+    end_time = utc_naive(now or datetime.now(pytz.UTC))
+    start_time = utc_naive(activity.start_time)
+    activity.end_time = end_time
+    activity.duration = max(0, int((end_time - start_time).total_seconds()))
+    if productivity is not None:
+        activity.productivity = productivity
+    if notes is not None:
+        activity.notes = notes
+
+    xp = activity.duration // 60 * XP_PER_MINUTE
+    user.xp = (user.xp or 0) + xp
+    leveled_up = user.calculate_level()
+    user.touch()
+    return xp, leveled_up
+
+
+def finished_payload(activity):
+    return {
+        'id': activity.id,
+        'end_time': pytz.UTC.localize(activity.end_time).isoformat(),
+        'duration': activity.duration
+    }
+
+
+def backfill_durations(db):
+    """Заполняет duration у завершенных активностей, где его нет, одним UPDATE"""
+    engine = db.engine
+    seconds = seconds_between(engine.dialect.name, Activity.start_time, Activity.end_time)
+    # В SQLite скалярный max() с несколькими аргументами - аналог greatest()
+    clamp = func.greatest if engine.dialect.name == 'postgresql' else func.max
+    statement = update(Activity).where(
+        Activity.duration.is_(None),
+        Activity.end_time.isnot(None)
+    ).values(
+        # round: julianday в SQLite дает погрешность в доли миллисекунды
+        duration=clamp(cast(func.round(seconds), Integer), 0)
+    )
+    with engine.begin() as conn:
+        updated = conn.execute(statement).rowcount
+    if updated:
+        logger.info(f"Backfilled duration for {updated} activities")
+    return updated